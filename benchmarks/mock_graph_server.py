@@ -0,0 +1,190 @@
+import gzip
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+LIST_ITEMS_PATH = re.compile(r"^/v1\.0/sites/[^/]+/lists/[^/]+/items$")
+UPLOAD_SESSION_PATH = re.compile(r"^/v1\.0/drives/[^/]+/items/.+/createUploadSession$")
+UPLOAD_PATH = re.compile(r"^/upload/(\d+)$")
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class MockGraphConfig(object):
+    """
+    Behaviour of the stand-in Graph server.
+    latency: seconds added to every request, plus latency_per_sub_request for each $batch sub-request.
+    number_of_items / max_page_size: size of the list returned by the list items endpoint and of its pages.
+    throttle_every: every n-th request, or $batch sub-request, is answered 429 with retry_after seconds.
+    """
+    def __init__(self, latency=0.0, latency_per_sub_request=0.0, number_of_items=1000, max_page_size=200,
+                 throttle_every=0, retry_after=0):
+        self.latency = latency
+        self.latency_per_sub_request = latency_per_sub_request
+        self.number_of_items = number_of_items
+        self.max_page_size = max_page_size
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+
+
+class MockGraphServer(object):
+    def __init__(self, config=None):
+        self.config = config or MockGraphConfig()
+        self.lock = threading.Lock()
+        self.request_counter = 0
+        self.upload_counter = 0
+        self.uploads = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), get_handler_class(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_base_url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def get_endpoint_url(self):
+        return "{}/v1.0".format(self.get_base_url())
+
+    def is_throttled(self):
+        if not self.config.throttle_every:
+            return False
+        with self.lock:
+            self.request_counter += 1
+            return self.request_counter % self.config.throttle_every == 0
+
+    def get_list_items_page(self, query, url):
+        parameters = urllib.parse.parse_qs(query)
+        top = int(parameters.get("$top", [self.config.max_page_size])[0])
+        page_size = min(top, self.config.max_page_size)
+        start = int(parameters.get("$skiptoken", [0])[0])
+        end = min(start + page_size, self.config.number_of_items)
+        page = {
+            "value": [
+                {"id": "{}".format(item_id), "fields": {"Title": "Item {}".format(item_id), "Number": item_id}}
+                for item_id in range(start + 1, end + 1)
+            ]
+        }
+        if end < self.config.number_of_items:
+            next_parameters = dict((key, values[0]) for key, values in parameters.items())
+            next_parameters["$skiptoken"] = end
+            page["@odata.nextLink"] = "{}?{}".format(url, urllib.parse.urlencode(next_parameters))
+        return page
+
+    def create_upload_session(self):
+        with self.lock:
+            self.upload_counter += 1
+            upload_id = self.upload_counter
+            self.uploads[upload_id] = 0
+        return {
+            "uploadUrl": "{}/upload/{}".format(self.get_base_url(), upload_id),
+            "expirationDateTime": "2099-01-01T00:00:00Z",
+            "nextExpectedRanges": ["0-"]
+        }
+
+    def write_upload_range(self, upload_id, content_range, size):
+        start, end, file_size = [int(value) for value in CONTENT_RANGE.match(content_range).groups()]
+        with self.lock:
+            if upload_id not in self.uploads or start != self.uploads[upload_id] or end - start + 1 != size:
+                return 416, {"error": {"code": "invalidRange", "message": "Unexpected range {}".format(content_range)}}
+            self.uploads[upload_id] = end + 1
+            if end + 1 < file_size:
+                return 202, {"nextExpectedRanges": ["{}-".format(end + 1)]}
+            del self.uploads[upload_id]
+        return 201, {"id": "file-{}".format(upload_id), "size": file_size}
+
+
+def get_handler_class(mock_server):
+    class MockGraphHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status_code, json_response, headers=None):
+            body = json.dumps(json_response).encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "{}".format(len(body)))
+            for header_name, header_value in (headers or {}).items():
+                self.send_header(header_name, header_value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            return body
+
+        def send_throttled(self):
+            self.send_json(
+                429,
+                {"error": {"code": "TooManyRequests", "message": "Too many requests"}},
+                headers={"Retry-After": "{}".format(mock_server.config.retry_after)}
+            )
+
+        def do_GET(self):
+            time.sleep(mock_server.config.latency)
+            path, _, query = self.path.partition("?")
+            if mock_server.is_throttled():
+                return self.send_throttled()
+            if LIST_ITEMS_PATH.match(path):
+                url = "{}{}".format(mock_server.get_base_url(), path)
+                return self.send_json(200, mock_server.get_list_items_page(query, url))
+            self.send_json(404, {"error": {"code": "itemNotFound", "message": "No route for {}".format(path)}})
+
+        def do_POST(self):
+            body = self.read_body()
+            path = self.path.partition("?")[0]
+            if path == "/v1.0/$batch":
+                return self.send_batch_response(json.loads(body))
+            time.sleep(mock_server.config.latency)
+            if mock_server.is_throttled():
+                return self.send_throttled()
+            if LIST_ITEMS_PATH.match(path):
+                return self.send_json(201, {"id": "1", "fields": json.loads(body).get("fields", {})})
+            if UPLOAD_SESSION_PATH.match(path):
+                return self.send_json(200, mock_server.create_upload_session())
+            self.send_json(404, {"error": {"code": "itemNotFound", "message": "No route for {}".format(path)}})
+
+        def do_PUT(self):
+            body = self.read_body()
+            time.sleep(mock_server.config.latency)
+            upload_match = UPLOAD_PATH.match(self.path)
+            if not upload_match:
+                return self.send_json(404, {"error": {"code": "itemNotFound", "message": "No route"}})
+            if mock_server.is_throttled():
+                return self.send_throttled()
+            status_code, json_response = mock_server.write_upload_range(
+                int(upload_match.group(1)), self.headers.get("Content-Range"), len(body)
+            )
+            self.send_json(status_code, json_response)
+
+        def send_batch_response(self, batch):
+            requests = batch.get("requests", [])
+            time.sleep(mock_server.config.latency + mock_server.config.latency_per_sub_request * len(requests))
+            responses = []
+            for request in requests:
+                if mock_server.is_throttled():
+                    responses.append({
+                        "id": request.get("id"),
+                        "status": 429,
+                        "headers": {"Retry-After": "{}".format(mock_server.config.retry_after)},
+                        "body": {"error": {"code": "TooManyRequests", "message": "Too many requests"}}
+                    })
+                else:
+                    responses.append({"id": request.get("id"), "status": 201, "body": {"id": request.get("id")}})
+            self.send_json(200, {"responses": responses})
+
+    return MockGraphHandler
@@ -0,0 +1,194 @@
+"""
+Runs the plugin's client against the local stand-in Graph server and reports throughput and latency percentiles.
+
+    PYTHONPATH=python-lib python3 benchmarks/run_benchmarks.py --latency 0.02 --throttle-every 50 --output bench.json
+
+With --compare, the throughputs are checked against a previous output, such as the committed benchmarks/baseline.json
+(run with the default arguments), and the run fails if one of them dropped by more than --max-regression.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python-lib"))
+
+from mock_graph_server import MockGraphServer, MockGraphConfig  # noqa: E402
+from office365_client import Office365Session, Office365ListWriter  # noqa: E402
+from office365_metrics import Office365Metrics  # noqa: E402
+from office365_throttling import Office365ThrottlingGovernor  # noqa: E402
+
+
+class RecordingMetrics(Office365Metrics):
+    # Keeps every latency, the percentiles cannot be computed from the histogram buckets
+    def reset(self):
+        super(RecordingMetrics, self).reset()
+        self.latencies = []
+
+    def record_request(self, method, url, status_code, latency, bytes_sent=0, bytes_received=0):
+        super(RecordingMetrics, self).record_request(
+            method, url, status_code, latency, bytes_sent=bytes_sent, bytes_received=bytes_received
+        )
+        with self.lock:
+            self.latencies.append(latency)
+
+
+def get_session(server, metrics, arguments):
+    # A governor of its own, so that the benchmarks do not slow each other down
+    governor = Office365ThrottlingGovernor(
+        initial_rate=arguments.rate, max_rate=arguments.rate, burst=arguments.rate
+    )
+    return Office365Session(
+        access_token="benchmark",
+        governor=governor,
+        metrics=metrics,
+        endpoint_url=server.get_endpoint_url(),
+        compress_requests=arguments.compress
+    )
+
+
+def benchmark_list_write(server, metrics, arguments):
+    session = get_session(server, metrics, arguments)
+    benchmark_list = session.get_site("benchmark-site").get_list("benchmark-list")
+    schema = {"columns": [
+        {"name": "Title", "type": "string"},
+        {"name": "Number", "type": "bigint"},
+        {"name": "Price", "type": "double"},
+        {"name": "Description", "type": "string"}
+    ]}
+    writer = Office365ListWriter(benchmark_list, schema, max_workers=arguments.max_workers)
+    description = "x" * arguments.row_text_size
+    for row_number in range(arguments.rows):
+        writer.write_row(["Row {}".format(row_number), row_number, row_number * 1.5, description])
+    writer.close()
+    return arguments.rows, "rows"
+
+
+def benchmark_list_read(server, metrics, arguments):
+    session = get_session(server, metrics, arguments)
+    benchmark_list = session.get_site("benchmark-site").get_list("benchmark-list")
+    number_of_rows = 0
+    for row in benchmark_list.get_next_row(page_size=arguments.page_size):
+        number_of_rows += 1
+    return number_of_rows, "rows"
+
+
+def benchmark_file_upload(server, metrics, arguments):
+    session = get_session(server, metrics, arguments)
+    drive = session.get_drive("benchmark-drive")
+    content = os.urandom(arguments.file_size)
+    upload_session = drive.create_upload_session_for_path("root", "benchmark.bin")
+    drive.write_chunked_file_content(upload_session.get("uploadUrl"), content, chunk_size=arguments.chunk_size)
+    return arguments.file_size / 1048576.0, "MB"
+
+
+BENCHMARKS = {
+    "list_write": benchmark_list_write,
+    "list_read": benchmark_list_read,
+    "file_upload": benchmark_file_upload
+}
+
+
+def run_benchmark(name, arguments):
+    config = MockGraphConfig(
+        latency=arguments.latency,
+        latency_per_sub_request=arguments.latency_per_sub_request,
+        number_of_items=arguments.rows,
+        max_page_size=arguments.server_page_size,
+        throttle_every=arguments.throttle_every,
+        retry_after=0
+    )
+    server = MockGraphServer(config).start()
+    metrics = RecordingMetrics()
+    try:
+        started_at = time.monotonic()
+        quantity, unit = BENCHMARKS[name](server, metrics, arguments)
+        elapsed = time.monotonic() - started_at
+    finally:
+        server.stop()
+    snapshot = metrics.get_snapshot()
+    latencies = sorted(metrics.latencies)
+    return {
+        "benchmark": name,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput": round(quantity / elapsed, 2) if elapsed else None,
+        "throughput_unit": "{}/s".format(unit),
+        "requests": snapshot.get("requests"),
+        "retries": snapshot.get("retries"),
+        "throttled": snapshot.get("throttled"),
+        "bytes_sent": snapshot.get("bytes_sent"),
+        "batch_fill_ratio": round(snapshot.get("batch_fill_ratio"), 3),
+        "p50_latency_ms": round(get_percentile(latencies, 50) * 1000, 2),
+        "p99_latency_ms": round(get_percentile(latencies, 99) * 1000, 2)
+    }
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0.0
+    index = int(round((len(sorted_values) - 1) * percentile / 100.0))
+    return sorted_values[index]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the SharePoint client against a local stand-in Graph server")
+    parser.add_argument("--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=2000, help="Rows written and read")
+    parser.add_argument("--row-text-size", type=int, default=100, help="Size of the text column of each written row")
+    parser.add_argument("--page-size", type=int, default=999, help="$top asked by the reads")
+    parser.add_argument("--server-page-size", type=int, default=200, help="Largest page returned by the server")
+    parser.add_argument("--file-size", type=int, default=32 * 1048576)
+    parser.add_argument("--chunk-size", type=int, default=5 * 1048576)
+    parser.add_argument("--max-workers", type=int, default=None, help="$batch sent concurrently")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds added by the server to each request")
+    parser.add_argument("--latency-per-sub-request", type=float, default=0.001)
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer 429 to every n-th request")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second allowed by the governor, "
+                        "the plugin's default when omitted")
+    parser.add_argument("--compress", action="store_true", help="Gzip the large request bodies")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="JSON output of a previous run the throughputs are compared to")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Largest throughput drop allowed by --compare, as a fraction of the previous throughput")
+    return parser.parse_args()
+
+
+def main():
+    arguments = get_arguments()
+    results = [run_benchmark(name, arguments) for name in arguments.benchmarks]
+    for result in results:
+        print(
+            "{benchmark:<12} {throughput:>10} {throughput_unit:<7} p50 {p50_latency_ms:>8}ms  p99 {p99_latency_ms:>8}ms  "
+            "{requests} requests, {retries} retries, $batch {batch_fill_ratio:.0%} full".format(**result)
+        )
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if arguments.compare:
+        with open(arguments.compare, "r") as baseline_file:
+            baseline_results = json.load(baseline_file)
+        regressions = get_regressions(results, baseline_results, arguments.max_regression)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            sys.exit(1)
+
+
+def get_regressions(results, baseline_results, max_regression):
+    # Benchmarks missing from the baseline are not compared
+    baseline_throughputs = dict((result.get("benchmark"), result.get("throughput")) for result in baseline_results)
+    regressions = []
+    for result in results:
+        baseline_throughput = baseline_throughputs.get(result.get("benchmark"))
+        if not baseline_throughput or result.get("throughput") is None:
+            continue
+        if result.get("throughput") < baseline_throughput * (1 - max_regression):
+            regressions.append("{} regressed: {} {}, {} in the baseline".format(
+                result.get("benchmark"), result.get("throughput"), result.get("throughput_unit"), baseline_throughput
+            ))
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import dataiku
+from dataiku.llm.agent_tools import BaseAgentTool
+from safe_logger import SafeLogger
+from office365_client import Office365Session
+from office365_commons import get_bounded_records_limit
+from sharepoint_constants import SharePointConstants
+
+logger = SafeLogger("sharepoint-tool plugin")
+
+
+class QuerySharePointListTool(BaseAgentTool):
+
+    def set_config(self, config, plugin_config):
+        logger.info('SharePoint Online plugin list query tool v{}'.format("0.0.3"))
+
+        connection_name = config.get("sharepoint_connection")
+        client = dataiku.api_client()
+        self.connection = client.get_connection(connection_name)
+        sharepoint_url = config.get("sharepoint_url")
+        self.max_records = max(1, config.get("max_records") or SharePointConstants.QUERY_TOOL_MAX_RECORDS)
+        self.allow_non_indexed_filter = config.get("allow_non_indexed_filter", False)
+
+        # The token is fetched again from the connection whenever it is about to expire
+        session = Office365Session(token_provider=self.get_access_token, credentials_identity=connection_name)
+        site_id, list_id = session.extract_site_list_from_url(sharepoint_url)
+        site = session.get_site(site_id)
+        self.list = site.get_list(list_id)
+
+    def get_access_token(self):
+        connection_info = self.connection.get_info()
+        credentials = connection_info.get_oauth2_credential()
+        return credentials.get("accessToken")
+
+    def get_visible_columns(self):
+        return [
+            sharepoint_column for sharepoint_column in self.list.get_cached_columns()
+            if not sharepoint_column.get("hidden")
+        ]
+
+    def get_descriptor(self, tool):
+        columns_description = []
+        for sharepoint_column in self.get_visible_columns():
+            column_description = "- {} ({})".format(sharepoint_column.get("name"), sharepoint_column.get("displayName"))
+            if sharepoint_column.get("description"):
+                column_description += ": {}".format(sharepoint_column.get("description"))
+            columns_description.append(column_description)
+        return {
+            "description": "This tool reads items from a SharePoint Online list. The filtering, the column selection and the limit are applied by SharePoint, so ask only for what is needed. The list has the following columns:\n{}".format(
+                "\n".join(columns_description)
+            ),
+            "inputSchema": {
+                "$id": "https://dataiku.com/agents/tools/search/input",
+                "title": "Query a SharePoint Online list tool",
+                "type": "object",
+                "properties": {
+                    "filter": {
+                        "type": "string",
+                        "description": "OData filter on the columns, prefixed with fields/, e.g. \"fields/Status eq 'Open' and fields/Priority gt 2\""
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Names of the columns to return, all the visible columns if omitted"
+                    },
+                    "order_by": {
+                        "type": "string",
+                        "description": "Column to sort on, prefixed with fields/ and optionally followed by desc, e.g. \"fields/Modified desc\""
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "maximum": self.max_records,
+                        "description": "Maximum number of items to return, at most {}".format(self.max_records)
+                    }
+                }
+            }
+        }
+
+    def invoke(self, input, trace):
+        query = input.get("input", {})
+        visible_column_names = [sharepoint_column.get("name") for sharepoint_column in self.get_visible_columns()]
+        columns = [column for column in query.get("columns") or [] if column in visible_column_names]
+        records_limit = get_bounded_records_limit(query.get("limit"), self.max_records)
+        rows = []
+        # A stuck Graph call must not stall the agent
+        with self.list.session.deadline(SharePointConstants.TOOL_INVOKE_DEADLINE_SEC):
+            for row in self.list.get_next_row(
+                columns=columns or visible_column_names,
+                filter=query.get("filter"),
+                order_by=query.get("order_by"),
+                allow_non_indexed_filter=self.allow_non_indexed_filter,
+                records_limit=records_limit
+            ):
+                rows.append(row.get("fields", {}))
+        logger.info("{} items read from the list".format(len(rows)))
+
+        return {
+            "output": rows
+        }
@@ -1,7 +1,9 @@
+import time
 import dataiku
 from dataiku.llm.agent_tools import BaseAgentTool
 from safe_logger import SafeLogger
-from office365_client import Office365Session, Office365ListWriter
+from office365_client import Office365Session
+from sharepoint_constants import SharePointConstants
 
 logger = SafeLogger("sharepoint-tool plugin")
 
@@ -13,24 +15,26 @@ class WriteToSharePointListTool(BaseAgentTool):
 
         connection_name = config.get("sharepoint_connection")
         client = dataiku.api_client()
-        connection = client.get_connection(connection_name)
-        connection_info = connection.get_info()
-        credentials = connection_info.get_oauth2_credential()
-        sharepoint_access_token = credentials.get("accessToken")
+        self.connection = client.get_connection(connection_name)
         sharepoint_url = config.get("sharepoint_url")
 
-        session = Office365Session(access_token=sharepoint_access_token)
+        # The token is fetched again from the connection whenever it is about to expire
+        session = Office365Session(token_provider=self.get_access_token, credentials_identity=connection_name)
         site_id, list_id = session.extract_site_list_from_url(sharepoint_url)
         site = session.get_site(site_id)
         self.list = site.get_list(list_id)
         self.output_schema = None
 
+    def get_access_token(self):
+        connection_info = self.connection.get_info()
+        credentials = connection_info.get_oauth2_credential()
+        return credentials.get("accessToken")
+
     def get_descriptor(self, tool):
         output_columns = []
         properties = {}
         required = []
-        for sharepoint_column in self.list.get_columns():
-            column_description = sharepoint_column.get("description")
+        for sharepoint_column in self.list.get_cached_columns():
             column_description = sharepoint_column.get("description")
             if column_description:
                 properties[sharepoint_column.get("name")] = {
@@ -57,15 +61,14 @@ class WriteToSharePointListTool(BaseAgentTool):
         }
 
     def invoke(self, input, trace):
-        sharepoint_writer = Office365ListWriter(
-            self.list,
-            self.output_schema,
-            write_from_dict=True
-        )
         row = input.get("input", {})
-        sharepoint_writer.write_row(row)
-        sharepoint_writer.close()
+        # A stuck Graph call must not stall the agent
+        with self.list.session.deadline(SharePointConstants.TOOL_INVOKE_DEADLINE_SEC):
+            # Rows from concurrent calls are sent together in the same $batch
+            write_queue = self.list.session.get_list_write_queue(self.list)
+            future = write_queue.write_row(row, deadline_at=self.list.session.get_deadline_at(time.monotonic()))
+            created_item = future.result(timeout=SharePointConstants.TOOL_INVOKE_DEADLINE_SEC)
 
         return {
-            "output": 'The record was added on the "{}" SharePoint list'.format(self.list)
+            "output": 'The record was added on the "{}" SharePoint list with id {}'.format(self.list, created_item.get("id"))
         }
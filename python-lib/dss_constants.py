@@ -5,16 +5,24 @@ class DSSConstants(object):
     AUTH_OAUTH = "oauth"
     AUTH_SITE_APP = "site-app-permissions"
     CHILDREN = 'children'
+    DATAFRAME_CHUNK_SIZE = 10000
     DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+    DATE_TYPES = ["date"]
+    DEFAULT_ASYNC_MAX_CONNECTIONS = 100
+    DEFAULT_BATCH_MAX_WORKERS = 4
     DEFAULT_BATCH_SIZE = 19
+    DEFAULT_DOWNLOAD_MAX_WORKERS = 4
     DIRECTORY = 'directory'
     EXISTS = 'exists'
     FALLBACK_TYPE = "string"
+    FLOAT_TYPES = ["float", "double"]
     FULL_PATH = 'fullPath'
+    GRAPH_ENDPOINT_URL = "https://graph.microsoft.com/v1.0"
+    GZIP_COMPRESS_LEVEL = 6
     GZIP_HEADERS = {
-        "Content-Encoding": "gzip",
         "Accept-Encoding": "gzip"
     }
+    INTEGER_TYPES = ["tinyint", "smallint", "int", "bigint"]
     IS_DIRECTORY = 'isDirectory'
     JSON_HEADERS = {
         "Content-Type": APPLICATION_JSON,
@@ -27,6 +35,9 @@ class DSSConstants(object):
         "sharepoint_username": "The account's username is missing",
         "sharepoint_password": "The account's password is missing"
     }
+    MAX_BATCH_BYTES = 3145728
+    MAX_BATCH_SIZE = 20
+    MAX_LIST_ITEMS_PAGE_SIZE = 999
     OAUTH_DETAILS = {
         "sharepoint_tenant": "The tenant name is missing",
         "sharepoint_site": "The site name is missing",
@@ -0,0 +1,498 @@
+import asyncio
+import time
+import urllib.parse
+import httpx
+from safe_logger import SafeLogger
+from office365_site import Office365SiteUrls
+from office365_list import Office365ListUrls, get_list_items_params, get_list_items_headers
+from office365_drive import Office365DriveUrls
+from office365_throttling import get_default_governor, Office365BatchSizer, get_batch_request_bytes
+from office365_client import assert_responses_ok
+from office365_auth import Office365Auth
+from office365_metrics import get_default_metrics, get_body_size
+from office365_transport import (
+    Office365TransportConfig, get_deadline_at, get_remaining_time, check_wait_within_deadline
+)
+from office365_commons import (
+    get_next_page_url, get_error, is_throttling, get_retry_after_value,
+    is_retryable_batch_response, is_throttling_batch_response, get_batch_response_retry_after,
+    get_compressed_request_kwargs, RecordsLimit
+)
+from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
+
+
+logger = SafeLogger("office-365 plugin", [])
+
+
+class AsyncOffice365Session(object):
+    """
+    asyncio counterpart of Office365Session, built on httpx.AsyncClient.
+    Same surface, but request / get_item / flush / close are coroutines and get_next_item is an async generator.
+    Its sites, lists and drives only share the URL builders of the sync classes, and only expose the calls defined below.
+    """
+    def __init__(self, access_token=None, governor=None, max_connections=None,
+                 compress_requests=False, compression_min_size=None, transport_config=None, token_provider=None,
+                 metrics=None, endpoint_url=None, transport=None):
+        # transport replaces the network layer of the httpx client, for instance with an httpx.MockTransport
+        self.metrics = metrics or get_default_metrics()
+        self.endpoint_url = endpoint_url or DSSConstants.GRAPH_ENDPOINT_URL
+        self.auth = Office365Auth(access_token=access_token, token_provider=token_provider)
+        self.compress_requests = compress_requests
+        self.compression_min_size = compression_min_size
+        self.transport_config = transport_config or Office365TransportConfig()
+        max_connections = max_connections or DSSConstants.DEFAULT_ASYNC_MAX_CONNECTIONS
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections if self.transport_config.keep_alive else 0,
+                keepalive_expiry=self.transport_config.keep_alive_idle
+            ),
+            timeout=self.get_timeout(),
+            transport=transport
+        )
+        self.governor = governor or get_default_governor()
+        self.is_batch_mode = False
+        self.requests_buffer = []
+        self.requests_buffer_bytes = 0
+        self.batch_sizer = Office365BatchSizer()
+        self.batch_max_workers = 1
+        self.pending_batches = []
+        self.batch_counter = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def request(self, **kwargs):
+        raise_on = kwargs.pop("raise_on", {})
+        cannot_raise = kwargs.pop("cannot_raise", False)
+        force_no_batch = kwargs.pop("force_no_batch", False)
+
+        if self.is_batch_mode and not force_no_batch:
+            request_bytes = get_batch_request_bytes(kwargs)
+            if self.requests_buffer and self.batch_sizer.would_overflow(self.requests_buffer_bytes, request_bytes):
+                await self.dispatch_batch()
+            self.requests_buffer.append(kwargs)
+            self.requests_buffer_bytes += request_bytes
+            if self.batch_sizer.is_full(len(self.requests_buffer), self.requests_buffer_bytes):
+                await self.dispatch_batch()
+            return
+
+        response = await self.send_with_governor(**kwargs)
+        error_message = get_error(response)
+        if raise_on:
+            status_code = response.status_code
+            error_message = raise_on.get(status_code)
+            if error_message:
+                raise Exception(error_message)
+        if error_message and not cannot_raise:
+            raise Exception(error_message)
+        return response
+
+    async def send_with_governor(self, cost=1, deadline_at=None, **kwargs):
+        if self.compress_requests:
+            kwargs = get_compressed_request_kwargs(kwargs, min_body_size=self.compression_min_size)
+        started_at = time.monotonic()
+        deadline_at = get_deadline_at(
+            started_at, operation_deadline=self.transport_config.operation_deadline, deadline_at=deadline_at
+        )
+        context = "{} {}".format(kwargs.get("method"), kwargs.get("url"))
+        attempt = 0
+        while True:
+            await self.sleep_within_deadline(self.governor.reserve(cost=cost), deadline_at, context)
+            httpx_kwargs = self.get_httpx_kwargs(kwargs, await self.get_access_token())
+            httpx_kwargs["timeout"] = self.get_timeout(get_remaining_time(deadline_at, context=context))
+            try:
+                response = await self.send_with_auth(httpx_kwargs)
+            except httpx.HTTPError as error:
+                attempt += 1
+                is_retryable = is_retryable_httpx_error(error, kwargs.get("method"))
+                if not is_retryable or attempt > SharePointConstants.MAX_RETRIES:
+                    raise
+                wait_time = SharePointConstants.WAIT_TIME_BEFORE_RETRY_SEC * 2 ** (attempt - 1)
+                logger.warning("{} failed ({}), retrying in {} seconds".format(context, error, wait_time))
+                await self.sleep_within_deadline(wait_time, deadline_at, context)
+                self.metrics.record_retry(wait_time)
+                continue
+            if not is_throttling(response):
+                self.governor.on_success(response.headers, cost=cost)
+                return response
+            attempt += 1
+            retry_after = get_retry_after_value(response, default=None)
+            sleep_time = self.governor.on_throttled(retry_after, attempt, started_at)
+            await self.sleep_within_deadline(sleep_time, deadline_at, context)
+            self.metrics.record_retry(sleep_time, is_throttled=True)
+
+    async def send_with_auth(self, httpx_kwargs):
+        response = await self.send_and_record(httpx_kwargs)
+        if response.status_code == 401 and self.auth.token_provider:
+            # Renewed at most once per call, then the request is replayed with the new token
+            rejected_token = httpx_kwargs["headers"]["Authorization"][len("Bearer "):]
+            access_token = await self.refresh_access_token(rejected_token)
+            if access_token != rejected_token:
+                httpx_kwargs["headers"]["Authorization"] = "Bearer {}".format(access_token)
+                response = await self.send_and_record(httpx_kwargs)
+        return response
+
+    async def send_and_record(self, httpx_kwargs):
+        attempt_started_at = time.monotonic()
+        try:
+            response = await self.client.request(**httpx_kwargs)
+        except httpx.HTTPError:
+            self.metrics.record_request(
+                httpx_kwargs.get("method"), httpx_kwargs.get("url"), None, time.monotonic() - attempt_started_at
+            )
+            raise
+        self.metrics.record_request(
+            httpx_kwargs.get("method"), httpx_kwargs.get("url"), response.status_code,
+            time.monotonic() - attempt_started_at,
+            bytes_sent=get_body_size(response.request.content), bytes_received=len(response.content)
+        )
+        return response
+
+    async def sleep_within_deadline(self, wait_time, deadline_at, context):
+        check_wait_within_deadline(wait_time, deadline_at, context=context)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def get_timeout(self, remaining_time=None):
+        connect_timeout, read_timeout = self.transport_config.get_timeout(remaining_time)
+        return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    async def get_access_token(self):
+        if self.auth.token_provider and self.auth.is_expiring():
+            return await self.refresh_access_token(self.auth.access_token)
+        return self.auth.access_token
+
+    async def refresh_access_token(self, rejected_token):
+        # The provider may block on I/O, and the lock on another renewal, so both run outside the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.auth.refresh_access_token, rejected_token)
+
+    def get_httpx_kwargs(self, kwargs, access_token):
+        # Maps the requests style keyword arguments used across the plugin to httpx ones
+        httpx_kwargs = {
+            "method": kwargs.get("method"),
+            "url": kwargs.get("url"),
+            "params": kwargs.get("params"),
+            "headers": dict(kwargs.get("headers") or {})
+        }
+        httpx_kwargs["headers"]["Authorization"] = "Bearer {}".format(access_token)
+        if kwargs.get("json") is not None:
+            httpx_kwargs["json"] = kwargs.get("json")
+        data = kwargs.get("data")
+        if isinstance(data, (bytes, bytearray, memoryview, str)):
+            httpx_kwargs["content"] = bytes(data) if isinstance(data, memoryview) else data
+        elif data is not None:
+            httpx_kwargs["data"] = data
+        return httpx_kwargs
+
+    async def get(self, **kwargs):
+        kwargs["method"] = "GET"
+        response = await self.request(**kwargs)
+        error_message = get_error(response)
+        if error_message and not kwargs.get("cannot_raise"):
+            raise Exception(error_message)
+        return response
+
+    async def get_item(self, **kwargs):
+        kwargs["headers"] = kwargs.get("headers", {})
+        kwargs["headers"].update(DSSConstants.JSON_HEADERS)
+        kwargs["headers"].update(DSSConstants.GZIP_HEADERS)
+        kwargs["cannot_raise"] = True
+        response = await self.get(
+            **kwargs
+        )
+        status_code = response.status_code
+        if status_code == 404:
+            return {}
+        json_response = response.json()
+        return json_response
+
+    async def get_next_item(self, **kwargs):
+        kwargs["headers"] = kwargs.get("headers", {})
+        kwargs["headers"].update(DSSConstants.JSON_HEADERS)
+        kwargs["headers"].update(DSSConstants.GZIP_HEADERS)
+        is_first_get = True
+        next_page_url = None
+        while next_page_url or is_first_get:
+            kwargs["url"] = next_page_url or kwargs["url"]
+            if next_page_url:
+                # As next_page_url already contains query params
+                kwargs["params"] = None
+            response = await self.get(
+                **kwargs
+            )
+            is_first_get = False
+            json_response = response.json()
+            next_page_url = get_next_page_url(json_response)
+            items = json_response.get("value", [])
+            for item in items:
+                yield item
+
+    async def get_all_items(self, **kwargs):
+        items = []
+        async for item in self.get_next_item(**kwargs):
+            items.append(item)
+        return items
+
+    def start_batch_mode(self, batch_size=None, max_workers=None):
+        self.is_batch_mode = True
+        self.batch_sizer = Office365BatchSizer(initial_size=batch_size, max_size=batch_size)
+        self.batch_max_workers = max_workers or DSSConstants.DEFAULT_BATCH_MAX_WORKERS
+        self.requests_buffer = []
+        self.requests_buffer_bytes = 0
+        self.pending_batches = []
+        self.batch_counter = 0
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            self.is_batch_mode = False
+
+    async def flush(self):
+        await self.dispatch_batch()
+        await self.wait_for_batches()
+
+    async def dispatch_batch(self):
+        requests_buffer = self.requests_buffer
+        self.requests_buffer = []
+        self.requests_buffer_bytes = 0
+        if not requests_buffer:
+            return
+        self.batch_counter += 1
+        await self.wait_for_batches(max_pending=self.batch_max_workers - 1)
+        task = asyncio.ensure_future(self.send_batch(requests_buffer))
+        self.pending_batches.append((self.batch_counter, task))
+
+    async def wait_for_batches(self, max_pending=0):
+        errors = []
+        while len(self.pending_batches) > max_pending:
+            batch_number, task = self.pending_batches.pop(0)
+            try:
+                responses = await task
+                assert_responses_ok(responses)
+            except Exception as error:
+                errors.append((batch_number, error))
+                max_pending = 0
+        for batch_number, error in errors:
+            logger.error("Batch #{} failed: {}".format(batch_number, error))
+        if errors:
+            raise errors[0][1]
+
+    async def send_batch(self, requests_buffer, deadline_at=None):
+        final_responses = [None] * len(requests_buffer)
+        pending_indexes = list(range(len(requests_buffer)))
+        started_at = time.monotonic()
+        deadline_at = get_deadline_at(
+            started_at, operation_deadline=self.transport_config.operation_deadline, deadline_at=deadline_at
+        )
+        attempt = 0
+        while pending_indexes:
+            batch_started_at = time.monotonic()
+            responses = await self.process_batch(
+                [requests_buffer[index] for index in pending_indexes], deadline_at=deadline_at
+            )
+            self.metrics.record_batch(len(pending_indexes), self.batch_sizer.max_size)
+            self.batch_sizer.on_batch_done(
+                len(pending_indexes),
+                time.monotonic() - batch_started_at,
+                any(is_retryable_batch_response(response) for response in responses)
+            )
+            retry_indexes = []
+            retry_after = None
+            for response in responses:
+                index = pending_indexes[int(response.get("id")) - 1]
+                response["id"] = "{}".format(index + 1)
+                final_responses[index] = response
+                if is_retryable_batch_response(response):
+                    retry_indexes.append(index)
+                    response_retry_after = get_batch_response_retry_after(response)
+                    if response_retry_after is not None:
+                        retry_after = max(retry_after or 0, response_retry_after)
+            if not retry_indexes:
+                break
+            attempt += 1
+            if attempt > SharePointConstants.MAX_RETRIES:
+                logger.error("{} batch sub-requests still failing after {} retries".format(len(retry_indexes), attempt - 1))
+                break
+            is_throttled = any(is_throttling_batch_response(final_responses[index]) for index in retry_indexes)
+            if is_throttled:
+                sleep_time = self.governor.on_throttled(retry_after, attempt, started_at)
+            else:
+                sleep_time = self.governor.get_retry_sleep_time(retry_after, attempt, started_at)
+            await self.sleep_within_deadline(sleep_time, deadline_at, "$batch")
+            self.metrics.record_retry(
+                sleep_time if is_throttled else 0, is_throttled=is_throttled, number_of_retries=len(retry_indexes)
+            )
+            pending_indexes = retry_indexes
+        return final_responses
+
+    async def process_batch(self, requests_buffer, deadline_at=None):
+        if not requests_buffer:
+            return {}
+        requests = []
+        for counter, request_kwargs in enumerate(requests_buffer, start=1):
+            request = {
+                "id": "{}".format(counter),
+                "method": request_kwargs.get("method"),
+                "url": self.get_relative_url(request_kwargs.get("url")),
+            }
+            if request_kwargs.get("headers"):
+                request["headers"] = request_kwargs.get("headers")
+            if request_kwargs.get("json"):
+                request["body"] = request_kwargs.get("json")
+            if request_kwargs.get("data"):
+                request["data"] = request_kwargs.get("data")
+            requests.append(request)
+        response = await self.send_with_governor(
+            cost=len(requests),
+            deadline_at=deadline_at,
+            method="POST",
+            url=self.get_batch_url(),
+            headers=DSSConstants.JSON_HEADERS,
+            json={"requests": requests}
+        )
+        status_code = response.status_code
+        if status_code >= 400:
+            logger.error("Error {}, dumping content: {}".format(status_code, response.content))
+            raise Exception("Error {}".format(status_code))
+        return response.json().get("responses", {})
+
+    def get_site(self, site_id):
+        return AsyncOffice365Site(self, site_id)
+
+    def get_drive(self, drive_id):
+        return AsyncOffice365Drive(self, drive_id)
+
+    def get_batch_url(self):
+        return self.get_endpoint_url_for("$batch")
+
+    def get_relative_url(self, full_url):
+        url_base = self.get_endpoint_url()
+        relative_url = full_url
+        if full_url.startswith(url_base):
+            relative_url = full_url.replace(url_base, "")
+        return relative_url
+
+    def get_endpoint_url(self):
+        return self.endpoint_url
+
+    def get_endpoint_url_for(self, root_path):
+        return "/".join(
+            [
+                self.get_endpoint_url(),
+                root_path
+            ]
+        )
+
+
+class AsyncOffice365Site(Office365SiteUrls):
+    def get_list(self, list_id):
+        return AsyncOffice365List(self, list_id)
+
+    async def get_list_id(self, list_name):
+        async for list in self.get_next_list():
+            list_web_url = urllib.parse.unquote(list.get("webUrl"))
+            if list_web_url.endswith(list_name):
+                return list.get("id")
+        return None
+
+    async def get_drive_id(self, drive_name):
+        async for drive in self.get_next_drive():
+            drive_web_url = urllib.parse.unquote(drive.get("webUrl"))
+            if drive_web_url.endswith(drive_name):
+                return drive.get("id")
+        return None
+
+    async def get_next_list(self):
+        async for list in self.session.get_next_item(url=self.get_lists_url()):
+            yield list
+
+    async def get_next_drive(self):
+        async for drive in self.session.get_next_item(url=self.get_drives_url()):
+            yield drive
+
+
+class AsyncOffice365List(Office365ListUrls):
+    async def get_columns(self):
+        return await self.session.get_all_items(url=self.get_column_url())
+
+    async def get_next_row(self, columns=None, filter=None, order_by=None, page_size=None, allow_non_indexed_filter=False,
+                           records_limit=-1):
+        records_limit = RecordsLimit(records_limit)
+        if records_limit.is_exhausted():
+            return
+        if not records_limit.has_no_limit:
+            page_size = min(page_size or records_limit.records_limit, records_limit.records_limit)
+        async for row in self.session.get_next_item(
+            url=self.get_next_list_row_url(),
+            params=get_list_items_params(columns=columns, filter=filter, order_by=order_by, page_size=page_size),
+            headers=get_list_items_headers(allow_non_indexed_filter=allow_non_indexed_filter),
+            force_no_batch=True
+        ):
+            if records_limit.is_reached():
+                return
+            yield row
+            if records_limit.is_exhausted():
+                return
+
+    async def write_row(self, row):
+        await self.session.request(
+            method="POST",
+            url=self.get_next_list_row_url(),
+            headers=DSSConstants.JSON_HEADERS,
+            json={"fields": row}
+        )
+
+    async def update_row(self, row_id, fields):
+        await self.session.request(
+            method="PATCH",
+            url=self.get_list_row_fields_url(row_id),
+            headers=DSSConstants.JSON_HEADERS,
+            json=fields
+        )
+
+    async def delete_row(self, row_id):
+        await self.session.request(
+            method="DELETE",
+            url=self.get_list_row_id_url(row_id)
+        )
+
+
+class AsyncOffice365Drive(Office365DriveUrls):
+    async def get_item(self, item_path):
+        return await self.session.get_item(url=self.get_item_url(item_path))
+
+    async def get_item_by_id(self, item_id):
+        return await self.session.get_item(url=self.get_item_by_id_url(item_id))
+
+    async def get_next_child(self, folder_path):
+        async for child in self.session.get_next_item(url=self.get_children_url(folder_path)):
+            yield child
+
+    async def get_next_child_by_id(self, folder_id):
+        async for child in self.session.get_next_item(url=self.get_item_by_id_children_url(folder_id)):
+            yield child
+
+    async def delete_item_by_id(self, item_id):
+        await self.session.request(
+            method="DELETE",
+            url=self.get_item_by_id_url(item_id)
+        )
+
+
+def is_retryable_httpx_error(error, method):
+    # Same rule as is_retryable_transport_error: only idempotent requests are sent again after a read failure
+    if isinstance(error, (httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, (httpx.NetworkError, httpx.TimeoutException, httpx.RemoteProtocolError)):
+        return (method or "GET").upper() in ["GET", "HEAD", "PUT", "DELETE"]
+    return False
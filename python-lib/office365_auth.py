@@ -1,12 +1,123 @@
+import base64
+import hashlib
+import json
+import threading
+import time
 import requests
+from safe_logger import SafeLogger
+from sharepoint_constants import SharePointConstants
+
+
+logger = SafeLogger("office-365 plugin", [])
 
 
 class Office365Auth(requests.auth.AuthBase):
-    def __init__(self, access_token=None):
-        self.access_token = access_token
+    """
+    Bearer token auth. With a token_provider callback returning a fresh access token, the token is
+    renewed shortly before it expires, and once on a 401 after which the request is replayed.
+    Threads that need a new token at the same time share a single call to the provider.
+    """
+    def __init__(self, access_token=None, token_provider=None, refresh_margin=None, identity=None):
+        self.token_provider = token_provider
+        self.identity = identity
+        self.refresh_margin = refresh_margin or SharePointConstants.TOKEN_REFRESH_MARGIN_SEC
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = None
+        self.set_access_token(access_token)
 
     def __call__(self, request):
         request.headers["Authorization"] = "Bearer {}".format(
-            self.access_token
+            self.get_access_token()
         )
+        if self.token_provider:
+            request.register_hook("response", self.handle_unauthorized)
         return request
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+        self.expires_at = get_token_expiration(access_token)
+
+    def get_access_token(self):
+        if self.token_provider and self.is_expiring():
+            self.refresh_access_token(self.access_token)
+        return self.access_token
+
+    def is_expiring(self):
+        if not self.access_token:
+            return True
+        if self.expires_at is None:
+            # Opaque token, it is only renewed when Graph rejects it
+            return False
+        return time.time() + self.refresh_margin >= self.expires_at
+
+    def get_identity(self):
+        # Tenant, user and app the token acts for. Opaque tokens have no claims, they are identified by
+        # the identity given to the constructor, or else by a hash of the token, which changes on every renewal
+        access_token = self.get_access_token()
+        claims = get_token_claims(access_token)
+        if claims.get("tid") and (claims.get("oid") or claims.get("sub")):
+            return "/".join([
+                "{}".format(claims.get("tid")),
+                "{}".format(claims.get("oid") or claims.get("sub")),
+                "{}".format(claims.get("appid") or claims.get("azp"))
+            ])
+        if self.identity:
+            return self.identity
+        return hashlib.sha256("{}".format(access_token).encode("utf-8")).hexdigest()
+
+    def refresh_access_token(self, rejected_token):
+        with self.lock:
+            # Another thread may have renewed the token while this one was waiting for the lock
+            if self.access_token == rejected_token:
+                logger.info("Renewing the access token")
+                self.set_access_token(self.token_provider())
+            return self.access_token
+
+    def handle_unauthorized(self, response, **kwargs):
+        request = response.request
+        authorization = request.headers.get("Authorization") or ""
+        if response.status_code != 401 or getattr(request, "is_auth_replay", False):
+            return response
+        if not authorization.startswith("Bearer ") or not is_replayable_body(request.body):
+            # The Authorization header is dropped when redirected to another host, no token to renew there
+            return response
+        rejected_token = authorization[len("Bearer "):]
+        access_token = self.refresh_access_token(rejected_token)
+        if access_token == rejected_token:
+            return response
+        # Release the connection before sending the request again
+        response.content
+        response.close()
+        replayed_request = request.copy()
+        replayed_request.headers["Authorization"] = "Bearer {}".format(access_token)
+        replayed_request.is_auth_replay = True
+        replayed_response = response.connection.send(replayed_request, **kwargs)
+        replayed_response.history.append(response)
+        replayed_response.request = replayed_request
+        return replayed_response
+
+
+def get_token_expiration(access_token):
+    # Graph access tokens are JWTs, their exp claim is the expiration as a unix timestamp
+    try:
+        return int(get_token_claims(access_token).get("exp"))
+    except (ValueError, TypeError):
+        return None
+
+
+def get_token_claims(access_token):
+    if not access_token:
+        return {}
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError, TypeError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def is_replayable_body(body):
+    # Streamed bodies have been consumed by the first attempt
+    return body is None or isinstance(body, (bytes, bytearray, memoryview, str))
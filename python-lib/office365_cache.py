@@ -0,0 +1,61 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TTLCache(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.in_flight = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+        return None
+
+    def get_stale(self, key):
+        # Returns the cached value even if expired, for callers able to revalidate it
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry[1] if entry else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries = {}
+            else:
+                self.entries.pop(key, None)
+
+    def get_or_compute(self, key, compute):
+        # Concurrent misses on the same key wait for the first caller's compute instead of repeating it
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self.lock:
+            in_flight = self.in_flight.get(key)
+            is_owner = in_flight is None
+            if is_owner:
+                in_flight = Future()
+                self.in_flight[key] = in_flight
+        if not is_owner:
+            return in_flight.result()
+        try:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+            in_flight.set_result(value)
+            return value
+        except Exception as error:
+            in_flight.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
@@ -1,47 +1,88 @@
 import requests
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from safe_logger import SafeLogger
 from office365_site import Office365Site
 from office365_drive import Office365Drive
 from office365_messages import Office365Messages
 from office365_auth import Office365Auth
-from office365_commons import get_next_page_url, get_error, prepare_row, is_throttling, get_retry_after_value
+from office365_throttling import get_default_governor, Office365BatchSizer, get_batch_request_bytes
+from office365_cache import TTLCache
+from office365_metrics import get_default_metrics, get_body_size
+from office365_write_queue import get_list_write_queue
+from office365_transport import (
+    Office365TransportConfig, get_transport_session, get_deadline_at, get_remaining_time,
+    sleep_within_deadline, is_retryable_transport_error
+)
+from office365_commons import (
+    get_next_page_url, get_error, is_deleted_item, is_throttling, get_retry_after_value,
+    is_retryable_batch_response, is_throttling_batch_response, get_batch_response_retry_after,
+    get_changed_fields, get_row_key, get_row_converter, get_dataframe_rows, get_compressed_request_kwargs
+)
 from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
 
 
 logger = SafeLogger("office-365 plugin", [])
+# Process wide, so that every tool instance pointing to the same list shares the resolution
+SITE_LIST_IDS_CACHE = TTLCache(ttl=SharePointConstants.ID_CACHE_TTL_SEC)
 
 
 class Office365Session():
-    def __init__(self, access_token=None):
-        self.session = requests.Session()
-        self.session.auth = Office365Auth(access_token=access_token)
+    def __init__(self, access_token=None, governor=None, compress_requests=False, compression_min_size=None,
+                 transport_config=None, token_provider=None, metrics=None, endpoint_url=None, credentials_identity=None):
+        # token_provider() returns a fresh access token, it is called when the current one expires
+        # credentials_identity, such as the connection name, identifies the credentials when the token is not a JWT
+        # endpoint_url points the session to another Graph endpoint, such as a local stand-in for benchmarks
+        self.endpoint_url = endpoint_url or DSSConstants.GRAPH_ENDPOINT_URL
+        self.metrics = metrics or get_default_metrics()
+        self.transport_config = transport_config or Office365TransportConfig()
+        self.session = get_transport_session(self.transport_config)
+        self.session.auth = Office365Auth(
+            access_token=access_token, token_provider=token_provider, identity=credentials_identity
+        )
+        # Deadlines set with the deadline() context manager only apply to the calling thread
+        self.local = threading.local()
+        self.governor = governor or get_default_governor()
+        # Opt-in, JSON bodies larger than compression_min_size bytes are sent gzipped
+        self.compress_requests = compress_requests
+        self.compression_min_size = compression_min_size
         self.is_batch_mode = False
         self.requests_buffer = []
-        self.batch_size = 0
+        self.requests_buffer_bytes = 0
+        self.batch_sizer = Office365BatchSizer()
+        self.batch_max_workers = 1
+        self.batch_executor = None
+        self.pending_batches = []
+        self.batch_counter = 0
+        self.batch_request_counter = 0
+        self.on_batch_done = None
 
     def request(self, **kwargs):
         raise_on = kwargs.pop("raise_on", {})
         cannot_raise = kwargs.pop("cannot_raise", False)
         force_no_batch = kwargs.pop("force_no_batch", False)
+        depends_on = kwargs.pop("depends_on", None)
 
         if self.is_batch_mode and not force_no_batch:
+            # The returned id can be passed as depends_on to the requests that have to run after this one
+            self.batch_request_counter += 1
+            kwargs["batch_id"] = "{}".format(self.batch_request_counter)
+            if depends_on:
+                kwargs["depends_on"] = depends_on if isinstance(depends_on, list) else [depends_on]
+            request_bytes = get_batch_request_bytes(kwargs)
+            if self.requests_buffer and self.batch_sizer.would_overflow(self.requests_buffer_bytes, request_bytes):
+                self.dispatch_batch()
             self.requests_buffer.append(kwargs)
-            if len(self.requests_buffer) >= self.batch_size:
-                self.flush()
-            return
+            self.requests_buffer_bytes += request_bytes
+            if self.batch_sizer.is_full(len(self.requests_buffer), self.requests_buffer_bytes):
+                self.dispatch_batch()
+            return kwargs["batch_id"]
 
-        should_retry = True
-        while should_retry:
-            should_retry = False
-            response = self.session.request(**kwargs)
-            if is_throttling(response):
-                retry_after = get_retry_after_value(response)
-                if retry_after:
-                    logger.warning("SharePoint is throttling... Sleeping for {} seconds".format(retry_after))
-                    time.sleep(retry_after)
-                    should_retry = True
-                    logger.warning("Retrying")
+        response = self.send_with_governor(**kwargs)
         error_message = get_error(response)
         if raise_on:
             status_code = response.status_code
@@ -52,6 +93,77 @@ class Office365Session():
             raise Exception(error_message)
         return response
 
+    def send_with_governor(self, cost=1, deadline_at=None, **kwargs):
+        if self.compress_requests:
+            kwargs = get_compressed_request_kwargs(kwargs, min_body_size=self.compression_min_size)
+        started_at = time.monotonic()
+        deadline_at = self.get_deadline_at(started_at, deadline_at=deadline_at)
+        context = "{} {}".format(kwargs.get("method"), kwargs.get("url"))
+        timeout = kwargs.pop("timeout", None)
+        attempt = 0
+        while True:
+            sleep_within_deadline(self.governor.reserve(cost=cost), deadline_at, context=context)
+            remaining_time = get_remaining_time(deadline_at, context=context)
+            attempt_started_at = time.monotonic()
+            try:
+                response = self.session.request(
+                    timeout=timeout or self.transport_config.get_timeout(remaining_time),
+                    **kwargs
+                )
+            except requests.exceptions.RequestException as error:
+                self.metrics.record_request(
+                    kwargs.get("method"), kwargs.get("url"), None, time.monotonic() - attempt_started_at,
+                    bytes_sent=get_body_size(kwargs.get("data"))
+                )
+                attempt += 1
+                is_retryable = is_retryable_transport_error(error, kwargs.get("method"))
+                if not is_retryable or attempt > SharePointConstants.MAX_RETRIES:
+                    raise
+                wait_time = SharePointConstants.WAIT_TIME_BEFORE_RETRY_SEC * 2 ** (attempt - 1)
+                logger.warning("{} failed ({}), retrying in {} seconds".format(context, error, wait_time))
+                sleep_within_deadline(wait_time, deadline_at, context=context)
+                self.metrics.record_retry(wait_time)
+                continue
+            self.record_response(kwargs, response, time.monotonic() - attempt_started_at)
+            if not is_throttling(response):
+                self.governor.on_success(response.headers, cost=cost)
+                return response
+            attempt += 1
+            retry_after = get_retry_after_value(response, default=None)
+            sleep_time = self.governor.on_throttled(retry_after, attempt, started_at)
+            sleep_within_deadline(sleep_time, deadline_at, context=context)
+            self.metrics.record_retry(sleep_time, is_throttled=True)
+
+    def record_response(self, kwargs, response, latency):
+        if kwargs.get("stream"):
+            # Reading a streamed body here would defeat the streaming, its announced size is used instead
+            bytes_received = int(response.headers.get("Content-Length") or 0)
+        else:
+            bytes_received = len(response.content)
+        self.metrics.record_request(
+            kwargs.get("method"), kwargs.get("url"), response.status_code, latency,
+            bytes_sent=get_body_size(response.request.body), bytes_received=bytes_received
+        )
+
+    @contextmanager
+    def deadline(self, budget):
+        # Bounds everything the calling thread sends within the block, retries and batches included
+        previous_deadline_at = getattr(self.local, "deadline_at", None)
+        self.local.deadline_at = get_deadline_at(
+            time.monotonic(), operation_deadline=budget, deadline_at=previous_deadline_at
+        )
+        try:
+            yield
+        finally:
+            self.local.deadline_at = previous_deadline_at
+
+    def get_deadline_at(self, started_at, deadline_at=None):
+        return get_deadline_at(
+            started_at,
+            operation_deadline=self.transport_config.operation_deadline,
+            deadline_at=deadline_at or getattr(self.local, "deadline_at", None)
+        )
+
     def get(self, **kwargs):
         kwargs["method"] = "GET"
         response = self.request(**kwargs)
@@ -79,6 +191,12 @@ class Office365Session():
         return json_response
 
     def get_next_item(self, **kwargs):
+        for json_response in self.get_next_page(**kwargs):
+            items = json_response.get("value", [])
+            for item in items:
+                yield item
+
+    def get_next_page(self, **kwargs):
         kwargs["headers"] = kwargs.get("headers", {})
         kwargs["headers"].update(DSSConstants.JSON_HEADERS)
         kwargs["headers"].update(DSSConstants.GZIP_HEADERS)
@@ -95,9 +213,43 @@ class Office365Session():
             is_first_get = False
             json_response = response.json()
             next_page_url = get_next_page_url(json_response)
-            items = json_response.get("value", [])
-            for item in items:
+            yield json_response
+
+    def get_next_delta_item(self, url, state_store, state_key=None, params=None, start_from_latest=False, skip_deleted=False):
+        # Yields the items created, updated or deleted since the delta link saved in state_store.
+        # The first run yields every item, unless start_from_latest is set. With skip_deleted, removed items are left out.
+        # The new delta link is only saved once all the pages have been consumed.
+        state_key = state_key or url
+        delta_link = state_store.get_delta_link(state_key)
+        if not delta_link and start_from_latest:
+            params = dict(params or {})
+            params["token"] = "latest"
+        is_first_page = True
+        for json_response in self.get_next_page(
+            url=delta_link or url,
+            params=None if delta_link else params,
+            cannot_raise=True,
+            force_no_batch=True
+        ):
+            if "error" in json_response:
+                if is_first_page and delta_link:
+                    # 410 Gone: the delta link expired, a full sync is required
+                    logger.warning("Delta link for {} is no longer valid, starting a full sync".format(state_key))
+                    state_store.delete_delta_link(state_key)
+                    for item in self.get_next_delta_item(
+                        url, state_store, state_key=state_key, params=params, skip_deleted=skip_deleted
+                    ):
+                        yield item
+                    return
+                raise Exception("Error during delta query on {}: {}".format(state_key, json_response.get("error")))
+            is_first_page = False
+            for item in json_response.get("value", []):
+                if skip_deleted and is_deleted_item(item):
+                    continue
                 yield item
+            next_delta_link = json_response.get("@odata.deltaLink")
+            if next_delta_link:
+                state_store.set_delta_link(state_key, next_delta_link)
 
     def get_next_site(self):
         for site in self.get_next_item(
@@ -127,29 +279,101 @@ class Office365Session():
             items.append(item)
         return items
 
-    def start_batch_mode(self, batch_size=None):
-        batch_size = batch_size or DSSConstants.DEFAULT_BATCH_SIZE
+    def start_batch_mode(self, batch_size=None, max_workers=None, on_batch_done=None):
+        # on_batch_done(number_of_requests) is called, in order, once each $batch has succeeded.
+        # batch_size is the size of the first $batch and the largest one sent, the size in between
+        # follows the observed latency and throttling.
+        max_workers = max_workers or DSSConstants.DEFAULT_BATCH_MAX_WORKERS
         self.is_batch_mode = True
-        self.batch_size = batch_size
+        self.batch_sizer = Office365BatchSizer(initial_size=batch_size, max_size=batch_size)
         self.requests_buffer = []
+        self.requests_buffer_bytes = 0
+        self.batch_max_workers = max_workers
+        self.pending_batches = []
+        self.batch_counter = 0
+        self.batch_request_counter = 0
+        self.on_batch_done = on_batch_done
+        if max_workers > 1:
+            self.batch_executor = ThreadPoolExecutor(max_workers=max_workers)
 
     def close(self):
-        self.flush()
-        self.is_batch_mode = False
+        try:
+            self.flush()
+        finally:
+            if self.batch_executor:
+                self.batch_executor.shutdown(wait=True)
+                self.batch_executor = None
+            self.is_batch_mode = False
 
     def flush(self):
-        responses = self.process_batch(self.requests_buffer)
+        self.dispatch_batch()
+        self.wait_for_batches()
+
+    def dispatch_batch(self):
+        requests_buffer = self.requests_buffer
         self.requests_buffer = []
-        assert_responses_ok(responses)
+        self.requests_buffer_bytes = 0
+        if not requests_buffer:
+            return
+        self.batch_counter += 1
+        # The batches run on worker threads, which do not see the caller's deadline
+        deadline_at = getattr(self.local, "deadline_at", None)
+        if not self.batch_executor:
+            responses = self.send_batch(requests_buffer, deadline_at=deadline_at)
+            assert_responses_ok(responses)
+            if self.on_batch_done:
+                self.on_batch_done(len(responses))
+            return
+        if has_external_dependencies(requests_buffer):
+            # Requests this batch depends on were sent in previous batches, which must be done first
+            self.wait_for_batches()
+        # Keep at most batch_max_workers $batch in flight, the oldest one is awaited first
+        self.wait_for_batches(max_pending=self.batch_max_workers - 1)
+        future = self.batch_executor.submit(self.send_batch, requests_buffer, deadline_at=deadline_at)
+        self.pending_batches.append((self.batch_counter, future))
+
+    def wait_for_batches(self, max_pending=0):
+        errors = []
+        while len(self.pending_batches) > max_pending:
+            batch_number, future = self.pending_batches.pop(0)
+            try:
+                responses = future.result()
+                assert_responses_ok(responses)
+                if self.on_batch_done and not errors:
+                    self.on_batch_done(len(responses))
+            except Exception as error:
+                errors.append((batch_number, error))
+                # Drain all in flight batches so that every failure gets reported
+                max_pending = 0
+        for batch_number, error in errors:
+            logger.error("Batch #{} failed: {}".format(batch_number, error))
+        if errors:
+            raise errors[0][1]
 
     def get_site(self, site_id):
         return Office365Site(self, site_id)
 
+    def get_list_write_queue(self, list):
+        return get_list_write_queue(list)
+
+    def get_credentials_identity(self):
+        return self.session.auth.get_identity()
+
     def get_messages(self, search_space=None):
         return Office365Messages(self, search_space=search_space)
 
     def get_site_id(self, site_name):
+        return SITE_LIST_IDS_CACHE.get_or_compute(
+            "site:{}".format(site_name),
+            lambda: self.resolve_site_id(site_name)
+        )
+
+    def resolve_site_id(self, site_name):
         search_by_web_url = True if "/" in site_name else False
+        if search_by_web_url:
+            site_id = self.get_site_id_by_path(self.get_root_hostname(), site_name)
+            if site_id:
+                return site_id
         for site in self.get_next_site():
             if search_by_web_url:
                 full_site_path = "/".join(site.get("webUrl").split("/")[3:])
@@ -163,18 +387,84 @@ class Office365Session():
     def get_drive(self, drive_id):
         return Office365Drive(self, drive_id)
 
-    def process_batch(self, requests_buffer):
+    def send_batch(self, requests_buffer, deadline_at=None):
+        # Sends the buffer as one $batch, then re-sends only the throttled / transiently failed
+        # sub-requests, and the ones that failed because they depend on them, until they succeed
+        # or the retry budget is spent. Responses are returned in the buffer order.
+        requests_buffer = [
+            dict(request_kwargs, batch_id=request_kwargs.get("batch_id") or "{}".format(index + 1))
+            for index, request_kwargs in enumerate(requests_buffer)
+        ]
+        index_by_id = {request_kwargs.get("batch_id"): index for index, request_kwargs in enumerate(requests_buffer)}
+        final_responses = [None] * len(requests_buffer)
+        pending_indexes = list(range(len(requests_buffer)))
+        started_at = time.monotonic()
+        deadline_at = self.get_deadline_at(started_at, deadline_at=deadline_at)
+        attempt = 0
+        while pending_indexes:
+            batch_started_at = time.monotonic()
+            responses = self.process_batch([requests_buffer[index] for index in pending_indexes], deadline_at=deadline_at)
+            self.metrics.record_batch(len(pending_indexes), self.batch_sizer.max_size)
+            self.batch_sizer.on_batch_done(
+                len(pending_indexes),
+                time.monotonic() - batch_started_at,
+                any(is_retryable_batch_response(response) for response in responses)
+            )
+            for response in responses:
+                final_responses[index_by_id.get(response.get("id"))] = response
+            retry_indexes = []
+            retry_ids = set()
+            retry_after = None
+            for index in pending_indexes:
+                response = final_responses[index]
+                depends_on = requests_buffer[index].get("depends_on") or []
+                is_failed_dependency = int(response.get("status", 200)) == 424 and retry_ids.intersection(depends_on)
+                if is_retryable_batch_response(response) or is_failed_dependency:
+                    retry_indexes.append(index)
+                    retry_ids.add(requests_buffer[index].get("batch_id"))
+                    response_retry_after = get_batch_response_retry_after(response)
+                    if response_retry_after is not None:
+                        retry_after = max(retry_after or 0, response_retry_after)
+            if not retry_indexes:
+                break
+            attempt += 1
+            if attempt > SharePointConstants.MAX_RETRIES:
+                logger.error("{} batch sub-requests still failing after {} retries".format(len(retry_indexes), attempt - 1))
+                break
+            logger.warning("{} of {} batch sub-requests throttled or failed, retrying them".format(
+                len(retry_indexes), len(pending_indexes)
+            ))
+            is_throttled = any(is_throttling_batch_response(final_responses[index]) for index in retry_indexes)
+            if is_throttled:
+                sleep_time = self.governor.on_throttled(retry_after, attempt, started_at)
+            else:
+                sleep_time = self.governor.get_retry_sleep_time(retry_after, attempt, started_at)
+            sleep_within_deadline(sleep_time, deadline_at, context="$batch")
+            self.metrics.record_retry(
+                sleep_time if is_throttled else 0, is_throttled=is_throttled, number_of_retries=len(retry_indexes)
+            )
+            pending_indexes = retry_indexes
+        return final_responses
+
+    def process_batch(self, requests_buffer, deadline_at=None):
         if not requests_buffer:
             return {}
         data = {}
         requests = []
         counter = 1
+        batch_ids = set(request_kwargs.get("batch_id") for request_kwargs in requests_buffer)
         for request_kwargs in requests_buffer:
             request = {
-                "id": "{}".format(counter),
+                "id": request_kwargs.get("batch_id") or "{}".format(counter),
                 "method": request_kwargs.get("method"),
                 "url": self.get_relative_url(request_kwargs.get("url")),
             }
+            # Dependencies sent in a previous $batch are already done
+            depends_on = [
+                dependency for dependency in request_kwargs.get("depends_on") or [] if dependency in batch_ids
+            ]
+            if depends_on:
+                request["dependsOn"] = depends_on
             if request_kwargs.get("headers"):
                 request["headers"] = request_kwargs.get("headers")
             if request_kwargs.get("json"):
@@ -186,7 +476,10 @@ class Office365Session():
             )
             counter += 1
         data["requests"] = requests
-        response = self.session.request(
+        # Graph counts each sub-request against the throttling limits
+        response = self.send_with_governor(
+            cost=len(requests),
+            deadline_at=deadline_at,
             method="POST",
             url=self.get_batch_url(),
             headers=DSSConstants.JSON_HEADERS,
@@ -229,7 +522,7 @@ class Office365Session():
         return relative_url
 
     def get_endpoint_url(self):
-        return "https://graph.microsoft.com/v1.0"
+        return self.endpoint_url
 
     def get_endpoint_url_for(self, root_path):
         return "/".join(
@@ -239,7 +532,62 @@ class Office365Session():
             ]
         )
 
+    def get_root_hostname(self):
+        return SITE_LIST_IDS_CACHE.get_or_compute(
+            "hostname:{}".format(self.get_endpoint_url()),
+            lambda: self.get_item(
+                url=self.get_endpoint_url_for("sites/root"),
+                params={"$select": "siteCollection"}
+            ).get("siteCollection", {}).get("hostname")
+        )
+
+    def get_site_id_by_path(self, hostname, site_path):
+        # GET /sites/{hostname}:/{server-relative-path}
+        site_path = site_path.strip("/")
+        if site_path:
+            url = self.get_endpoint_url_for("sites/{}:/{}".format(hostname, urllib.parse.quote(site_path)))
+        else:
+            url = self.get_endpoint_url_for("sites/{}".format(hostname))
+        site = self.get_item(url=url, params={"$select": "id"})
+        return site.get("id")
+
+    def get_list_id_by_name(self, site_id, list_name):
+        # GET /sites/{site-id}/lists/{list-title}, then the URL name of the lists on that site
+        sharepoint_list = self.get_item(
+            url=self.get_endpoint_url_for("sites/{}/lists/{}".format(site_id, urllib.parse.quote(list_name))),
+            params={"$select": "id"}
+        )
+        list_id = sharepoint_list.get("id")
+        if list_id:
+            return list_id
+        site = self.get_site(site_id)
+        for sharepoint_list in site.get_next_list():
+            if sharepoint_list.get("name") == list_name:
+                return sharepoint_list.get("id")
+        return None
+
     def extract_site_list_from_url(self, url):
+        site_list_ids = SITE_LIST_IDS_CACHE.get_or_compute(
+            "list:{}".format(url),
+            lambda: self.resolve_site_list_from_url(url)
+        )
+        return site_list_ids or (None, None)
+
+    def resolve_site_list_from_url(self, url):
+        hostname, site_path, list_name = split_list_url(url)
+        if list_name:
+            site_id = self.get_site_id_by_path(hostname, site_path)
+            if site_id:
+                list_id = self.get_list_id_by_name(site_id, list_name)
+                if list_id:
+                    return site_id, list_id
+        logger.warning("Could not address the list '{}' directly, searching through all sites".format(url))
+        site_id, list_id = self.search_site_list_from_url(url)
+        if site_id and list_id:
+            return site_id, list_id
+        return None
+
+    def search_site_list_from_url(self, url):
         url_tokens = url.strip("/").split("/")
         list_name = url_tokens[-2:-1][0]
         site_name = url_tokens[-4:-3][0]
@@ -302,6 +650,30 @@ class Office365Session():
         return []
 
 
+def split_list_url(url):
+    # https://{hostname}/sites/{site}/Lists/{list}/AllItems.aspx -> ({hostname}, "sites/{site}", {list})
+    parsed_url = urllib.parse.urlparse(url.strip())
+    path_tokens = [urllib.parse.unquote(token) for token in parsed_url.path.split("/") if token]
+    lowered_path_tokens = [token.lower() for token in path_tokens]
+    if "lists" not in lowered_path_tokens:
+        return parsed_url.netloc, None, None
+    lists_index = lowered_path_tokens.index("lists")
+    if lists_index + 1 >= len(path_tokens):
+        return parsed_url.netloc, None, None
+    site_path = "/".join(path_tokens[:lists_index])
+    list_name = path_tokens[lists_index + 1]
+    return parsed_url.netloc, site_path, list_name
+
+
+def has_external_dependencies(requests_buffer):
+    batch_ids = set(request_kwargs.get("batch_id") for request_kwargs in requests_buffer)
+    for request_kwargs in requests_buffer:
+        for dependency in request_kwargs.get("depends_on") or []:
+            if dependency not in batch_ids:
+                return True
+    return False
+
+
 def get_relative_url(url_base, full_url):
     relative_url = full_url
     if full_url.startswith(url_base):
@@ -310,7 +682,6 @@ def get_relative_url(url_base, full_url):
 
 
 def assert_responses_ok(responses):
-    max_retry_after = 0
     for response in responses:
         if int(response.get("status", 200)) >= 400:
             logger.error("Error during batch, dumping responses: {}".format(responses))
@@ -318,26 +689,84 @@ def assert_responses_ok(responses):
                 response.get("id"),
                 response.get("status"),
                 response.get("body"),
-                response.get("header")
+                response.get("headers")
             ))
-        retry_after = response.get("header", {}).get("Retry-After", 0)
-        if retry_after > max_retry_after:
-            max_retry_after = retry_after
     return True
 
 
 class Office365ListWriter(object):
-    def __init__(self, list, dataset_schema, batch_size=None, write_from_dict=False):
+    def __init__(self, list, dataset_schema, batch_size=None, write_from_dict=False, max_workers=None,
+                 write_mode=SharePointConstants.WRITE_MODE_CREATE, key_column=None):
         self.list = list
-        self.list.session.start_batch_mode(batch_size=batch_size)
         self.columns = dataset_schema.get("columns")
         self.write_from_dict = write_from_dict
+        self.convert_row = get_row_converter(self.columns)
+        self.write_mode = write_mode
+        self.key_column = key_column
+        self.existing_rows = {}
+        if write_mode == SharePointConstants.WRITE_MODE_UPSERT:
+            if not key_column:
+                raise Exception("A key column is required to upsert rows")
+            self.existing_rows = self.get_existing_rows()
+        self.list.session.start_batch_mode(batch_size=batch_size, max_workers=max_workers)
+
+    def get_existing_rows(self):
+        # key -> (item id, fields), from one scan limited to the key and the written columns
+        column_names = [self.key_column] + [
+            column.get("name") for column in self.columns if column.get("name") != self.key_column
+        ]
+        existing_rows = {}
+        for row in self.list.get_next_row(columns=column_names, page_size=DSSConstants.MAX_LIST_ITEMS_PAGE_SIZE):
+            fields = row.get("fields", {})
+            key = fields.get(self.key_column)
+            if key is None:
+                continue
+            key = get_row_key(key)
+            if key in existing_rows:
+                logger.warning("Key '{}' is not unique in the list, only its first item will be updated".format(key))
+                continue
+            existing_rows[key] = (row.get("id"), fields)
+        logger.info("{} existing rows indexed on column '{}'".format(len(existing_rows), self.key_column))
+        return existing_rows
 
     def write_row(self, row):
-        if self.write_from_dict:
-            self.list.write_row(row)
+        if not self.write_from_dict:
+            row = self.convert_row(row)
+        self.write_converted_row(row)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def write_dataframe(self, dataframe):
+        # Columns of the DataFrame are matched to the schema by name, the other ones are ignored
+        for row in get_dataframe_rows(dataframe, self.columns):
+            self.write_converted_row(row)
+
+    def write_converted_row(self, row):
+        if self.write_mode == SharePointConstants.WRITE_MODE_UPSERT:
+            self.upsert_row(row)
         else:
-            self.list.write_row(prepare_row(row, self.columns))
+            self.list.write_row(row)
+
+    def upsert_row(self, row):
+        key = row.get(self.key_column)
+        if key is None:
+            raise Exception("Row has no value for the key column '{}'".format(self.key_column))
+        key = get_row_key(key)
+        existing_row = self.existing_rows.get(key)
+        if existing_row is None:
+            self.list.write_row(row)
+            self.existing_rows[key] = (None, row)
+            return
+        item_id, existing_fields = existing_row
+        if item_id is None:
+            logger.warning("Key '{}' appears more than once in the written rows, only its first row is kept".format(key))
+            return
+        changed_fields = get_changed_fields(row, existing_fields)
+        if changed_fields:
+            self.list.update_row(item_id, changed_fields)
+            existing_fields.update(changed_fields)
 
     def close(self):
         self.list.session.close()
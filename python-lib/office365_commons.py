@@ -1,9 +1,14 @@
-from datetime import datetime
+import gzip
+import json
+import re
+from datetime import datetime, timedelta, timezone
 from safe_logger import SafeLogger
-import requests
+from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
 
 
 logger = SafeLogger("office-365 plugin", [])
+ISO_DATE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:\d{2})?$")
 
 
 class RecordsLimit():
@@ -18,6 +23,21 @@ class RecordsLimit():
         self.counter += 1
         return self.counter > self.records_limit
 
+    def is_exhausted(self):
+        # True once records_limit records have been counted, before the next one is even fetched
+        if self.has_no_limit:
+            return False
+        return self.counter >= self.records_limit
+
+
+def get_bounded_records_limit(limit, max_records):
+    # A negative limit would mean no limit at all for RecordsLimit, so it is always kept within [1, max_records]
+    if limit is None:
+        return max_records
+    if isinstance(limit, bool) or not isinstance(limit, int):
+        raise Exception("The limit must be an integer, got {}".format(repr(limit)))
+    return max(1, min(limit, max_records))
+
 
 def get_credentials_from_config(config):
     auth_token = config.get("sharepoint_oauth", {}).get("sharepoint_oauth")
@@ -81,20 +101,34 @@ def get_next_page_url(json_response):
     return json_response.get("@odata.nextLink", None)
 
 
+def get_json_response(response):
+    # In batch mode, the request is only queued and its batch id is returned instead of a response
+    if isinstance(response, str):
+        return response
+    return response.json()
+
+
+def is_deleted_item(item):
+    # Delta queries flag removed entries with a deleted facet or an @removed annotation
+    return "deleted" in item or "@removed" in item
+
+
 def get_error(response):
     error_message = None
-    if type(response) != requests.Response:
+    # requests.Response, or httpx.Response for the asyncio session
+    if not hasattr(response, "status_code"):
         error_message = "Incorrect response type"
     else:
         status_code = response.status_code
         if status_code >= 400:
             error_message = "Error {} while accessing {}".format(status_code, response.url)
-        try:
-            json_response = response.json()
-            enriched_error_message = json_response.get("error", "").get("message", "")
-            error_message += ". {}".format(enriched_error_message)
-        except Exception as sub_error_message:
-            logger.debug("Could not decode json: {}".format(sub_error_message))
+            # Only error bodies are decoded, so that streamed contents are left untouched
+            try:
+                json_response = response.json()
+                enriched_error_message = json_response.get("error", "").get("message", "")
+                error_message += ". {}".format(enriched_error_message)
+            except Exception as sub_error_message:
+                logger.debug("Could not decode json: {}".format(sub_error_message))
     if error_message:
         logger.error(error_message)
         logger.error("Dumping content: {}".format(response.content))
@@ -102,27 +136,179 @@ def get_error(response):
 
 
 def is_throttling(response):
-    return response.status_code == 429
+    # SharePoint answers 503 instead of 429 when it throttles at the farm level
+    return response.status_code in [429, 503]
 
 
-def get_retry_after_value(response):
+def get_retry_after_value(response, default=30):
     retry_after_value = response.headers.get("Retry-After")
     if retry_after_value:
         return int(retry_after_value)
-    return 30
+    return default
+
+
+def get_compressed_request_kwargs(kwargs, min_body_size=None):
+    # Gzips the JSON body once it is large enough for the compression to pay off
+    min_body_size = min_body_size or SharePointConstants.GZIP_MIN_BODY_SIZE
+    if kwargs.get("json") is None:
+        return kwargs
+    body = json.dumps(kwargs.get("json")).encode("utf-8")
+    if len(body) < min_body_size:
+        return kwargs
+    compressed_kwargs = dict(kwargs)
+    compressed_kwargs.pop("json")
+    compressed_kwargs["data"] = gzip.compress(body, compresslevel=DSSConstants.GZIP_COMPRESS_LEVEL)
+    compressed_kwargs["headers"] = dict(kwargs.get("headers") or {})
+    compressed_kwargs["headers"]["Content-Type"] = DSSConstants.APPLICATION_JSON
+    compressed_kwargs["headers"]["Content-Encoding"] = "gzip"
+    return compressed_kwargs
+
+
+def is_retryable_batch_response(batch_response):
+    return int(batch_response.get("status", 200)) in SharePointConstants.RETRYABLE_STATUS_CODES
+
+
+def is_throttling_batch_response(batch_response):
+    return int(batch_response.get("status", 200)) in [429, 503]
+
+
+def get_batch_response_retry_after(batch_response):
+    headers = batch_response.get("headers") or {}
+    retry_after_value = headers.get("Retry-After")
+    if retry_after_value:
+        return int(retry_after_value)
+    return None
 
 
 def prepare_row(row, columns):
-    prepared_row = {}
-    for item, column in zip(row, columns):
-        column_type = column.get("type")
-        if column_type == "int":
-            prepared_row[column.get("name")] = int(item)
-        elif column_type == "float":
-            prepared_row[column.get("name")] = float(item)
-        else:
-            prepared_row[column.get("name")] = str(item)
-    return prepared_row
+    return get_row_converter(columns)(row)
+
+
+def get_row_converter(columns):
+    # The cell converters are picked once per schema instead of once per cell
+    converters = [(column.get("name"), get_cell_converter(column.get("type"))) for column in columns]
+
+    def convert_row(row):
+        return {name: convert_cell(item) for (name, convert_cell), item in zip(converters, row)}
+    return convert_row
+
+
+def get_cell_converter(column_type):
+    if column_type in DSSConstants.INTEGER_TYPES:
+        convert_value = int
+    elif column_type in DSSConstants.FLOAT_TYPES:
+        convert_value = float
+    elif column_type in DSSConstants.DATE_TYPES:
+        convert_value = format_dss_date
+    else:
+        convert_value = str
+
+    def convert_cell(item):
+        if is_null(item):
+            return None
+        return convert_value(item)
+    return convert_cell
+
+
+def is_null(item):
+    # NaN and NaT are the only values not equal to themselves
+    return item is None or (item != item) is True
+
+
+def format_dss_date(item):
+    if not hasattr(item, "strftime"):
+        return str(item)
+    if getattr(item, "tzinfo", None) is not None:
+        item = item.astimezone(timezone.utc)
+    return item.strftime(DSSConstants.DATE_FORMAT)
+
+
+def get_dataframe_rows(dataframe, columns, chunk_size=None):
+    """
+    Yields the rows of a pandas DataFrame as dicts ready to be written, for the schema columns it contains.
+    Each column is converted as a whole, chunk_size rows at a time, instead of cell by cell.
+    """
+    chunk_size = chunk_size or DSSConstants.DATAFRAME_CHUNK_SIZE
+    columns = [column for column in columns if column.get("name") in dataframe.columns]
+    column_names = [column.get("name") for column in columns]
+    for start in range(0, len(dataframe.index), chunk_size):
+        chunk = dataframe.iloc[start:start + chunk_size]
+        columns_values = [get_series_values(chunk[column.get("name")], column.get("type")) for column in columns]
+        for row_values in zip(*columns_values):
+            yield dict(zip(column_names, row_values))
+
+
+def get_series_values(series, column_type):
+    is_null_value = series.isna()
+    if column_type in DSSConstants.INTEGER_TYPES:
+        series = series.fillna(0).astype("int64")
+    elif column_type in DSSConstants.FLOAT_TYPES:
+        series = series.astype("float64")
+    elif column_type in DSSConstants.DATE_TYPES and str(series.dtype).startswith("datetime64"):
+        if series.dt.tz is not None:
+            series = series.dt.tz_convert("UTC")
+        series = series.dt.strftime(DSSConstants.DATE_FORMAT)
+    elif column_type in DSSConstants.DATE_TYPES:
+        series = series.map(format_dss_date, na_action="ignore")
+    else:
+        series = series.astype(str)
+    # tolist() returns python ints, floats and strs, which json can serialize
+    values = series.tolist()
+    if is_null_value.any():
+        values = [None if is_null_cell else value for value, is_null_cell in zip(values, is_null_value.tolist())]
+    return values
+
+
+def get_changed_fields(new_fields, existing_fields):
+    changed_fields = {}
+    for field_name, new_value in new_fields.items():
+        if not is_same_value(new_value, existing_fields.get(field_name)):
+            changed_fields[field_name] = new_value
+    return changed_fields
+
+
+def is_same_value(first_value, second_value):
+    # SharePoint returns numbers as int or float whatever the column definition
+    if is_number(first_value) and is_number(second_value):
+        return float(first_value) == float(second_value)
+    if first_value is None or second_value is None:
+        return first_value is None and second_value is None
+    # Dates are written as 2024-01-02T03:04:05.000000Z but read back as 2024-01-02T03:04:05Z
+    first_date = get_utc_date(first_value)
+    if first_date is not None:
+        return first_date == get_utc_date(second_value)
+    return "{}".format(first_value) == "{}".format(second_value)
+
+
+def get_utc_date(value):
+    # Returns the naive UTC datetime of an ISO 8601 date string, or None if value is not one
+    if not isinstance(value, str):
+        return None
+    match = ISO_DATE_PATTERN.match(value)
+    if not match:
+        return None
+    date_time, fraction, time_zone = match.groups()
+    try:
+        utc_date = datetime.strptime(date_time, "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
+    # Graph returns up to 7 fractional digits, more than a datetime can hold
+    utc_date = utc_date.replace(microsecond=int((fraction or "0")[:6].ljust(6, "0")))
+    if time_zone and time_zone != "Z":
+        offset = timedelta(hours=int(time_zone[1:3]), minutes=int(time_zone[4:6]))
+        utc_date = utc_date - offset if time_zone[0] == "+" else utc_date + offset
+    return utc_date
+
+
+def get_row_key(value):
+    # Same numeric rule as is_same_value, so that a key read back as 1.0 matches a row written with 1
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return "{}".format(value)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
 def assert_response_ok(response, context=None):
@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+
+class Office365DeltaStateStore(object):
+    """
+    Keeps the @odata.deltaLink of each synced collection between runs.
+    Subclass it to store the links somewhere else (DSS project variables, a managed folder...).
+    """
+    def get_delta_link(self, state_key):
+        raise NotImplementedError()
+
+    def set_delta_link(self, state_key, delta_link):
+        raise NotImplementedError()
+
+    def delete_delta_link(self, state_key):
+        raise NotImplementedError()
+
+
+class InMemoryDeltaStateStore(Office365DeltaStateStore):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.delta_links = {}
+
+    def get_delta_link(self, state_key):
+        with self.lock:
+            return self.delta_links.get(state_key)
+
+    def set_delta_link(self, state_key, delta_link):
+        with self.lock:
+            self.delta_links[state_key] = delta_link
+
+    def delete_delta_link(self, state_key):
+        with self.lock:
+            self.delta_links.pop(state_key, None)
+
+
+class JsonFileDeltaStateStore(Office365DeltaStateStore):
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def get_delta_link(self, state_key):
+        with self.lock:
+            return self.load().get(state_key)
+
+    def set_delta_link(self, state_key, delta_link):
+        with self.lock:
+            delta_links = self.load()
+            delta_links[state_key] = delta_link
+            self.save(delta_links)
+
+    def delete_delta_link(self, state_key):
+        with self.lock:
+            delta_links = self.load()
+            delta_links.pop(state_key, None)
+            self.save(delta_links)
+
+    def load(self):
+        try:
+            with open(self.file_path, "r") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, delta_links):
+        temporary_path = "{}.tmp".format(self.file_path)
+        with open(temporary_path, "w") as state_file:
+            json.dump(delta_links, state_file)
+        os.replace(temporary_path, self.file_path)
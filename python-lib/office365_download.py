@@ -0,0 +1,95 @@
+import base64
+import hashlib
+
+
+QUICK_XOR_WIDTH_IN_BYTES = 20
+QUICK_XOR_WIDTH_IN_BITS = QUICK_XOR_WIDTH_IN_BYTES * 8
+QUICK_XOR_SHIFT = 11
+QUICK_XOR_MASK = (1 << QUICK_XOR_WIDTH_IN_BITS) - 1
+# Bytes that are QUICK_XOR_WIDTH_IN_BITS apart in the stream are xored at the same place of the hash
+FOLD_SIZE = QUICK_XOR_WIDTH_IN_BITS
+FOLD_BITS = FOLD_SIZE * 8
+FOLD_MASK = (1 << FOLD_BITS) - 1
+
+
+class QuickXorHash(object):
+    """
+    quickXorHash, the only content hash SharePoint Online and OneDrive for Business expose on drive items.
+    Byte i of the stream is xored into a 160 bits register, rotated left by 11 * i bits.
+    Instead of a per byte loop, the bytes are first xored together per position modulo 160
+    using large integers, and the 160 resulting bytes are spread in the register at digest time.
+    """
+    def __init__(self):
+        self.folded_bytes = 0
+        self.length = 0
+
+    def update(self, data):
+        data = bytes(data)
+        if not data:
+            return
+        padding = (-len(data)) % FOLD_SIZE
+        folded_bytes = int.from_bytes(data + bytes(padding), "little")
+        number_of_blocks = (len(data) + padding) // FOLD_SIZE
+        while number_of_blocks > 1:
+            half = (number_of_blocks + 1) // 2
+            half_bits = half * FOLD_BITS
+            folded_bytes = (folded_bytes & ((1 << half_bits) - 1)) ^ (folded_bytes >> half_bits)
+            number_of_blocks = half
+        rotation = (self.length % FOLD_SIZE) * 8
+        if rotation:
+            folded_bytes = ((folded_bytes << rotation) | (folded_bytes >> (FOLD_BITS - rotation))) & FOLD_MASK
+        self.folded_bytes ^= folded_bytes
+        self.length += len(data)
+
+    def digest(self):
+        register = 0
+        folded_bytes = self.folded_bytes.to_bytes(FOLD_SIZE, "little")
+        for position, byte in enumerate(folded_bytes):
+            if byte:
+                shifted_byte = byte << ((position * QUICK_XOR_SHIFT) % QUICK_XOR_WIDTH_IN_BITS)
+                register ^= (shifted_byte & QUICK_XOR_MASK) | (shifted_byte >> QUICK_XOR_WIDTH_IN_BITS)
+        digest = bytearray(register.to_bytes(QUICK_XOR_WIDTH_IN_BYTES, "little"))
+        # The stream length is xored into the last 8 bytes
+        for index, length_byte in enumerate(self.length.to_bytes(8, "little")):
+            digest[QUICK_XOR_WIDTH_IN_BYTES - 8 + index] ^= length_byte
+        return bytes(digest)
+
+    def b64digest(self):
+        return base64.b64encode(self.digest()).decode("ascii")
+
+
+class Office365ContentHash(object):
+    """Checks a content against the hashes Graph returns in a driveItem's file facet"""
+    def __init__(self, item):
+        hashes = (item.get("file") or {}).get("hashes") or {}
+        self.expected_hash = None
+        self.hasher = None
+        if hashes.get("quickXorHash"):
+            self.expected_hash = hashes.get("quickXorHash")
+            self.hasher = QuickXorHash()
+            self.get_hash = self.hasher.b64digest
+        elif hashes.get("sha256Hash"):
+            self.expected_hash = hashes.get("sha256Hash").upper()
+            self.hasher = hashlib.sha256()
+            self.get_hash = lambda: self.hasher.hexdigest().upper()
+        elif hashes.get("sha1Hash"):
+            self.expected_hash = hashes.get("sha1Hash").upper()
+            self.hasher = hashlib.sha1()
+            self.get_hash = lambda: self.hasher.hexdigest().upper()
+
+    def update(self, data):
+        if self.hasher:
+            self.hasher.update(data)
+
+    def assert_hash_ok(self, context):
+        if not self.hasher:
+            return
+        computed_hash = self.get_hash()
+        if computed_hash != self.expected_hash:
+            raise Exception("Hash mismatch for {}, expected {} but got {}".format(context, self.expected_hash, computed_hash))
+
+
+def get_byte_ranges(file_size, range_size):
+    return [
+        (start, min(start + range_size, file_size) - 1) for start in range(0, file_size, range_size)
+    ]
@@ -1,19 +1,133 @@
-from office365_commons import assert_response_ok
+import requests
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from safe_logger import SafeLogger
+from office365_commons import get_error, get_json_response, get_next_page_url
+from office365_upload import (
+    Office365UploadSource, Office365UploadJournal, get_next_expected_offset, is_retryable_upload_status
+)
+from office365_download import Office365ContentHash, get_byte_ranges
 from sharepoint_constants import SharePointConstants
 from dss_constants import DSSConstants
 
 
-class Office365Drive(object):
+logger = SafeLogger("office-365 plugin", [])
+
+
+class Office365DriveUrls(object):
+    """
+    URL builders of a drive, shared by the sync and the asyncio drive classes.
+    """
     def __init__(self, parent, drive_id):
         self.session = parent
         self.drive_id = drive_id
 
+    def get_item_content_url(self, item_id):
+        url = "/".join(
+            [
+                self.get_item_by_id_url(item_id),
+                "content"
+            ]
+        )
+        return url
+
+    def get_children_url(self, folder_path):
+        if (not folder_path) or (folder_path == "/"):
+            url = self.get_item_url(folder_path) + "/children"
+        else:
+            url = self.get_item_url(folder_path) + ":/children"
+        return url
+
+    def get_delta_url(self):
+        url = "/".join(
+            [
+                self.get_drives_url(),
+                "root",
+                "delta"
+            ]
+        )
+        return url
+
+    def get_item_by_id_children_url(self, item_id):
+        url = "/".join(
+            [
+                self.get_item_by_id_url(item_id),
+                "children"
+            ]
+        )
+        return url
+
+    def get_content_url(self, content_parent_id, content_path):
+        url = "/".join(
+            [
+                self.get_item_by_id_url("{}:".format(content_parent_id)),
+                "{}:".format(content_path),
+                "content"
+            ]
+        )
+        return url
+
+    def get_create_upload_session_url(self, item_id):
+        url = "/".join(
+            [
+                self.get_item_by_id_url(item_id),
+                "createUploadSession"
+            ]
+        )
+        return url
+
+    def get_item_by_id_url(self, item_id):
+        url = "/".join(
+            [
+                self.get_drives_url(),
+                "items",
+                item_id
+            ]
+        )
+        return url
+
+    def get_item_url(self, item_path):
+        if (not item_path) or (item_path == "/"):
+            url = "/".join(
+                [
+                    self.get_drives_url(),
+                    "root/"
+                ]
+            )
+        else:
+            url = "/".join(
+                [
+                    self.get_drives_url(),
+                    "root:/{}".format(item_path)
+                ]
+            )
+        return url
+
+    def get_drives_url(self):
+        return "/".join(
+            [
+                self.session.get_endpoint_url(),
+                "drives",
+                "{}".format(self.drive_id)
+            ]
+        )
+
+
+class Office365Drive(Office365DriveUrls):
+
     def get_item(self, item_path):
         item = self.session.get_item(
             url=self.get_item_url(item_path)
         )
         return item
 
+    def get_item_by_id(self, item_id):
+        item = self.session.get_item(
+            url=self.get_item_by_id_url(item_id)
+        )
+        return item
+
     def get_permission_list(self, item_id):
         url = self.get_item_by_id_url(item_id) + "/permissions"
         list = self.session.get_item(
@@ -42,10 +156,71 @@ class Office365Drive(object):
         ):
             yield item
 
-    def delete_item_by_id(self, item_id):
-        self.session.request(
+    def walk(self, folder_id="root", max_depth=None, item_filter=None, folder_filter=None, max_workers=None):
+        # Yields every item below folder_id as soon as it is listed.
+        # Folders are expanded breadth first, the children listings of up to MAX_BATCH_SIZE folders
+        # being grouped in one $batch, with at most max_workers $batch in flight.
+        # folder_filter decides which folders are expanded, item_filter which items are yielded.
+        max_workers = max_workers or DSSConstants.DEFAULT_BATCH_MAX_WORKERS
+        pending_folders = deque([(folder_id, 0)])
+        running_batches = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending_folders or running_batches:
+                while pending_folders and len(running_batches) < max_workers:
+                    number_of_folders = min(DSSConstants.MAX_BATCH_SIZE, len(pending_folders))
+                    folders = [pending_folders.popleft() for _ in range(number_of_folders)]
+                    running_batches.add(executor.submit(self.get_children_of_folders, folders))
+                done_batches, running_batches = wait(running_batches, return_when=FIRST_COMPLETED)
+                for done_batch in done_batches:
+                    for item, depth in done_batch.result():
+                        should_expand = "folder" in item and (max_depth is None or depth < max_depth)
+                        if should_expand and (folder_filter is None or folder_filter(item)):
+                            pending_folders.append((item.get("id"), depth))
+                        if item_filter is None or item_filter(item):
+                            yield item
+
+    def get_children_of_folders(self, folders):
+        # folders is a list of (folder_id, depth), returns the (child, child depth) of all of them
+        requests_buffer = [
+            {
+                "method": "GET",
+                "url": self.get_item_by_id_children_url(folder_id),
+                "headers": DSSConstants.JSON_HEADERS
+            } for folder_id, _ in folders
+        ]
+        responses = self.session.send_batch(requests_buffer)
+        children = []
+        for (folder_id, depth), response in zip(folders, responses):
+            if int(response.get("status", 200)) >= 400:
+                raise Exception("Could not list the children of folder {}: {} {}".format(
+                    folder_id, response.get("status"), response.get("body")
+                ))
+            body = response.get("body") or {}
+            for child in body.get("value", []):
+                children.append((child, depth + 1))
+            next_page_url = get_next_page_url(body)
+            if next_page_url:
+                for child in self.session.get_next_item(url=next_page_url, force_no_batch=True):
+                    children.append((child, depth + 1))
+        return children
+
+    def get_next_delta_item(self, state_store, state_key=None, params=None, start_from_latest=False, skip_deleted=False):
+        for item in self.session.get_next_delta_item(
+            self.get_delta_url(),
+            state_store,
+            state_key=state_key,
+            params=params,
+            start_from_latest=start_from_latest,
+            skip_deleted=skip_deleted
+        ):
+            yield item
+
+    def delete_item_by_id(self, item_id, depends_on=None):
+        # In batch mode, the returned batch id can be passed as depends_on to the calls that have to run after this one
+        return self.session.request(
             method="DELETE",
-            url=self.get_item_by_id_url(item_id)
+            url=self.get_item_by_id_url(item_id),
+            depends_on=depends_on
         )
 
     def move_item(self, path_from, path_to):
@@ -56,7 +231,7 @@ class Office365Drive(object):
         item_to_id = item_to.get("id")
         return self.move_item_with_id(item_from_id, item_to_id, file_name)
 
-    def move_item_with_id(self, item_from_id, item_to_id, file_name):
+    def move_item_with_id(self, item_from_id, item_to_id, file_name, depends_on=None):
         data = {
             "parentReference": {
                 "id": item_to_id
@@ -69,119 +244,244 @@ class Office365Drive(object):
             method="PATCH",
             url=url,
             headers=headers,
-            json=data
+            json=data,
+            depends_on=depends_on
         )
-        json_response = response.json()
-        return json_response
+        return get_json_response(response)
 
-    def create_empty_item(self, parent_id, path):
+    def create_empty_item(self, parent_id, path, depends_on=None):
         response = self.session.request(
             method="PUT",
-            url=self.get_content_url(parent_id, path)
+            url=self.get_content_url(parent_id, path),
+            depends_on=depends_on
         )
-        json_response = response.json()
-        return json_response
+        return get_json_response(response)
+
+    def create_upload_session(self, item_id, depends_on=None):
+        response = self.session.request(
+            method="POST",
+            url=self.get_create_upload_session_url(item_id),
+            depends_on=depends_on
+        )
+        return get_json_response(response)
 
-    def create_upload_session(self, item_id):
+    def create_upload_session_for_path(self, parent_id, path):
         response = self.session.request(
             method="POST",
-            url=self.get_create_upload_session_url(item_id)
+            url=self.get_create_upload_session_url("{}:/{}:".format(parent_id, path)),
+            force_no_batch=True
         )
         json_response = response.json()
         return json_response
 
-    def write_chunked_file_content(self, upload_url, data, chunk_size=SharePointConstants.FILE_UPLOAD_CHUNK_SIZE):
-        file_size = len(data)
-        save_upload_offset = 0
-        while save_upload_offset < file_size:
-            next_save_upload_offset = save_upload_offset + chunk_size
-            if next_save_upload_offset > file_size:
-                next_save_upload_offset = file_size
-            headers = DSSConstants.JSON_HEADERS
-            headers.update(
-                {
-                    "Content-Range": "bytes {}-{}/{}".format(save_upload_offset, next_save_upload_offset-1, file_size)
+    def upload_file(self, parent_id, path, source, file_size=None, chunk_size=SharePointConstants.FILE_UPLOAD_CHUNK_SIZE,
+                    journal_path=None):
+        # source can be bytes, a file path, a file-like object or an iterator of bytes (file_size is then required)
+        # With a journal_path, an upload interrupted by a previous call resumes from the last byte received by SharePoint
+        with Office365UploadSource(source, file_size=file_size) as upload_source:
+            target = "/".join([self.drive_id, parent_id, path])
+            journal = Office365UploadJournal(journal_path) if journal_path else None
+            upload_state = journal.load(target, upload_source.file_size) if journal else None
+            offset = None
+            if upload_state:
+                offset = self.get_upload_session_offset(upload_state.get("uploadUrl"))
+            if offset is None:
+                upload_session = self.create_upload_session_for_path(parent_id, path)
+                upload_state = {
+                    "target": target,
+                    "fileSize": upload_source.file_size,
+                    "uploadUrl": upload_session.get("uploadUrl"),
+                    "expirationDateTime": upload_session.get("expirationDateTime")
                 }
-            )
-            response = self.session.request(
-                method="PUT",
-                url=upload_url,
-                headers=headers,
-                data=data[save_upload_offset:next_save_upload_offset]
-            )
-            assert_response_ok(response)
-            save_upload_offset = next_save_upload_offset
-
-    def get_children_url(self, folder_path):
-        if (not folder_path) or (folder_path == "/"):
-            url = self.get_item_url(folder_path) + "/children"
-        else:
-            url = self.get_item_url(folder_path) + ":/children"
-        return url
+                offset = 0
+            else:
+                logger.info("Resuming the upload of {} at byte {}".format(path, offset))
+            if journal:
+                journal.update_offset(upload_state, offset)
+            json_response = self.write_upload_source(upload_state, upload_source, chunk_size, offset=offset, journal=journal)
+        if journal:
+            journal.delete()
+        return json_response
 
-    def get_item_by_id_children_url(self, item_id):
-        url = "/".join(
-            [
-                self.get_item_by_id_url(item_id),
-                "children"
-            ]
+    def get_upload_session_offset(self, upload_url):
+        # Returns None if the upload session is gone
+        response = self.session.request(
+            method="GET",
+            url=upload_url,
+            cannot_raise=True,
+            force_no_batch=True
         )
-        return url
+        if response.status_code >= 400:
+            return None
+        return get_next_expected_offset(response.json())
 
-    def get_content_url(self, content_parent_id, content_path):
-        url = "/".join(
-            [
-                self.get_item_by_id_url("{}:".format(content_parent_id)),
-                "{}:".format(content_path),
-                "content"
-            ]
-        )
-        return url
+    def write_chunked_file_content(self, upload_url, data, chunk_size=SharePointConstants.FILE_UPLOAD_CHUNK_SIZE):
+        return self.write_chunked_file_stream(upload_url, data, chunk_size=chunk_size)
 
-    def get_create_upload_session_url(self, item_id):
-        url = "/".join(
-            [
-                self.get_item_by_id_url(item_id),
-                "createUploadSession"
-            ]
-        )
-        return url
+    def write_chunked_file_stream(self, upload_url, source, file_size=None, chunk_size=SharePointConstants.FILE_UPLOAD_CHUNK_SIZE):
+        with Office365UploadSource(source, file_size=file_size) as upload_source:
+            return self.write_upload_source({"uploadUrl": upload_url}, upload_source, chunk_size)
 
-    def get_item_by_id_url(self, item_id):
-        url = "/".join(
-            [
-                self.get_drives_url(),
-                "items",
-                item_id
-            ]
+    def write_upload_source(self, upload_state, upload_source, chunk_size, offset=0, journal=None):
+        upload_url = upload_state.get("uploadUrl")
+        json_response = {}
+        for chunk_offset, chunk in upload_source.get_next_chunk(chunk_size, offset=offset):
+            response = self.write_chunk_with_retries(upload_url, chunk, chunk_offset, upload_source.file_size)
+            if response is not None and response.status_code in [200, 201]:
+                json_response = response.json()
+            if journal:
+                journal.update_offset(upload_state, chunk_offset + len(chunk))
+        return json_response
+
+    def write_chunk_with_retries(self, upload_url, chunk, offset, file_size):
+        attempt = 0
+        while True:
+            try:
+                response = self.write_chunk(upload_url, chunk, offset, file_size)
+            except requests.exceptions.RequestException as error:
+                last_error = error
+            else:
+                if response.status_code < 400:
+                    return response
+                last_error = Exception(get_error(response))
+                if not is_retryable_upload_status(response.status_code):
+                    # An expired session or a rejected request cannot be fixed by sending the bytes again
+                    raise last_error
+            attempt += 1
+            if attempt > SharePointConstants.MAX_RETRIES:
+                raise last_error
+            wait_time = SharePointConstants.WAIT_TIME_BEFORE_RETRY_SEC * 2 ** (attempt - 1)
+            logger.warning("Upload of bytes {}-{} failed ({}), retrying in {} seconds".format(
+                offset, offset + len(chunk) - 1, last_error, wait_time
+            ))
+            time.sleep(wait_time)
+            # The chunk may have been received, entirely or in part, even though its response was lost
+            next_offset = self.get_upload_session_offset(upload_url)
+            if next_offset is None:
+                continue
+            if next_offset >= offset + len(chunk):
+                return None
+            if next_offset < offset:
+                raise Exception("SharePoint expects byte {} which is before the chunk starting at {}".format(next_offset, offset))
+            chunk = chunk[next_offset - offset:]
+            offset = next_offset
+
+    def write_chunk(self, upload_url, chunk, offset, file_size):
+        headers = {
+            "Content-Range": "bytes {}-{}/{}".format(offset, offset + len(chunk) - 1, file_size)
+        }
+        response = self.session.request(
+            method="PUT",
+            url=upload_url,
+            headers=headers,
+            data=chunk,
+            cannot_raise=True,
+            force_no_batch=True
         )
-        return url
+        return response
 
-    def get_item_url(self, item_path):
-        if (not item_path) or (item_path == "/"):
-            url = "/".join(
-                [
-                    self.get_drives_url(),
-                    "root/"
-                ]
-            )
+    def download_item(self, item_id, destination_path, max_workers=None, range_size=SharePointConstants.FILE_DOWNLOAD_RANGE_SIZE):
+        # Large items are fetched as byte ranges downloaded concurrently, each written straight to its place in the file
+        item = self.get_item_by_id(item_id)
+        file_size = item.get("size", 0)
+        max_workers = max_workers or DSSConstants.DEFAULT_DOWNLOAD_MAX_WORKERS
+        with open(destination_path, "wb") as destination_file:
+            destination_file.truncate(file_size)
+        byte_ranges = get_byte_ranges(file_size, range_size)
+        if len(byte_ranges) <= 1 or max_workers <= 1:
+            for start, end in byte_ranges:
+                self.download_range_to_file(item_id, destination_path, start, end)
         else:
-            url = "/".join(
-                [
-                    self.get_drives_url(),
-                    "root:/{}".format(item_path)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(self.download_range_to_file, item_id, destination_path, start, end) for start, end in byte_ranges
                 ]
-            )
-        return url
+                for future in futures:
+                    future.result()
+        self.assert_downloaded_file_ok(item, destination_path)
+        return item
 
-    def get_drives_url(self):
-        return "/".join(
-            [
-                self.session.get_endpoint_url(),
-                "drives",
-                "{}".format(self.drive_id)
-            ]
+    def get_next_content_chunk(self, item_id, max_workers=None, range_size=SharePointConstants.FILE_DOWNLOAD_RANGE_SIZE):
+        # Ranges are prefetched concurrently but yielded in order, at most max_workers ranges are held in memory
+        item = self.get_item_by_id(item_id)
+        content_hash = Office365ContentHash(item)
+        max_workers = max_workers or DSSConstants.DEFAULT_DOWNLOAD_MAX_WORKERS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending_ranges = []
+            for start, end in get_byte_ranges(item.get("size", 0), range_size):
+                pending_ranges.append(executor.submit(self.download_range, item_id, start, end))
+                if len(pending_ranges) > max_workers:
+                    chunk = pending_ranges.pop(0).result()
+                    content_hash.update(chunk)
+                    yield chunk
+            for pending_range in pending_ranges:
+                chunk = pending_range.result()
+                content_hash.update(chunk)
+                yield chunk
+        content_hash.assert_hash_ok(item.get("name"))
+
+    def download_range(self, item_id, start, end):
+        return self.with_download_retries(self.read_range, item_id, start, end)
+
+    def download_range_to_file(self, item_id, destination_path, start, end):
+        return self.with_download_retries(self.write_range_to_file, item_id, destination_path, start, end)
+
+    def with_download_retries(self, download_function, *args):
+        attempt = 0
+        while True:
+            try:
+                return download_function(*args)
+            except Exception as error:
+                attempt += 1
+                if attempt > SharePointConstants.MAX_RETRIES:
+                    raise
+                wait_time = SharePointConstants.WAIT_TIME_BEFORE_RETRY_SEC * 2 ** (attempt - 1)
+                logger.warning("Download failed ({}), retrying in {} seconds".format(error, wait_time))
+                time.sleep(wait_time)
+
+    def read_range(self, item_id, start, end):
+        response = self.get_range_response(item_id, start, end)
+        chunk = response.content
+        if len(chunk) != end - start + 1:
+            raise Exception("Received {} bytes for range {}-{}".format(len(chunk), start, end))
+        return chunk
+
+    def write_range_to_file(self, item_id, destination_path, start, end):
+        response = self.get_range_response(item_id, start, end)
+        written_size = 0
+        with open(destination_path, "r+b") as destination_file:
+            destination_file.seek(start)
+            for block in response.iter_content(chunk_size=SharePointConstants.FILE_DOWNLOAD_BUFFER_SIZE):
+                destination_file.write(block)
+                written_size += len(block)
+        if written_size != end - start + 1:
+            raise Exception("Received {} bytes for range {}-{}".format(written_size, start, end))
+
+    def get_range_response(self, item_id, start, end):
+        # /content redirects to a pre-authenticated download URL, the Range header follows the redirect.
+        # The ranges are of the raw bytes, so the content must not be served compressed.
+        response = self.session.request(
+            method="GET",
+            url=self.get_item_content_url(item_id),
+            headers={"Range": "bytes={}-{}".format(start, end), "Accept-Encoding": "identity"},
+            stream=True,
+            force_no_batch=True
         )
+        if response.status_code != 206 and not (response.status_code == 200 and start == 0):
+            response.close()
+            raise Exception("Range request on item {} returned status {}".format(item_id, response.status_code))
+        return response
+
+    def assert_downloaded_file_ok(self, item, destination_path):
+        content_hash = Office365ContentHash(item)
+        downloaded_size = 0
+        with open(destination_path, "rb") as destination_file:
+            for block in iter(lambda: destination_file.read(SharePointConstants.FILE_DOWNLOAD_RANGE_SIZE), b""):
+                content_hash.update(block)
+                downloaded_size += len(block)
+        if downloaded_size != item.get("size", 0):
+            raise Exception("Downloaded {} bytes of {}, expected {}".format(downloaded_size, item.get("name"), item.get("size")))
+        content_hash.assert_hash_ok(item.get("name"))
 
 
 def split_file_path(file_path):
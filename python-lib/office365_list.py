@@ -1,17 +1,26 @@
-from office365_commons import get_sharepoint_type_descriptor
+import urllib.parse
+from safe_logger import SafeLogger
+from office365_commons import get_sharepoint_type_descriptor, RecordsLimit
+from office365_cache import TTLCache
 from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
 
 
-class Office365List(object):
+logger = SafeLogger("office-365 plugin", [])
+# (lastModifiedDateTime, columns) per list, shared by all the sessions of the process
+COLUMNS_CACHE = TTLCache(ttl=SharePointConstants.COLUMNS_CACHE_TTL_SEC)
+RECORD_COUNTS_CACHE = TTLCache(ttl=SharePointConstants.RECORD_COUNT_CACHE_TTL_SEC)
+
+
+class Office365ListUrls(object):
+    """
+    URL builders of a list, shared by the sync and the asyncio list classes.
+    """
     def __init__(self, parent, list_id):
         self.session = parent.session
         self.list_id = list_id
         self.parent = parent
 
-    def get_columns(self):
-        url = self.get_column_url()
-        return self.session.get_all_items(url=url)
-
     def get_column_url(self):
         url = "/".join(
             [
@@ -22,14 +31,14 @@ class Office365List(object):
         )
         return url
 
-    def get_next_row(self):
-        url = self.get_next_list_row_url()
-        for row in self.session.get_next_item(
-            url=url,
-            params={"expand": "field"},
-            force_no_batch=True
-        ):
-            yield row
+    def get_list_row_delta_url(self):
+        url = "/".join(
+            [
+                self.get_next_list_row_url(),
+                "delta"
+            ]
+        )
+        return url
 
     def get_next_list_row_url(self):
         url = "/".join(
@@ -62,6 +71,104 @@ class Office365List(object):
         )
         return url
 
+    def get_list_row_id_url(self, row_id):
+        url = "/".join(
+            [
+                self.parent.get_site_url(),
+                "lists/{}/items/{}".format(
+                    self.list_id,
+                    row_id
+                )
+            ]
+        )
+        return url
+
+    def get_list_row_fields_url(self, row_id):
+        url = "/".join(
+            [
+                self.get_list_row_id_url(row_id),
+                "fields"
+            ]
+        )
+        return url
+
+
+class Office365List(Office365ListUrls):
+
+    def get_columns(self):
+        url = self.get_column_url()
+        return self.session.get_all_items(url=url)
+
+    def get_cached_columns(self):
+        cache_key = self.get_column_url()
+        _, columns = COLUMNS_CACHE.get_or_compute(cache_key, self.get_columns_if_modified)
+        return columns
+
+    def get_columns_if_modified(self):
+        # Once the TTL expires, the columns are only fetched again if the list was modified since
+        last_modified = self.get_last_modified_date_time()
+        cached_columns = COLUMNS_CACHE.get_stale(self.get_column_url())
+        if cached_columns and last_modified and cached_columns[0] == last_modified:
+            return cached_columns
+        return last_modified, self.get_columns()
+
+    def get_last_modified_date_time(self):
+        sharepoint_list = self.session.get_item(
+            url=self.get_next_list_url(),
+            params={"$select": "lastModifiedDateTime"}
+        )
+        return sharepoint_list.get("lastModifiedDateTime")
+
+    def get_next_row(self, columns=None, filter=None, order_by=None, page_size=None, allow_non_indexed_filter=False,
+                     records_limit=-1):
+        # columns, filter and order_by are pushed to Graph, for instance
+        # columns=["Title", "Status"], filter="fields/Status eq 'Open'", order_by="fields/Modified desc"
+        records_limit = RecordsLimit(records_limit)
+        if records_limit.is_exhausted():
+            return
+        if not records_limit.has_no_limit:
+            # Pages are no larger than the limit, and no page is requested once the limit is reached
+            page_size = min(page_size or records_limit.records_limit, records_limit.records_limit)
+        url = self.get_next_list_row_url()
+        for row in self.session.get_next_item(
+            url=url,
+            params=get_list_items_params(columns=columns, filter=filter, order_by=order_by, page_size=page_size),
+            headers=get_list_items_headers(allow_non_indexed_filter=allow_non_indexed_filter),
+            force_no_batch=True
+        ):
+            if records_limit.is_reached():
+                return
+            yield row
+            if records_limit.is_exhausted():
+                return
+
+    def get_next_delta_row(self, state_store, state_key=None, params=None, start_from_latest=False, skip_deleted=False):
+        for row in self.session.get_next_delta_item(
+            self.get_list_row_delta_url(),
+            state_store,
+            state_key=state_key,
+            params=params,
+            start_from_latest=start_from_latest,
+            skip_deleted=skip_deleted
+        ):
+            yield row
+
+    def get_next_row_id(self, filter=None, allow_non_indexed_filter=False):
+        # Only the item ids are transferred, with the largest page size Graph allows
+        params = {
+            "$select": "id",
+            "$top": DSSConstants.MAX_LIST_ITEMS_PAGE_SIZE
+        }
+        if filter:
+            params["$filter"] = filter
+        for row in self.session.get_next_item(
+            url=self.get_next_list_row_url(),
+            params=encode_odata_params(params),
+            headers=get_list_items_headers(allow_non_indexed_filter=allow_non_indexed_filter),
+            force_no_batch=True
+        ):
+            yield row.get("id")
+
     def add_column(self, name, type, description=None):
         description = "" or description
         data = {
@@ -83,60 +190,120 @@ class Office365List(object):
             raise_on={403: "Check that your Azure app has Sites.Manage.All scope enabled"}
         )
 
-    def write_row(self, row):
+    def write_row(self, row, depends_on=None):
+        # In batch mode, the returned batch id can be passed as depends_on to the calls that have to run after this one
         headers = DSSConstants.JSON_HEADERS
         data = {
             "fields": row,
         }
         url = self.get_next_list_row_url()
-        self.session.request(
+        return self.session.request(
             method="POST",
             url=url,
             headers=headers,
-            json=data
+            json=data,
+            depends_on=depends_on
         )
 
-    def delete_row(self, row_id):
-        self.session.request(
-            method="DELETE",
-            url=self.get_list_row_id_url(row_id)
+    def update_row(self, row_id, fields, depends_on=None):
+        return self.session.request(
+            method="PATCH",
+            url=self.get_list_row_fields_url(row_id),
+            headers=DSSConstants.JSON_HEADERS,
+            json=fields,
+            depends_on=depends_on
         )
 
-    def get_list_row_id_url(self, row_id):
-        url = "/".join(
-            [
-                self.parent.get_site_url(),
-                "lists/{}/items/{}".format(
-                    self.list_id,
-                    row_id
-                )
-            ]
+    def delete_row(self, row_id, depends_on=None):
+        return self.session.request(
+            method="DELETE",
+            url=self.get_list_row_id_url(row_id),
+            depends_on=depends_on
         )
-        return url
 
-    def delete_all_rows(self):
-        self.session.start_batch_mode()
-        for row in self.get_next_row():
-            row_id = row.get("id")
+    def delete_all_rows(self, filter=None, max_workers=None, progress_callback=None, allow_non_indexed_filter=False):
+        # All the ids are read before deleting anything, as paging through a shrinking collection skips items.
+        # progress_callback(number_of_deleted_rows, number_of_rows) is called after each $batch
+        row_ids = list(self.get_next_row_id(filter=filter, allow_non_indexed_filter=allow_non_indexed_filter))
+        number_of_rows = len(row_ids)
+        logger.info("Deleting {} rows from list {}".format(number_of_rows, self.list_id))
+        progress = {"deleted": 0, "logged_tenth": 0}
+
+        def on_batch_done(number_of_deleted_rows):
+            progress["deleted"] += number_of_deleted_rows
+            if progress_callback:
+                progress_callback(progress["deleted"], number_of_rows)
+            tenth = progress["deleted"] * 10 // number_of_rows
+            if tenth > progress["logged_tenth"]:
+                progress["logged_tenth"] = tenth
+                logger.info("{} / {} rows deleted".format(progress["deleted"], number_of_rows))
+
+        self.session.start_batch_mode(
+            batch_size=DSSConstants.MAX_BATCH_SIZE,
+            max_workers=max_workers,
+            on_batch_done=on_batch_done
+        )
+        for row_id in row_ids:
             self.delete_row(row_id)
         self.session.close()
+        return number_of_rows
 
-    def get_record_count(self):
-        url = "/".join(
-            [
-                self.get_next_list_row_url(),
-                "?expand=fields(select=ID)"
-            ]
+    def get_record_count(self, allow_enumeration=False):
+        return RECORD_COUNTS_CACHE.get_or_compute(
+            self.get_next_list_url(),
+            lambda: self.count_records(allow_enumeration=allow_enumeration)
         )
+
+    def count_records(self, allow_enumeration=False):
+        # Graph v1.0 lists have no item count property. $count is asked for first. If it is not honoured,
+        # None is returned, unless allow_enumeration is set: the ids are then counted over pages of 999 ids,
+        # which means reading through the whole list.
         response = self.session.request(
             method="GET",
-            url=url
+            url=self.get_next_list_row_url(),
+            params=encode_odata_params({"$select": "id", "$top": 1, "$count": "true"}),
+            headers={"ConsistencyLevel": "eventual"},
+            cannot_raise=True,
+            force_no_batch=True
         )
-        json_response = None
-        try:
+        if response.status_code < 400:
             json_response = response.json()
-        except Exception as er:
-            print("ALX:error")
-            print("ALX:error {} ".format(er))
-        
-        print("ALX:get_record_count:url={}, response={}".format(url, json_response))
+            if "@odata.count" in json_response:
+                return int(json_response.get("@odata.count"))
+        if not allow_enumeration:
+            logger.warning("$count not honoured on list {} (status {}), its number of items is unknown".format(
+                self.list_id, response.status_code
+            ))
+            return None
+        logger.warning("$count not honoured on list {} (status {}), counting all its item ids instead".format(
+            self.list_id, response.status_code
+        ))
+        return sum(1 for _ in self.get_next_row_id())
+
+
+def get_list_items_params(columns=None, filter=None, order_by=None, page_size=None):
+    params = {}
+    if columns:
+        params["$expand"] = "fields($select={})".format(",".join(columns))
+    else:
+        params["$expand"] = "fields"
+    if filter:
+        params["$filter"] = filter
+    if order_by:
+        params["$orderby"] = order_by
+    if page_size:
+        params["$top"] = min(page_size, DSSConstants.MAX_LIST_ITEMS_PAGE_SIZE)
+    return encode_odata_params(params)
+
+
+def encode_odata_params(params):
+    # Spaces in OData expressions have to be sent as %20, not as +
+    return urllib.parse.urlencode(params, safe="$(),/'=", quote_via=urllib.parse.quote)
+
+
+def get_list_items_headers(allow_non_indexed_filter=False):
+    headers = {}
+    if allow_non_indexed_filter:
+        # Without it, Graph refuses filters and sorts on columns that are not indexed
+        headers["Prefer"] = "HonorNonIndexedQueriesWarningMayFailRandomly"
+    return headers
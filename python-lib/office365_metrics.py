@@ -0,0 +1,201 @@
+import threading
+import time
+import urllib.parse
+from safe_logger import SafeLogger
+from sharepoint_constants import SharePointConstants
+
+
+logger = SafeLogger("office-365 plugin", [])
+
+# Path segments kept as is in endpoint names, the other ones are ids or paths and are replaced by {id}
+GRAPH_PATH_KEYWORDS = {
+    "$batch", "children", "columns", "content", "createUploadSession", "delta", "drive", "drives", "fields",
+    "groups", "items", "lists", "me", "planner", "plans", "root", "sites", "tasks", "v1.0"
+}
+
+
+class Office365Metrics(object):
+    """
+    Counters and latency histograms of the Graph calls made by the sessions sharing this object.
+    Read them with get_snapshot(), get_summary() or get_prometheus_text().
+    With summary_interval set, a summary line is logged at most every summary_interval seconds.
+    """
+    def __init__(self, latency_buckets=None, summary_interval=None):
+        self.lock = threading.Lock()
+        self.latency_buckets = latency_buckets or SharePointConstants.METRICS_LATENCY_BUCKETS_SEC
+        self.summary_interval = summary_interval
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.counters = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "throttled": 0,
+                "throttling_sleep_sec": 0.0,
+                "bytes_sent": 0,
+                "bytes_received": 0,
+                "batches": 0,
+                "batch_sub_requests": 0,
+                "batch_capacity": 0
+            }
+            self.started_at = time.monotonic()
+            self.last_summary_at = self.started_at
+
+    def record_request(self, method, url, status_code, latency, bytes_sent=0, bytes_received=0):
+        # status_code is None when no response was received (timeout, connection error)
+        endpoint = get_endpoint_name(method, url)
+        is_error = status_code is None or status_code >= 400
+        with self.lock:
+            endpoint_metrics = self.endpoints.get(endpoint)
+            if endpoint_metrics is None:
+                endpoint_metrics = {
+                    "count": 0,
+                    "errors": 0,
+                    "latency_sum": 0.0,
+                    "latency_buckets": [0] * len(self.latency_buckets)
+                }
+                self.endpoints[endpoint] = endpoint_metrics
+            endpoint_metrics["count"] += 1
+            endpoint_metrics["latency_sum"] += latency
+            if is_error:
+                endpoint_metrics["errors"] += 1
+            for index, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    endpoint_metrics["latency_buckets"][index] += 1
+                    break
+            self.counters["requests"] += 1
+            self.counters["errors"] += 1 if is_error else 0
+            self.counters["bytes_sent"] += bytes_sent
+            self.counters["bytes_received"] += bytes_received
+        self.log_summary_if_due()
+
+    def record_retry(self, sleep_time, is_throttled=False, number_of_retries=1):
+        # number_of_retries requests retried after one shared sleep, such as the sub-requests of a $batch
+        with self.lock:
+            self.counters["retries"] += number_of_retries
+            if is_throttled:
+                self.counters["throttled"] += number_of_retries
+                self.counters["throttling_sleep_sec"] += sleep_time
+
+    def record_batch(self, number_of_requests, capacity):
+        with self.lock:
+            self.counters["batches"] += 1
+            self.counters["batch_sub_requests"] += number_of_requests
+            self.counters["batch_capacity"] += capacity
+
+    def get_snapshot(self):
+        with self.lock:
+            snapshot = dict(self.counters)
+            snapshot["elapsed_sec"] = time.monotonic() - self.started_at
+            snapshot["batch_fill_ratio"] = get_ratio(self.counters["batch_sub_requests"], self.counters["batch_capacity"])
+            snapshot["endpoints"] = {}
+            for endpoint, endpoint_metrics in self.endpoints.items():
+                snapshot["endpoints"][endpoint] = {
+                    "count": endpoint_metrics["count"],
+                    "errors": endpoint_metrics["errors"],
+                    "latency_sum": endpoint_metrics["latency_sum"],
+                    "latency_avg": get_ratio(endpoint_metrics["latency_sum"], endpoint_metrics["count"]),
+                    "latency_buckets": list(zip(self.latency_buckets, endpoint_metrics["latency_buckets"]))
+                }
+            return snapshot
+
+    def get_summary(self):
+        snapshot = self.get_snapshot()
+        summary = (
+            "Graph calls: {requests} requests ({errors} errors) in {elapsed_sec:.0f}s, {retries} retries, "
+            "{throttled} throttled ({throttling_sleep_sec:.1f}s asleep), {bytes_sent} bytes sent, "
+            "{bytes_received} bytes received, {batches} $batch ({batch_fill_ratio:.0%} full)"
+        ).format(**snapshot)
+        slowest_endpoints = sorted(
+            snapshot["endpoints"].items(), key=lambda endpoint: endpoint[1]["latency_sum"], reverse=True
+        )[:SharePointConstants.METRICS_SUMMARY_ENDPOINTS]
+        if slowest_endpoints:
+            summary += ". Slowest: " + ", ".join(
+                "{} {}x{:.2f}s".format(endpoint, metrics["count"], metrics["latency_avg"])
+                for endpoint, metrics in slowest_endpoints
+            )
+        return summary
+
+    def log_summary_if_due(self):
+        if not self.summary_interval:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_summary_at < self.summary_interval:
+                return
+            self.last_summary_at = now
+        logger.info(self.get_summary())
+
+    def get_prometheus_text(self):
+        snapshot = self.get_snapshot()
+        lines = []
+        counters = [
+            ("requests", "office365_requests_total", "counter", "Graph requests sent, batch sub-requests excluded"),
+            ("errors", "office365_request_errors_total", "counter", "Graph requests that failed or got a status >= 400"),
+            ("retries", "office365_retries_total", "counter", "Requests and batch sub-requests sent again"),
+            ("throttled", "office365_throttled_total", "counter", "Retries caused by throttling"),
+            ("throttling_sleep_sec", "office365_throttling_sleep_seconds_total", "counter", "Time spent waiting after throttling"),
+            ("bytes_sent", "office365_bytes_sent_total", "counter", "Request body bytes sent"),
+            ("bytes_received", "office365_bytes_received_total", "counter", "Response body bytes received"),
+            ("batches", "office365_batches_total", "counter", "$batch requests sent"),
+            ("batch_sub_requests", "office365_batch_sub_requests_total", "counter", "Sub-requests sent in $batch requests"),
+            ("batch_fill_ratio", "office365_batch_fill_ratio", "gauge", "Sub-requests per $batch over the $batch capacity"),
+        ]
+        for key, name, metric_type, description in counters:
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            lines.append("{} {}".format(name, snapshot[key]))
+        name = "office365_request_duration_seconds"
+        lines.append("# HELP {} Latency of the Graph requests per endpoint".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for endpoint, endpoint_metrics in sorted(snapshot["endpoints"].items()):
+            label = 'endpoint="{}"'.format(escape_label_value(endpoint))
+            cumulated_count = 0
+            for bucket, count in endpoint_metrics["latency_buckets"]:
+                cumulated_count += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, label, bucket, cumulated_count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, label, endpoint_metrics["count"]))
+            lines.append("{}_sum{{{}}} {}".format(name, label, endpoint_metrics["latency_sum"]))
+            lines.append("{}_count{{{}}} {}".format(name, label, endpoint_metrics["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def get_endpoint_name(method, url):
+    # GET https://graph.microsoft.com/v1.0/sites/abc,def/lists/123/items?$top=10 -> GET sites/{id}/lists/{id}/items
+    path = urllib.parse.urlparse(url or "").path
+    segments = [segment for segment in path.split("/") if segment]
+    if "v1.0" in segments:
+        segments = segments[segments.index("v1.0") + 1:]
+    segments = [segment if segment in GRAPH_PATH_KEYWORDS else "{id}" for segment in segments]
+    return "{} {}".format(method or "GET", "/".join(segments))
+
+
+def get_body_size(body):
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    if isinstance(body, memoryview):
+        return body.nbytes
+    return 0
+
+
+def get_ratio(numerator, denominator):
+    return float(numerator) / denominator if denominator else 0.0
+
+
+def escape_label_value(label_value):
+    return label_value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+default_metrics = None
+default_metrics_lock = threading.Lock()
+
+
+def get_default_metrics():
+    global default_metrics
+    with default_metrics_lock:
+        if default_metrics is None:
+            default_metrics = Office365Metrics()
+        return default_metrics
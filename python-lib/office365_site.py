@@ -2,12 +2,42 @@ from office365_list import Office365List
 import urllib.parse
 
 
-class Office365Site(object):
-
+class Office365SiteUrls(object):
+    """
+    URL builders of a site, shared by the sync and the asyncio site classes.
+    """
     def __init__(self, parent, site_id):
         self.session = parent
         self.site_id = site_id
 
+    def get_lists_url(self):
+        return "/".join(
+            [
+                self.get_site_url(),
+                "lists"
+            ]
+        )
+
+    def get_drives_url(self):
+        return "/".join(
+            [
+                self.get_site_url(),
+                "drives"
+            ]
+        )
+
+    def get_site_url(self):
+        return "/".join(
+            [
+                self.session.get_endpoint_url(),
+                "sites",
+                "{}".format(self.site_id)
+            ]
+        )
+
+
+class Office365Site(Office365SiteUrls):
+
     def get_list(self, list_id):
         return Office365List(self, list_id)
 
@@ -26,34 +56,13 @@ class Office365Site(object):
         return None
 
     def get_next_list(self):
-        url = "/".join(
-            [
-                self.get_site_url(),
-                "lists"
-            ]
-        )
         for list in self.session.get_next_item(
-            url=url
+            url=self.get_lists_url()
         ):
             yield list
 
     def get_next_drive(self):
-        url = "/".join(
-            [
-                self.get_site_url(),
-                "drives"
-            ]
-        )
         for drive in self.session.get_next_item(
-            url=url
+            url=self.get_drives_url()
         ):
             yield drive
-
-    def get_site_url(self):
-        return "/".join(
-            [
-                self.session.get_endpoint_url(),
-                "sites",
-                "{}".format(self.site_id)
-            ]
-        )
@@ -0,0 +1,163 @@
+import json
+import random
+import threading
+import time
+from safe_logger import SafeLogger
+from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
+
+
+logger = SafeLogger("office-365 plugin", [])
+
+
+class Office365ThrottlingGovernor(object):
+    """
+    Token bucket shared by all the sessions of the process.
+    It starts wide open, and is only tightened by Graph's own signals: RateLimit-* headers, 429 or 503.
+    The refill rate is then adjusted with AIMD: it grows by a step per request that went through
+    and is cut by a factor when Graph throttles, so that concurrent callers slow down together.
+    """
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None, burst=None,
+                 increase_step=None, decrease_factor=None, max_retry_time=None):
+        self.lock = threading.Lock()
+        self.min_rate = min_rate or SharePointConstants.THROTTLING_MIN_RATE
+        self.max_rate = max_rate or SharePointConstants.THROTTLING_MAX_RATE
+        self.rate = initial_rate or self.max_rate
+        self.burst = burst or SharePointConstants.THROTTLING_BURST
+        self.increase_step = increase_step or SharePointConstants.THROTTLING_INCREASE_STEP
+        self.decrease_factor = decrease_factor or SharePointConstants.THROTTLING_DECREASE_FACTOR
+        self.max_retry_time = max_retry_time or SharePointConstants.THROTTLING_MAX_RETRY_TIME_SEC
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+
+    def reserve(self, cost=1):
+        # Takes cost tokens and returns how long the caller has to wait before sending its request
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens -= cost
+            wait_time = max(0, self.blocked_until - now)
+            if self.tokens < 0:
+                wait_time = max(wait_time, -self.tokens / self.rate)
+            return wait_time
+
+    def acquire(self, cost=1):
+        wait_time = self.reserve(cost=cost)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def on_success(self, headers=None, cost=1):
+        # A $batch of n sub-requests earns as much as n single requests
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step * cost)
+            if headers:
+                self.apply_rate_limit_headers(headers)
+
+    def apply_rate_limit_headers(self, headers):
+        # SharePoint sends RateLimit-* headers once 80% of the quota is consumed, before any 429
+        remaining = get_int_header(headers, "RateLimit-Remaining")
+        reset = get_int_header(headers, "RateLimit-Reset")
+        if remaining is None or not reset:
+            return
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            return
+        self.rate = max(self.min_rate, min(self.rate, float(remaining) / reset))
+
+    def on_throttled(self, retry_after, attempt, started_at):
+        """
+        Slows the whole process down and returns how long the throttled caller must sleep.
+        Raises once the caller has spent more than max_retry_time seconds retrying.
+        """
+        sleep_time = self.get_retry_sleep_time(retry_after, attempt, started_at)
+        if retry_after is None:
+            retry_after = sleep_time
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = min(self.tokens, 0)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.warning("SharePoint is throttling, rate lowered to {:.2f} requests/s. Sleeping for {:.1f} seconds".format(
+            self.rate, sleep_time
+        ))
+        return sleep_time
+
+    def get_retry_sleep_time(self, retry_after, attempt, started_at):
+        # Back off without touching the rate, for failures that are not throttling such as 504
+        if retry_after is None:
+            retry_after = min(
+                SharePointConstants.WAIT_TIME_BEFORE_RETRY_SEC * 2 ** attempt,
+                SharePointConstants.DEFAULT_WAIT_BEFORE_RETRY
+            )
+        # Jitter keeps the callers throttled at the same time from retrying in sync
+        sleep_time = retry_after + random.uniform(0, retry_after * SharePointConstants.THROTTLING_JITTER_RATIO + 1)
+        elapsed = time.monotonic() - started_at
+        if elapsed + sleep_time > self.max_retry_time:
+            raise Exception("SharePoint kept throttling or failing for {:.0f} seconds, giving up after {} attempts".format(
+                elapsed, attempt
+            ))
+        return sleep_time
+
+
+def get_int_header(headers, header_name):
+    header_value = headers.get(header_name)
+    try:
+        return int(header_value)
+    except (TypeError, ValueError):
+        return None
+
+
+default_governor = None
+default_governor_lock = threading.Lock()
+
+
+def get_default_governor():
+    global default_governor
+    with default_governor_lock:
+        if default_governor is None:
+            default_governor = Office365ThrottlingGovernor()
+        return default_governor
+
+
+class Office365BatchSizer(object):
+    """
+    Decides when the buffered requests make a full $batch: at max_size requests or max_bytes of payload,
+    whichever comes first, or earlier at a target size adjusted from each batch's latency and throttling.
+    """
+    def __init__(self, initial_size=None, max_size=None, max_bytes=None, target_latency=None):
+        self.lock = threading.Lock()
+        self.max_size = min(max_size or DSSConstants.MAX_BATCH_SIZE, DSSConstants.MAX_BATCH_SIZE)
+        self.max_bytes = max_bytes or DSSConstants.MAX_BATCH_BYTES
+        self.target_latency = target_latency or SharePointConstants.BATCH_TARGET_LATENCY_SEC
+        self.target_size = min(initial_size or DSSConstants.DEFAULT_BATCH_SIZE, self.max_size)
+
+    def is_full(self, number_of_requests, number_of_bytes):
+        return number_of_requests >= self.target_size or number_of_bytes >= self.max_bytes
+
+    def would_overflow(self, number_of_bytes, request_bytes):
+        return number_of_bytes + request_bytes > self.max_bytes
+
+    def on_batch_done(self, number_of_requests, latency, is_throttled):
+        with self.lock:
+            if is_throttled:
+                self.target_size = max(1, self.target_size // 2)
+            elif latency > self.target_latency:
+                self.target_size = max(1, self.target_size - 1)
+            elif number_of_requests >= self.target_size:
+                # Only full batches tell whether a larger one would still be fast enough
+                self.target_size = min(self.max_size, self.target_size + 1)
+
+
+def get_batch_request_bytes(request_kwargs):
+    # Approximate size of the sub-request once serialized in the $batch payload
+    request_bytes = len(request_kwargs.get("url") or "") + SharePointConstants.BATCH_REQUEST_OVERHEAD_BYTES
+    if request_kwargs.get("json") is not None:
+        request_bytes += len(json.dumps(request_kwargs.get("json")))
+    if request_kwargs.get("data") is not None:
+        request_bytes += len(request_kwargs.get("data"))
+    return request_bytes
@@ -0,0 +1,113 @@
+import socket
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from sharepoint_constants import SharePointConstants
+
+
+class Office365TransportConfig(object):
+    """
+    Connection pool, keep-alive, timeout and deadline settings of a session.
+    operation_deadline bounds the time spent on one call, throttling waits and retries included.
+    """
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=False,
+                 connect_timeout=None, read_timeout=None, keep_alive=True, keep_alive_idle=None,
+                 operation_deadline=None):
+        self.pool_connections = pool_connections or SharePointConstants.POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or SharePointConstants.POOL_MAXSIZE
+        self.pool_block = pool_block
+        self.connect_timeout = connect_timeout or SharePointConstants.CONNECT_TIMEOUT_SEC
+        self.read_timeout = read_timeout or SharePointConstants.TIMEOUT_SEC
+        self.keep_alive = keep_alive
+        self.keep_alive_idle = keep_alive_idle or SharePointConstants.KEEP_ALIVE_IDLE_SEC
+        self.operation_deadline = operation_deadline
+
+    def get_timeout(self, remaining_time=None):
+        # (connect, read) timeouts, shortened so that a single attempt cannot outlive the deadline
+        connect_timeout = self.connect_timeout
+        read_timeout = self.read_timeout
+        if remaining_time is not None:
+            connect_timeout = min(connect_timeout, remaining_time)
+            read_timeout = min(read_timeout, remaining_time)
+        return connect_timeout, read_timeout
+
+    def get_socket_options(self):
+        socket_options = list(HTTPConnection.default_socket_options)
+        if not self.keep_alive:
+            return socket_options
+        # TCP keep-alive probes detect the pooled connections silently dropped by proxies and load balancers
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keep_alive_idle))
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keep_alive_idle))
+        return socket_options
+
+
+class Office365HTTPAdapter(HTTPAdapter):
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super(Office365HTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super(Office365HTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+def get_transport_session(transport_config):
+    session = requests.Session()
+    adapter = Office365HTTPAdapter(
+        socket_options=transport_config.get_socket_options(),
+        pool_connections=transport_config.pool_connections,
+        pool_maxsize=transport_config.pool_maxsize,
+        pool_block=transport_config.pool_block,
+        max_retries=0
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not transport_config.keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def get_deadline_at(started_at, operation_deadline=None, deadline_at=None):
+    # Earliest of the caller's deadline and the per operation budget, None if there is neither
+    deadlines = [deadline_at]
+    if operation_deadline:
+        deadlines.append(started_at + operation_deadline)
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    return min(deadlines) if deadlines else None
+
+
+def get_remaining_time(deadline_at, context=None):
+    if deadline_at is None:
+        return None
+    remaining_time = deadline_at - time.monotonic()
+    if remaining_time <= 0:
+        raise Exception("Deadline exceeded{}".format(" ({})".format(context) if context else ""))
+    return remaining_time
+
+
+def check_wait_within_deadline(wait_time, deadline_at, context=None):
+    remaining_time = get_remaining_time(deadline_at, context=context)
+    if remaining_time is not None and wait_time > remaining_time:
+        raise Exception("Deadline exceeded{}, {:.1f}s left but {:.1f}s to wait before retrying".format(
+            " ({})".format(context) if context else "", remaining_time, wait_time
+        ))
+
+
+def sleep_within_deadline(wait_time, deadline_at, context=None):
+    check_wait_within_deadline(wait_time, deadline_at, context=context)
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+
+def is_retryable_transport_error(error, method):
+    # A request that timed out while reading may have been applied, only idempotent ones are sent again
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return (method or "GET").upper() in ["GET", "HEAD", "PUT", "DELETE"]
+    return False
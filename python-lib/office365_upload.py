@@ -0,0 +1,219 @@
+import io
+import json
+import mmap
+import os
+from datetime import datetime
+
+
+class Office365UploadSource(object):
+    """
+    Reads an upload source one chunk at a time: bytes, a file path, a file-like object or an iterator of bytes.
+    Chunks are memoryviews over the source (files are mmap-ed) or over one reused chunk buffer,
+    so the memory used is bounded by one chunk whatever the file size.
+    """
+    def __init__(self, source, file_size=None):
+        self.source = source
+        self.file_size = file_size
+        self.file = None
+        self.mmap = None
+        self.view = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.view = memoryview(source).cast("B")
+        elif isinstance(source, (str, os.PathLike)):
+            self.file = open(source, "rb")
+            self.view = self.map_file(self.file)
+        elif hasattr(source, "read"):
+            self.view = self.map_file(source)
+            if self.view is None and self.file_size is None:
+                self.file_size = get_remaining_size(source)
+        if self.view is not None:
+            self.file_size = len(self.view)
+        if self.file_size is None:
+            self.close()
+            raise Exception("The size of the file to upload is required when uploading from a stream or an iterator")
+
+    def map_file(self, file):
+        # The upload starts from the current position of the file
+        try:
+            file_size = os.fstat(file.fileno()).st_size
+            position = file.tell()
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return None
+        if file_size <= position:
+            return memoryview(b"")
+        self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.mmap)[position:]
+
+    def get_next_chunk(self, chunk_size, offset=0):
+        # Yields (offset, chunk) tuples, a chunk is only valid until the next one is requested
+        if self.view is not None:
+            while offset < self.file_size:
+                chunk = self.view[offset:offset + chunk_size]
+                try:
+                    yield offset, chunk
+                finally:
+                    # mmap can only be closed once no view over it is left
+                    chunk.release()
+                offset += chunk_size
+            return
+        buffer = bytearray(chunk_size)
+        buffer_view = memoryview(buffer)
+        if hasattr(self.source, "readinto"):
+            next_chunk_size = self.read_chunk_into
+        elif hasattr(self.source, "read"):
+            next_chunk_size = self.copy_read_chunk_into
+        else:
+            next_chunk_size = self.get_iterator_chunk_filler(iter(self.source))
+        self.skip(offset, next_chunk_size, buffer_view)
+        while offset < self.file_size:
+            size = next_chunk_size(buffer_view)
+            if size == 0:
+                raise Exception("The upload source ended after {} bytes, {} were expected".format(offset, self.file_size))
+            yield offset, buffer_view[:size]
+            offset += size
+
+    def skip(self, offset, next_chunk_size, buffer_view):
+        # When resuming a stream, the bytes already uploaded are skipped
+        if not offset:
+            return
+        if hasattr(self.source, "seekable") and self.source.seekable():
+            self.source.seek(offset, io.SEEK_CUR)
+            return
+        skipped_size = 0
+        while skipped_size < offset:
+            size = next_chunk_size(buffer_view[:min(len(buffer_view), offset - skipped_size)])
+            if size == 0:
+                raise Exception("The upload source ended after {} bytes, cannot resume at {}".format(skipped_size, offset))
+            skipped_size += size
+
+    def read_chunk_into(self, buffer_view):
+        size = 0
+        while size < len(buffer_view):
+            read_size = self.source.readinto(buffer_view[size:])
+            if not read_size:
+                break
+            size += read_size
+        return size
+
+    def copy_read_chunk_into(self, buffer_view):
+        size = 0
+        while size < len(buffer_view):
+            data = self.source.read(len(buffer_view) - size)
+            if not data:
+                break
+            buffer_view[size:size + len(data)] = data
+            size += len(data)
+        return size
+
+    def get_iterator_chunk_filler(self, iterator):
+        pending = [memoryview(b"")]
+
+        def fill_chunk(buffer_view):
+            size = 0
+            while size < len(buffer_view):
+                if not pending[0]:
+                    next_data = next(iterator, None)
+                    if next_data is None:
+                        break
+                    pending[0] = memoryview(next_data).cast("B")
+                    continue
+                copied_size = min(len(pending[0]), len(buffer_view) - size)
+                buffer_view[size:size + copied_size] = pending[0][:copied_size]
+                pending[0] = pending[0][copied_size:]
+                size += copied_size
+            return size
+        return fill_chunk
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Office365UploadJournal(object):
+    """
+    Small local JSON file keeping track of an upload session (upload URL, offset, expiration),
+    so that an interrupted upload resumes where it stopped instead of starting over.
+    """
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+
+    def load(self, target, file_size):
+        # Returns the saved upload state if it is for the same target and file size and has not expired yet
+        try:
+            with open(self.journal_path, "r") as journal_file:
+                upload_state = json.load(journal_file)
+        except (OSError, ValueError):
+            return None
+        if upload_state.get("target") != target or upload_state.get("fileSize") != file_size:
+            return None
+        if is_expired(upload_state.get("expirationDateTime")):
+            return None
+        return upload_state
+
+    def save(self, target, file_size, upload_url, offset, expiration_date_time):
+        upload_state = {
+            "target": target,
+            "fileSize": file_size,
+            "uploadUrl": upload_url,
+            "offset": offset,
+            "expirationDateTime": expiration_date_time
+        }
+        temporary_path = "{}.tmp".format(self.journal_path)
+        with open(temporary_path, "w") as journal_file:
+            json.dump(upload_state, journal_file)
+        os.replace(temporary_path, self.journal_path)
+
+    def update_offset(self, upload_state, offset):
+        upload_state["offset"] = offset
+        self.save(
+            upload_state.get("target"), upload_state.get("fileSize"), upload_state.get("uploadUrl"),
+            offset, upload_state.get("expirationDateTime")
+        )
+
+    def delete(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+def is_expired(expiration_date_time):
+    if not expiration_date_time:
+        return False
+    # Graph can return more fractional digits than %f accepts, only the seconds are kept
+    expiration = datetime.strptime(expiration_date_time[:19], "%Y-%m-%dT%H:%M:%S")
+    return expiration <= datetime.utcnow()
+
+
+def get_next_expected_offset(upload_session_status):
+    next_expected_ranges = upload_session_status.get("nextExpectedRanges") or []
+    if not next_expected_ranges:
+        return None
+    return int(next_expected_ranges[0].split("-")[0])
+
+
+def is_retryable_upload_status(status_code):
+    # 416 means the range does not match what the server received, the chunk is then re-sliced from its next expected byte
+    return status_code == 416 or status_code >= 500
+
+
+def get_remaining_size(file):
+    try:
+        position = file.tell()
+        file.seek(0, io.SEEK_END)
+        end_position = file.tell()
+        file.seek(position)
+        return end_position - position
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import Future
+from safe_logger import SafeLogger
+from office365_throttling import get_batch_request_bytes
+from dss_constants import DSSConstants
+from sharepoint_constants import SharePointConstants
+
+
+logger = SafeLogger("office-365 plugin", [])
+# One queue per list and credentials for the whole process, whichever session or tool instance the rows come from
+LIST_WRITE_QUEUES = {}
+LIST_WRITE_QUEUES_LOCK = threading.Lock()
+
+
+def get_list_write_queue(list):
+    # Rows are only merged between callers acting as the same user and app, and are sent with their credentials
+    queue_key = (list.get_next_list_row_url(), list.session.get_credentials_identity())
+    with LIST_WRITE_QUEUES_LOCK:
+        if queue_key not in LIST_WRITE_QUEUES:
+            LIST_WRITE_QUEUES[queue_key] = Office365ListWriteQueue(list, queue_key=queue_key)
+        return LIST_WRITE_QUEUES[queue_key]
+
+
+def remove_list_write_queue(write_queue):
+    # A caller may still hold the removed queue, its rows are sent all the same
+    with LIST_WRITE_QUEUES_LOCK:
+        if LIST_WRITE_QUEUES.get(write_queue.queue_key) is write_queue:
+            del LIST_WRITE_QUEUES[write_queue.queue_key]
+
+
+class Office365ListWriteQueue(object):
+    """
+    Merges the rows written to one list by concurrent callers into shared $batch requests.
+    A $batch is sent as soon as it is full, or linger seconds after its first row was queued.
+    write_row returns a Future resolved with the created item (its id is in "id"), or failed with the row's error.
+    """
+    def __init__(self, list, linger=None, idle_timeout=None, queue_key=None):
+        self.list = list
+        self.queue_key = queue_key
+        self.session = list.session
+        self.linger = linger or SharePointConstants.WRITE_QUEUE_LINGER_SEC
+        self.idle_timeout = idle_timeout or SharePointConstants.WRITE_QUEUE_IDLE_TIMEOUT_SEC
+        self.condition = threading.Condition()
+        self.pending_rows = []
+        self.pending_bytes = 0
+        self.flusher = None
+
+    def write_row(self, row, deadline_at=None):
+        # deadline_at is the caller's, the queue may belong to the session of another caller
+        future = Future()
+        request_kwargs = {
+            "method": "POST",
+            "url": self.list.get_next_list_row_url(),
+            "headers": DSSConstants.JSON_HEADERS,
+            "json": {"fields": row}
+        }
+        # The caller's deadline goes along with its row, the $batch is sent by another thread
+        queued_row = QueuedRow(request_kwargs, future, deadline_at or self.session.get_deadline_at(time.monotonic()))
+        with self.condition:
+            self.pending_rows.append(queued_row)
+            self.pending_bytes += queued_row.request_bytes
+            if self.flusher is None:
+                # The flusher stops after idle_timeout seconds without rows, and is started again on demand
+                self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+                self.flusher.start()
+            self.condition.notify()
+        return future
+
+    def run_flusher(self):
+        while True:
+            with self.condition:
+                if not self.pending_rows:
+                    self.condition.wait(timeout=self.idle_timeout)
+                    if not self.pending_rows:
+                        self.flusher = None
+                        # Idle queues leave the registry, so that it does not grow with every list and token
+                        remove_list_write_queue(self)
+                        return
+                linger_until = self.pending_rows[0].queued_at + self.linger
+                while not self.is_batch_full():
+                    remaining_time = linger_until - time.monotonic()
+                    if remaining_time <= 0:
+                        break
+                    self.condition.wait(timeout=remaining_time)
+                queued_rows = self.take_batch()
+            self.send_batch(queued_rows)
+
+    def is_batch_full(self):
+        return self.session.batch_sizer.is_full(len(self.pending_rows), self.pending_bytes)
+
+    def take_batch(self):
+        batch_sizer = self.session.batch_sizer
+        queued_rows = []
+        batch_bytes = 0
+        for queued_row in self.pending_rows:
+            if len(queued_rows) >= batch_sizer.target_size:
+                break
+            if queued_rows and batch_sizer.would_overflow(batch_bytes, queued_row.request_bytes):
+                break
+            queued_rows.append(queued_row)
+            batch_bytes += queued_row.request_bytes
+        self.pending_rows = self.pending_rows[len(queued_rows):]
+        self.pending_bytes -= batch_bytes
+        return queued_rows
+
+    def send_batch(self, queued_rows):
+        deadlines = [queued_row.deadline_at for queued_row in queued_rows if queued_row.deadline_at is not None]
+        try:
+            responses = self.session.send_batch(
+                [queued_row.request_kwargs for queued_row in queued_rows],
+                deadline_at=min(deadlines) if deadlines else None
+            )
+        except Exception as error:
+            logger.error("Batch of {} queued rows failed: {}".format(len(queued_rows), error))
+            for queued_row in queued_rows:
+                queued_row.future.set_exception(error)
+            return
+        for queued_row, response in zip(queued_rows, responses):
+            status = int(response.get("status", 200))
+            if status < 400:
+                queued_row.future.set_result(response.get("body") or {})
+            else:
+                queued_row.future.set_exception(Exception("Row could not be written, error {}. {}".format(
+                    status, response.get("body")
+                )))
+
+
+class QueuedRow(object):
+    def __init__(self, request_kwargs, future, deadline_at):
+        self.request_kwargs = request_kwargs
+        self.future = future
+        self.deadline_at = deadline_at
+        self.request_bytes = get_batch_request_bytes(request_kwargs)
+        self.queued_at = time.monotonic()
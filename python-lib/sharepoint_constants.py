@@ -1,6 +1,10 @@
 class SharePointConstants(object):
+    BATCH_REQUEST_OVERHEAD_BYTES = 128
+    BATCH_TARGET_LATENCY_SEC = 10
     COLUMNS = 'columns'
+    COLUMNS_CACHE_TTL_SEC = 300
     COMMENT_COLUMN = 'comment'
+    CONNECT_TIMEOUT_SEC = 10
     DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
     DEFAULT_VIEW_ENDPOINT = "DefaultView/ViewFields"
     DEFAULT_WAIT_BEFORE_RETRY = 60
@@ -10,30 +14,51 @@ class SharePointConstants(object):
     FALLBACK_TYPE = "Text"
     FILE = 0
     FILE_SYSTEM_OBJECT_TYPE = "FileSystemObjectType"
+    FILE_DOWNLOAD_BUFFER_SIZE = 1048576
+    FILE_DOWNLOAD_RANGE_SIZE = 8388608
     FILE_UPLOAD_CHUNK_SIZE = 5242880  # 131072000
     FORM_DIGEST_VALUE = "FormDigestValue"
     GET_CONTEXT_WEB_INFORMATION = "GetContextWebInformation"
     GET_FOLDER_URL_STRUCTURE = "{0}/{1}/_api/Web/GetFolderByServerRelativeUrl('/{1}/{2}{3}')"
     GET_SITE_APP_TOKEN_URL = "https://accounts.accesscontrol.windows.net/{tenant_id}/tokens/OAuth/2"
+    GZIP_MIN_BODY_SIZE = 8192
     HIDDEN_COLUMN = 'Hidden'
+    ID_CACHE_TTL_SEC = 3600
     INTERNAL_NAME = 'InternalName'
+    KEEP_ALIVE_IDLE_SEC = 60
     LENGTH = 'Length'
     LOOKUP_FIELD = 'LookupField'
     MAX_FILE_SIZE_CONTINUOUS_UPLOAD = 262144000
     MAX_RETRIES = 5
     MESSAGE = 'message'
+    METRICS_LATENCY_BUCKETS_SEC = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+    METRICS_SUMMARY_ENDPOINTS = 3
     MOVE_TO = "MoveTo"
     NAME = 'Name'
     NAME_COLUMN = 'name'
     NEXT_PAGE = '__next'
+    POOL_CONNECTIONS = 10
+    POOL_MAXSIZE = 20
+    QUERY_TOOL_MAX_RECORDS = 100
     READ_ONLY_FIELD = 'ReadOnlyField'
+    RECORD_COUNT_CACHE_TTL_SEC = 60
     RENDER_OPTIONS = 5707271
     RESULTS = 'results'
     RESULTS_CONTAINER_V2 = 'd'
+    RETRYABLE_STATUS_CODES = [429, 503, 504]
     SHAREPOINT_ONLINE_RESSOURCE = "00000003-0000-0ff1-ce00-000000000000"
     STATIC_NAME = 'StaticName'
+    THROTTLING_BURST = 200
+    THROTTLING_DECREASE_FACTOR = 0.5
+    THROTTLING_INCREASE_STEP = 0.2
+    THROTTLING_JITTER_RATIO = 0.2
+    THROTTLING_MAX_RATE = 2000
+    THROTTLING_MAX_RETRY_TIME_SEC = 900
+    THROTTLING_MIN_RATE = 0.5
     TIME_LAST_MODIFIED = 'TimeLastModified'
     TITLE_COLUMN = 'Title'
+    TOKEN_REFRESH_MARGIN_SEC = 300
+    TOOL_INVOKE_DEADLINE_SEC = 120
     TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
     TIMEOUT_SEC = 300
     TYPES = {
@@ -53,4 +78,7 @@ class SharePointConstants(object):
     TYPE_COLUMN = 'type'
     VALUE = 'value'
     WRITE_MODE_CREATE = "create"
+    WRITE_MODE_UPSERT = "upsert"
+    WRITE_QUEUE_IDLE_TIMEOUT_SEC = 60
+    WRITE_QUEUE_LINGER_SEC = 0.05
     WAIT_TIME_BEFORE_RETRY_SEC = 2
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import httpx
+import pytest
+from office365_async_client import AsyncOffice365Session, AsyncOffice365List, is_retryable_httpx_error
+from office365_throttling import Office365ThrottlingGovernor
+from office365_metrics import Office365Metrics
+
+
+ENDPOINT_URL = "https://graph.test/v1.0"
+
+
+class FakeGraph(object):
+    """
+    httpx.MockTransport handler. A list of 5 items served 2 per page, $batch sub-requests answered 201
+    unless their id is in throttled_ids (answered 429 the first time they are seen).
+    """
+    def __init__(self, throttled_ids=None, failures=None):
+        self.throttled_ids = set(throttled_ids or [])
+        self.failures = list(failures or [])
+        self.requests = []
+        self.batches = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return httpx.Response(failure)
+        if request.url.path == "/v1.0/$batch":
+            return self.get_batch_response(json.loads(request.content))
+        if request.url.path.endswith("/items") and request.method == "GET":
+            start = int(request.url.params.get("$skiptoken", 0))
+            page = {"value": [{"id": "{}".format(item_id)} for item_id in range(start + 1, min(start + 2, 5) + 1)]}
+            if start + 2 < 5:
+                page["@odata.nextLink"] = "{}/sites/s/lists/l/items?$skiptoken={}".format(ENDPOINT_URL, start + 2)
+            return httpx.Response(200, json=page)
+        return httpx.Response(201, json={"id": "1"})
+
+    def get_batch_response(self, batch):
+        self.batches.append(batch.get("requests"))
+        responses = []
+        for sub_request in batch.get("requests"):
+            title = (sub_request.get("body") or {}).get("fields", {}).get("Title")
+            if title in self.throttled_ids:
+                self.throttled_ids.discard(title)
+                responses.append({"id": sub_request.get("id"), "status": 429, "headers": {"Retry-After": "0"}})
+            else:
+                responses.append({"id": sub_request.get("id"), "status": 201, "body": {"id": title}})
+        return httpx.Response(200, json={"responses": responses})
+
+
+def get_session(fake_graph, **kwargs):
+    session = AsyncOffice365Session(
+        access_token=kwargs.pop("access_token", "token"),
+        governor=Office365ThrottlingGovernor(),
+        metrics=Office365Metrics(),
+        endpoint_url=ENDPOINT_URL,
+        transport=httpx.MockTransport(fake_graph),
+        **kwargs
+    )
+
+    async def sleep_within_deadline(wait_time, deadline_at, context):
+        pass
+    session.sleep_within_deadline = sleep_within_deadline
+    return session
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_get_next_row_follows_pages_up_to_the_limit():
+    fake_graph = FakeGraph()
+
+    async def read_rows():
+        async with get_session(fake_graph) as session:
+            sharepoint_list = session.get_site("s").get_list("l")
+            return [row.get("id") async for row in sharepoint_list.get_next_row(records_limit=3)]
+
+    assert run(read_rows()) == ["1", "2", "3"]
+    assert len(fake_graph.requests) == 2
+
+
+def test_batch_mode_retries_throttled_sub_requests():
+    fake_graph = FakeGraph(throttled_ids=["b"])
+
+    async def write_rows():
+        async with get_session(fake_graph) as session:
+            sharepoint_list = session.get_site("s").get_list("l")
+            session.start_batch_mode(batch_size=20)
+            for title in ["a", "b", "c"]:
+                await sharepoint_list.write_row({"Title": title})
+            await session.close()
+            return session.metrics.get_snapshot()
+
+    snapshot = run(write_rows())
+    assert [len(batch) for batch in fake_graph.batches] == [3, 1]
+    assert fake_graph.batches[1][0].get("body") == {"fields": {"Title": "b"}}
+    assert snapshot.get("throttled") == 1
+
+
+def test_transport_errors_are_retried_for_idempotent_requests():
+    fake_graph = FakeGraph(failures=[httpx.ConnectError("refused"), httpx.ReadTimeout("slow")])
+
+    async def get_item():
+        async with get_session(fake_graph) as session:
+            return (await session.get(url="{}/sites/s/lists/l/items".format(ENDPOINT_URL))).json()
+
+    assert [item.get("id") for item in run(get_item()).get("value")] == ["1", "2"]
+    assert len(fake_graph.requests) == 3
+
+
+def test_read_timeouts_are_not_retried_for_posts():
+    fake_graph = FakeGraph(failures=[httpx.ReadTimeout("slow")])
+
+    async def post_item():
+        async with get_session(fake_graph) as session:
+            await session.request(method="POST", url="{}/sites/s/lists/l/items".format(ENDPOINT_URL), json={})
+
+    with pytest.raises(httpx.ReadTimeout):
+        run(post_item())
+    assert len(fake_graph.requests) == 1
+
+
+def test_retryable_httpx_errors():
+    assert is_retryable_httpx_error(httpx.ConnectTimeout("timeout"), "POST")
+    assert is_retryable_httpx_error(httpx.ReadError("reset"), "GET")
+    assert not is_retryable_httpx_error(httpx.ReadError("reset"), "POST")
+    assert not is_retryable_httpx_error(httpx.DecodingError("invalid"), "GET")
+
+
+def test_rejected_token_is_renewed_and_the_request_replayed():
+    fake_graph = FakeGraph(failures=[401])
+    tokens = ["renewed"]
+
+    async def get_items():
+        async with get_session(fake_graph, access_token="expired", token_provider=tokens.pop) as session:
+            return await session.get(url="{}/sites/s/lists/l/items".format(ENDPOINT_URL))
+
+    assert run(get_items()).status_code == 200
+    assert [request.headers.get("Authorization") for request in fake_graph.requests] == [
+        "Bearer expired", "Bearer renewed"
+    ]
+
+
+def test_async_list_only_exposes_coroutines():
+    assert not hasattr(AsyncOffice365List, "delete_all_rows")
+    assert not hasattr(AsyncOffice365List, "get_record_count")
+    assert asyncio.iscoroutinefunction(AsyncOffice365List.write_row)
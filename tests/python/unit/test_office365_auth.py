@@ -0,0 +1,100 @@
+import base64
+import json
+import threading
+import time
+import requests
+from office365_auth import Office365Auth, get_token_expiration
+
+
+def get_jwt(**claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode("utf-8")).decode("ascii").rstrip("=")
+    return "header.{}.signature".format(payload)
+
+
+class FakeGraphAdapter(requests.adapters.BaseAdapter):
+    """
+    Answers 401 to the requests sent with one of the rejected tokens, 200 to the others.
+    """
+    def __init__(self, rejected_tokens):
+        super(FakeGraphAdapter, self).__init__()
+        self.rejected_tokens = rejected_tokens
+        self.authorizations = []
+
+    def send(self, request, **kwargs):
+        authorization = request.headers.get("Authorization")
+        self.authorizations.append(authorization)
+        response = requests.Response()
+        response.status_code = 401 if authorization[len("Bearer "):] in self.rejected_tokens else 200
+        response._content = b"{}"
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+def get_session(auth, rejected_tokens):
+    session = requests.Session()
+    adapter = FakeGraphAdapter(rejected_tokens)
+    session.mount("https://", adapter)
+    session.auth = auth
+    return session, adapter
+
+
+def test_token_expiration_is_read_from_the_jwt():
+    assert get_token_expiration(get_jwt(exp=1700000000)) == 1700000000
+    assert get_token_expiration("opaque-token") is None
+    assert get_token_expiration(None) is None
+
+
+def test_expiring_token_is_renewed_before_use():
+    expiring_token = get_jwt(exp=int(time.time()) + 10)
+    auth = Office365Auth(access_token=expiring_token, token_provider=lambda: "renewed", refresh_margin=60)
+    assert auth.get_access_token() == "renewed"
+    valid_token = get_jwt(exp=int(time.time()) + 3600)
+    auth = Office365Auth(access_token=valid_token, token_provider=lambda: "renewed", refresh_margin=60)
+    assert auth.get_access_token() == valid_token
+
+
+def test_opaque_token_is_kept_until_rejected():
+    auth = Office365Auth(access_token="opaque", token_provider=lambda: "renewed")
+    assert auth.get_access_token() == "opaque"
+
+
+def test_concurrent_refreshes_share_one_provider_call():
+    calls = []
+
+    def token_provider():
+        calls.append(1)
+        time.sleep(0.05)
+        return "renewed"
+    auth = Office365Auth(access_token="rejected", token_provider=token_provider)
+    threads = [threading.Thread(target=auth.refresh_access_token, args=("rejected",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert auth.access_token == "renewed"
+
+
+def test_rejected_request_is_replayed_with_a_new_token():
+    session, adapter = get_session(Office365Auth(access_token="old", token_provider=lambda: "new"), ["old"])
+    response = session.post("https://graph.test/v1.0/items", json={"fields": {}})
+    assert response.status_code == 200
+    assert adapter.authorizations == ["Bearer old", "Bearer new"]
+    assert response.history[0].status_code == 401
+
+
+def test_request_is_replayed_only_once():
+    session, adapter = get_session(Office365Auth(access_token="old", token_provider=lambda: "new"), ["old", "new"])
+    assert session.get("https://graph.test/v1.0/items").status_code == 401
+    assert adapter.authorizations == ["Bearer old", "Bearer new"]
+
+
+def test_no_replay_without_token_provider():
+    session, adapter = get_session(Office365Auth(access_token="old"), ["old"])
+    assert session.get("https://graph.test/v1.0/items").status_code == 401
+    assert adapter.authorizations == ["Bearer old"]
@@ -0,0 +1,76 @@
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from office365_cache import TTLCache
+
+
+def test_get_or_compute_caches_until_the_ttl_expires():
+    cache = TTLCache(ttl=0.1)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_compute("key", compute) == 1
+    assert cache.get_or_compute("key", compute) == 1
+    time.sleep(0.15)
+    assert cache.get_or_compute("key", compute) == 2
+
+
+def test_get_or_compute_does_not_cache_none():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_compute("key", compute) is None
+    assert cache.get_or_compute("key", compute) is None
+    assert len(calls) == 2
+
+
+def test_invalidate():
+    cache = TTLCache(ttl=60)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    cache.invalidate("first")
+    assert cache.get("first") is None
+    assert cache.get("second") == 2
+    cache.invalidate()
+    assert cache.get("second") is None
+
+
+def test_get_or_compute_is_single_flight():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        values = list(executor.map(lambda _: cache.get_or_compute("key", compute), range(5)))
+    assert values == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_get_or_compute_shares_the_error():
+    cache = TTLCache(ttl=60)
+
+    def compute():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute("key", compute)
+    assert cache.get_or_compute("key", lambda: "value") == "value"
+
+
+def test_get_stale_returns_expired_entries():
+    cache = TTLCache(ttl=0.01)
+    cache.set("key", "value")
+    time.sleep(0.02)
+    assert cache.get("key") is None
+    assert cache.get_stale("key") == "value"
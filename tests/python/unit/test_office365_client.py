@@ -0,0 +1,186 @@
+import pytest
+import office365_client
+from office365_client import Office365Session, split_list_url
+from office365_throttling import Office365ThrottlingGovernor
+from office365_metrics import Office365Metrics
+from office365_delta import InMemoryDeltaStateStore
+from sharepoint_constants import SharePointConstants
+
+
+ITEMS_URL = "https://graph.microsoft.com/v1.0/sites/site-id/lists/list-id/items"
+
+
+class FakeResponse(object):
+    def __init__(self, json_response):
+        self.status_code = 200
+        self.json_response = json_response
+        self.content = b""
+
+    def json(self):
+        return self.json_response
+
+
+class FakeBatchEndpoint(object):
+    """
+    Stands in for send_with_governor on $batch calls.
+    statuses[n] maps the sub-request ids of the n-th $batch to their status, the others succeed.
+    """
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.batches = []
+
+    def __call__(self, cost=1, deadline_at=None, **kwargs):
+        requests = kwargs.get("json").get("requests")
+        round_statuses = self.statuses[len(self.batches)] if len(self.batches) < len(self.statuses) else {}
+        self.batches.append(requests)
+        responses = []
+        for request in requests:
+            status = round_statuses.get(request.get("id"), 201)
+            response = {"id": request.get("id"), "status": status, "body": {"id": request.get("id")}}
+            if status == 429:
+                response["headers"] = {"Retry-After": "0"}
+            responses.append(response)
+        return FakeResponse({"responses": responses})
+
+
+def get_session(monkeypatch, statuses):
+    monkeypatch.setattr(office365_client, "sleep_within_deadline", lambda *args, **kwargs: None)
+    session = Office365Session(access_token="token", governor=Office365ThrottlingGovernor(), metrics=Office365Metrics())
+    batch_endpoint = FakeBatchEndpoint(statuses)
+    session.send_with_governor = batch_endpoint
+    return session, batch_endpoint
+
+
+def get_write_request(batch_id, depends_on=None):
+    request_kwargs = {"method": "POST", "url": ITEMS_URL, "json": {"fields": {"Title": batch_id}}, "batch_id": batch_id}
+    if depends_on:
+        request_kwargs["depends_on"] = depends_on
+    return request_kwargs
+
+
+def test_send_batch_retries_only_failed_sub_requests(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [{"2": 429, "3": 503}])
+    responses = session.send_batch([get_write_request(batch_id) for batch_id in ["1", "2", "3", "4"]])
+    assert [request.get("id") for request in batch_endpoint.batches[1]] == ["2", "3"]
+    assert len(batch_endpoint.batches) == 2
+    assert [response.get("id") for response in responses] == ["1", "2", "3", "4"]
+    assert [response.get("status") for response in responses] == [201, 201, 201, 201]
+
+
+def test_send_batch_does_not_retry_client_errors(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [{"1": 400}])
+    responses = session.send_batch([get_write_request("1"), get_write_request("2")])
+    assert len(batch_endpoint.batches) == 1
+    assert responses[0].get("status") == 400
+
+
+def test_send_batch_gives_up_after_max_retries(monkeypatch):
+    statuses = [{"1": 429}] * (SharePointConstants.MAX_RETRIES + 2)
+    session, batch_endpoint = get_session(monkeypatch, statuses)
+    responses = session.send_batch([get_write_request("1"), get_write_request("2")])
+    assert len(batch_endpoint.batches) == SharePointConstants.MAX_RETRIES + 1
+    assert responses[0].get("status") == 429
+    assert responses[1].get("status") == 201
+
+
+def test_send_batch_counts_retries_per_sub_request(monkeypatch):
+    session, _ = get_session(monkeypatch, [{"1": 429, "2": 429}])
+    session.send_batch([get_write_request(batch_id) for batch_id in ["1", "2", "3"]])
+    snapshot = session.metrics.get_snapshot()
+    assert snapshot.get("retries") == 2
+    assert snapshot.get("throttled") == 2
+
+
+def test_send_batch_requeues_failed_dependencies(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [{"1": 429, "2": 424}])
+    responses = session.send_batch([
+        get_write_request("1"),
+        get_write_request("2", depends_on=["1"]),
+        get_write_request("3")
+    ])
+    retried_requests = batch_endpoint.batches[1]
+    assert [request.get("id") for request in retried_requests] == ["1", "2"]
+    assert retried_requests[1].get("dependsOn") == ["1"]
+    assert [response.get("status") for response in responses] == [201, 201, 201]
+
+
+def test_send_batch_keeps_unrelated_424(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [{"2": 424}])
+    responses = session.send_batch([get_write_request("1"), get_write_request("2", depends_on=["1"])])
+    assert len(batch_endpoint.batches) == 1
+    assert responses[1].get("status") == 424
+
+
+def test_send_batch_drops_dependencies_sent_in_previous_batches(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [])
+    session.send_batch([get_write_request("5", depends_on=["4"])])
+    assert "dependsOn" not in batch_endpoint.batches[0][0]
+
+
+def test_list_calls_can_be_chained_in_one_batch(monkeypatch):
+    session, batch_endpoint = get_session(monkeypatch, [])
+    sharepoint_list = session.get_site("site-id").get_list("list-id")
+    session.start_batch_mode(batch_size=20)
+    batch_id = sharepoint_list.delete_row("1")
+    assert sharepoint_list.write_row({"Title": "Replacement"}, depends_on=batch_id) == "2"
+    session.close()
+    assert len(batch_endpoint.batches) == 1
+    assert [request.get("dependsOn") for request in batch_endpoint.batches[0]] == [None, ["1"]]
+
+
+def test_split_list_url():
+    assert split_list_url("https://contoso.sharepoint.com/sites/Team/Lists/Issues/AllItems.aspx") == (
+        "contoso.sharepoint.com", "sites/Team", "Issues"
+    )
+
+
+def test_split_list_url_with_subsite_and_encoded_name():
+    assert split_list_url(" https://contoso.sharepoint.com/sites/Team/Sub/lists/My%20Issues/ ") == (
+        "contoso.sharepoint.com", "sites/Team/Sub", "My Issues"
+    )
+
+
+def test_split_list_url_of_root_site():
+    assert split_list_url("https://contoso.sharepoint.com/Lists/Issues") == ("contoso.sharepoint.com", "", "Issues")
+
+
+def test_split_list_url_without_list():
+    assert split_list_url("https://contoso.sharepoint.com/sites/Team/Shared%20Documents") == (
+        "contoso.sharepoint.com", None, None
+    )
+    assert split_list_url("https://contoso.sharepoint.com/sites/Team/Lists") == ("contoso.sharepoint.com", None, None)
+
+
+def get_delta_session(pages):
+    # pages maps a delta query url to the json pages it returns
+    session = Office365Session(access_token="token", governor=Office365ThrottlingGovernor(), metrics=Office365Metrics())
+    session.get_next_page = lambda url=None, **kwargs: iter(pages.get(url))
+    return session
+
+
+def test_expired_delta_link_starts_a_full_sync():
+    state_store = InMemoryDeltaStateStore()
+    state_store.set_delta_link(ITEMS_URL, "expired-link")
+    session = get_delta_session({
+        "expired-link": [{"error": {"code": "resyncRequired"}}],
+        ITEMS_URL: [{"value": [{"id": "1"}], "@odata.nextLink": "page-2"}, {"value": [{"id": "2"}], "@odata.deltaLink": "new-link"}]
+    })
+    assert [item.get("id") for item in session.get_next_delta_item(ITEMS_URL, state_store)] == ["1", "2"]
+    assert state_store.get_delta_link(ITEMS_URL) == "new-link"
+
+
+def test_delta_link_is_kept_until_all_pages_are_read():
+    state_store = InMemoryDeltaStateStore()
+    state_store.set_delta_link(ITEMS_URL, "link")
+    session = get_delta_session({"link": [{"value": [{"id": "1"}], "@odata.nextLink": "page-2"}, {"error": {"code": "serviceNotAvailable"}}]})
+    with pytest.raises(Exception):
+        list(session.get_next_delta_item(ITEMS_URL, state_store))
+    assert state_store.get_delta_link(ITEMS_URL) == "link"
+
+
+def test_delta_can_skip_deleted_items():
+    pages = {ITEMS_URL: [{"value": [{"id": "1"}, {"id": "2", "deleted": {}}, {"id": "3", "@removed": {}}]}]}
+    session = get_delta_session(pages)
+    assert len(list(session.get_next_delta_item(ITEMS_URL, InMemoryDeltaStateStore()))) == 3
+    items = session.get_next_delta_item(ITEMS_URL, InMemoryDeltaStateStore(), skip_deleted=True)
+    assert [item.get("id") for item in items] == ["1"]
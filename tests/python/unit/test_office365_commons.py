@@ -0,0 +1,129 @@
+import datetime
+import pandas
+import pytest
+from office365_commons import (
+    format_date, get_bounded_records_limit, get_row_converter, get_series_values, get_changed_fields, get_row_key,
+    get_utc_date
+)
+
+
+def test_changed_fields():
+    new_fields = {"Title": "New", "Count": 3, "Price": 1.5, "Empty": None}
+    existing_fields = {"Title": "Old", "Count": 3.0, "Price": 1.5, "Empty": None, "Other": "x"}
+    assert get_changed_fields(new_fields, existing_fields) == {"Title": "New"}
+
+
+def test_changed_fields_with_missing_and_null_values():
+    assert get_changed_fields({"Title": "New"}, {}) == {"Title": "New"}
+    assert get_changed_fields({"Title": None}, {"Title": "Old"}) == {"Title": None}
+    assert get_changed_fields({"Title": "Old"}, {"Title": None}) == {"Title": "Old"}
+
+
+def test_changed_fields_compares_numbers_and_text():
+    assert get_changed_fields({"Count": 1}, {"Count": "1"}) == {}
+    assert get_changed_fields({"Count": 1}, {"Count": 1.5}) == {"Count": 1}
+    assert get_changed_fields({"Flag": True}, {"Flag": 1}) == {"Flag": True}
+
+
+def test_changed_fields_compares_dates_whatever_their_format():
+    assert get_changed_fields({"Due": "2024-01-02T03:04:05.000000Z"}, {"Due": "2024-01-02T03:04:05Z"}) == {}
+    assert get_changed_fields({"Due": "2024-01-02T04:04:05+01:00"}, {"Due": "2024-01-02T03:04:05Z"}) == {}
+    assert get_changed_fields({"Due": "2024-01-02T03:04:05.000000Z"}, {"Due": "2024-01-02T03:04:06Z"}) == {
+        "Due": "2024-01-02T03:04:05.000000Z"
+    }
+    assert get_changed_fields({"Due": "2024-01-02T03:04:05Z"}, {"Due": "soon"}) == {"Due": "2024-01-02T03:04:05Z"}
+
+
+def test_utc_date():
+    assert get_utc_date("2024-01-02T03:04:05.1234567Z") == get_utc_date("2024-01-02T03:04:05.123456Z")
+    assert get_utc_date("2024-01-02T00:30:00-01:00") == get_utc_date("2024-01-02T01:30:00Z")
+    assert get_utc_date("2024-13-02T03:04:05Z") is None
+    assert get_utc_date("2024-01-02") is None
+    assert get_utc_date(20240102) is None
+
+
+def test_row_key():
+    assert get_row_key(1.0) == get_row_key(1) == "1"
+    assert get_row_key(1.5) == "1.5"
+    assert get_row_key("A") == "A"
+
+
+COLUMNS = [
+    {"name": "Title", "type": "string"},
+    {"name": "Count", "type": "bigint"},
+    {"name": "Price", "type": "double"},
+    {"name": "Due", "type": "date"}
+]
+
+
+def test_format_date_returns_epoch_milliseconds():
+    assert format_date("2024-01-02T03:04:05Z") == 1704164645000
+    assert format_date(None) is None
+
+
+def test_row_converter():
+    convert_row = get_row_converter(COLUMNS)
+    assert convert_row(["Item", "3", 1, datetime.datetime(2024, 1, 2, 3, 4, 5)]) == {
+        "Title": "Item",
+        "Count": 3,
+        "Price": 1.0,
+        "Due": "2024-01-02T03:04:05.000000Z"
+    }
+
+
+def test_row_converter_keeps_nulls():
+    convert_row = get_row_converter(COLUMNS)
+    assert convert_row([None, float("nan"), None, pandas.NaT]) == {
+        "Title": None, "Count": None, "Price": None, "Due": None
+    }
+
+
+def test_row_converter_converts_dates_to_utc():
+    convert_row = get_row_converter([{"name": "Due", "type": "date"}])
+    paris_time = datetime.timezone(datetime.timedelta(hours=1))
+    assert convert_row([datetime.datetime(2024, 1, 2, 3, 0, tzinfo=paris_time)]) == {"Due": "2024-01-02T02:00:00.000000Z"}
+
+
+def test_series_values():
+    assert get_series_values(pandas.Series(["a", 1, None]), "string") == ["a", "1", None]
+    assert get_series_values(pandas.Series([1.0, None, 3.0]), "bigint") == [1, None, 3]
+    assert get_series_values(pandas.Series([1, 2]), "double") == [1.0, 2.0]
+
+
+def test_series_values_of_dates():
+    series = pandas.Series(pandas.to_datetime(["2024-01-02 03:04:05", None]))
+    assert get_series_values(series, "date") == ["2024-01-02T03:04:05.000000Z", None]
+    aware_series = series.dt.tz_localize("Europe/Paris")
+    assert get_series_values(aware_series, "date") == ["2024-01-02T02:04:05.000000Z", None]
+
+
+def test_series_values_are_python_types():
+    values = get_series_values(pandas.Series([1, 2]), "bigint") + get_series_values(pandas.Series([1.5]), "double")
+    assert [type(value) for value in values] == [int, int, float]
+
+
+def test_series_values_match_row_converter():
+    dataframe = pandas.DataFrame({
+        "Title": ["Item", None],
+        "Count": [3, None],
+        "Price": [1.5, 2],
+        "Due": pandas.to_datetime(["2024-01-02", None])
+    })
+    convert_row = get_row_converter(COLUMNS)
+    columns_values = [get_series_values(dataframe[column.get("name")], column.get("type")) for column in COLUMNS]
+    for row_values, row in zip(zip(*columns_values), dataframe.itertuples(index=False)):
+        assert dict(zip([column.get("name") for column in COLUMNS], row_values)) == convert_row(list(row))
+
+
+def test_bounded_records_limit():
+    assert get_bounded_records_limit(None, 50) == 50
+    assert get_bounded_records_limit(10, 50) == 10
+    assert get_bounded_records_limit(500, 50) == 50
+    assert get_bounded_records_limit(0, 50) == 1
+    assert get_bounded_records_limit(-1, 50) == 1
+
+
+def test_bounded_records_limit_must_be_an_integer():
+    for limit in [True, "10", 10.5]:
+        with pytest.raises(Exception):
+            get_bounded_records_limit(limit, 50)
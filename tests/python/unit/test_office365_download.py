@@ -0,0 +1,52 @@
+import base64
+import os
+from office365_download import QuickXorHash, get_byte_ranges
+
+
+def get_reference_quick_xor_hash(data):
+    # Byte by byte transcription of the quickXorHash specification
+    register = 0
+    for index, byte in enumerate(data):
+        shift = (index * 11) % 160
+        shifted_byte = byte << shift
+        register ^= (shifted_byte & ((1 << 160) - 1)) | (shifted_byte >> 160)
+    digest = bytearray(register.to_bytes(20, "little"))
+    for index, length_byte in enumerate(len(data).to_bytes(8, "little")):
+        digest[12 + index] ^= length_byte
+    return base64.b64encode(bytes(digest)).decode("ascii")
+
+
+def get_quick_xor_hash(chunks):
+    quick_xor_hash = QuickXorHash()
+    for chunk in chunks:
+        quick_xor_hash.update(chunk)
+    return quick_xor_hash.b64digest()
+
+
+def test_quick_xor_hash_of_empty_content():
+    assert get_quick_xor_hash([]) == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+    assert get_quick_xor_hash([b""]) == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+
+
+def test_quick_xor_hash_matches_reference():
+    for size in [1, 19, 20, 21, 159, 160, 161, 1000, 4099]:
+        data = os.urandom(size)
+        assert get_quick_xor_hash([data]) == get_reference_quick_xor_hash(data)
+
+
+def test_quick_xor_hash_does_not_depend_on_chunking():
+    data = os.urandom(10000)
+    expected_hash = get_reference_quick_xor_hash(data)
+    for chunk_size in [1, 7, 160, 333, 4096]:
+        chunks = [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+        assert get_quick_xor_hash(chunks) == expected_hash
+
+
+def test_quick_xor_hash_includes_the_length():
+    assert get_quick_xor_hash([bytes(10)]) != get_quick_xor_hash([bytes(11)])
+
+
+def test_get_byte_ranges():
+    assert get_byte_ranges(0, 4) == []
+    assert get_byte_ranges(4, 4) == [(0, 3)]
+    assert get_byte_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
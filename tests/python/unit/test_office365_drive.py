@@ -0,0 +1,58 @@
+from office365_drive import Office365Drive
+
+
+TREE = {
+    "root": [{"id": "a", "folder": {}}, {"id": "f1", "file": {}}],
+    "a": [{"id": "b", "folder": {}}, {"id": "f2", "file": {}}],
+    "b": [{"id": "f3", "file": {}}]
+}
+NEXT_PAGES = {
+    "root": [{"id": "c", "folder": {}}],
+    "c": []
+}
+
+
+class FakeTreeSession(object):
+    """
+    Serves the children listings of TREE through send_batch, the ones of NEXT_PAGES as a second page.
+    """
+    def __init__(self):
+        self.batches = []
+
+    def get_endpoint_url(self):
+        return "https://graph.test/v1.0"
+
+    def send_batch(self, requests_buffer):
+        folder_ids = [request.get("url").split("/")[-2] for request in requests_buffer]
+        self.batches.append(folder_ids)
+        responses = []
+        for folder_id in folder_ids:
+            body = {"value": TREE.get(folder_id, [])}
+            if folder_id in NEXT_PAGES:
+                body["@odata.nextLink"] = "next-page/{}".format(folder_id)
+            responses.append({"status": 200, "body": body})
+        return responses
+
+    def get_next_item(self, url=None, **kwargs):
+        return iter(NEXT_PAGES.get(url.split("/")[-1]))
+
+
+def walk(**kwargs):
+    drive = Office365Drive(FakeTreeSession(), "drive")
+    return sorted(item.get("id") for item in drive.walk(**kwargs)), drive.session.batches
+
+
+def test_walk_yields_every_item_breadth_first():
+    item_ids, batches = walk()
+    assert item_ids == ["a", "b", "c", "f1", "f2", "f3"]
+    assert batches == [["root"], ["a", "c"], ["b"]]
+
+
+def test_walk_stops_at_max_depth():
+    assert walk(max_depth=1)[0] == ["a", "c", "f1"]
+    assert walk(max_depth=2)[0] == ["a", "b", "c", "f1", "f2"]
+
+
+def test_walk_filters():
+    assert walk(folder_filter=lambda item: item.get("id") != "a")[0] == ["a", "c", "f1"]
+    assert walk(item_filter=lambda item: "file" in item)[0] == ["f1", "f2", "f3"]
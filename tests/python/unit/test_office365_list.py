@@ -0,0 +1,88 @@
+import office365_list
+from office365_list import Office365List, get_list_items_params, encode_odata_params
+
+
+class FakeSite(object):
+    def __init__(self, session):
+        self.session = session
+
+    def get_site_url(self):
+        return "https://graph.microsoft.com/v1.0/sites/site-id"
+
+
+class FakeListSession(object):
+    def __init__(self, last_modified):
+        self.last_modified = last_modified
+        self.columns_calls = 0
+
+    def get_item(self, **kwargs):
+        return {"lastModifiedDateTime": self.last_modified}
+
+    def get_all_items(self, **kwargs):
+        self.columns_calls += 1
+        return [{"name": "Title", "version": self.columns_calls}]
+
+
+def test_cached_columns_are_only_fetched_again_if_the_list_changed(monkeypatch):
+    monkeypatch.setattr(office365_list, "COLUMNS_CACHE", office365_list.TTLCache(ttl=0))
+    session = FakeListSession("2024-01-01T00:00:00Z")
+    sharepoint_list = Office365List(FakeSite(session), "list-id")
+    assert sharepoint_list.get_cached_columns() == [{"name": "Title", "version": 1}]
+    assert sharepoint_list.get_cached_columns() == [{"name": "Title", "version": 1}]
+    assert session.columns_calls == 1
+    session.last_modified = "2024-01-02T00:00:00Z"
+    assert sharepoint_list.get_cached_columns() == [{"name": "Title", "version": 2}]
+
+
+def test_list_items_params():
+    assert get_list_items_params() == "$expand=fields"
+    assert get_list_items_params(columns=["Title", "Id"], page_size=10000) == "$expand=fields($select=Title,Id)&$top=999"
+
+
+def test_odata_expressions_keep_their_syntax():
+    params = get_list_items_params(filter="fields/Title eq 'a b'", order_by="fields/Modified desc")
+    assert params == "$expand=fields&$filter=fields/Title%20eq%20'a%20b'&$orderby=fields/Modified%20desc"
+    assert encode_odata_params({"$filter": "fields/Name eq 'R&D'"}) == "$filter=fields/Name%20eq%20'R%26D'"
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, json_response=None):
+        self.status_code = status_code
+        self.json_response = json_response or {}
+
+    def json(self):
+        return self.json_response
+
+
+class FakeCountSession(object):
+    """
+    Answers the $count probe with count_response, and lists number_of_items ids.
+    """
+    def __init__(self, count_response, number_of_items):
+        self.count_response = count_response
+        self.number_of_items = number_of_items
+        self.listed_ids = 0
+
+    def request(self, **kwargs):
+        return self.count_response
+
+    def get_next_item(self, **kwargs):
+        for item_id in range(self.number_of_items):
+            self.listed_ids += 1
+            yield {"id": "{}".format(item_id)}
+
+
+def test_record_count_uses_the_count_probe():
+    session = FakeCountSession(FakeResponse(200, {"@odata.count": 3, "value": []}), 3)
+    assert Office365List(FakeSite(session), "list-id").count_records() == 3
+    assert session.listed_ids == 0
+
+
+def test_record_count_only_enumerates_ids_if_allowed(monkeypatch):
+    monkeypatch.setattr(office365_list, "RECORD_COUNTS_CACHE", office365_list.TTLCache(ttl=60))
+    session = FakeCountSession(FakeResponse(400), 3)
+    sharepoint_list = Office365List(FakeSite(session), "list-id")
+    assert sharepoint_list.get_record_count() is None
+    assert session.listed_ids == 0
+    assert sharepoint_list.get_record_count(allow_enumeration=True) == 3
+    assert session.listed_ids == 3
@@ -0,0 +1,47 @@
+from office365_metrics import Office365Metrics, get_endpoint_name, get_body_size
+
+
+def test_endpoint_names_hide_ids():
+    assert get_endpoint_name("GET", "https://graph.microsoft.com/v1.0/sites/abc,def/lists/123/items?$top=10") == (
+        "GET sites/{id}/lists/{id}/items"
+    )
+    assert get_endpoint_name("POST", "https://graph.microsoft.com/v1.0/$batch") == "POST $batch"
+    assert get_endpoint_name("PUT", "https://contoso.sharepoint.com/upload/session-token") == "PUT {id}/{id}"
+    assert get_endpoint_name(None, None) == "GET "
+
+
+def test_body_size():
+    assert get_body_size(b"abc") == 3
+    assert get_body_size(memoryview(bytearray(8)).cast("d")) == 8
+    assert get_body_size(None) == 0
+
+
+def test_snapshot_counts_requests_per_endpoint():
+    metrics = Office365Metrics(latency_buckets=[0.1, 1])
+    metrics.record_request("GET", "https://graph.microsoft.com/v1.0/sites/a/lists/b/items", 200, 0.05, bytes_received=10)
+    metrics.record_request("GET", "https://graph.microsoft.com/v1.0/sites/c/lists/d/items", 503, 0.5)
+    metrics.record_request("POST", "https://graph.microsoft.com/v1.0/$batch", None, 2, bytes_sent=20)
+    metrics.record_batch(5, 20)
+    snapshot = metrics.get_snapshot()
+    assert (snapshot["requests"], snapshot["errors"], snapshot["bytes_sent"], snapshot["bytes_received"]) == (3, 2, 20, 10)
+    assert snapshot["batch_fill_ratio"] == 0.25
+    items_metrics = snapshot["endpoints"]["GET sites/{id}/lists/{id}/items"]
+    assert (items_metrics["count"], items_metrics["errors"]) == (2, 1)
+    assert items_metrics["latency_buckets"] == [(0.1, 1), (1, 1)]
+
+
+def test_prometheus_text():
+    metrics = Office365Metrics(latency_buckets=[0.1, 1])
+    metrics.record_request("GET", "https://graph.microsoft.com/v1.0/sites/a/lists/b/items", 200, 0.05)
+    metrics.record_request("GET", "https://graph.microsoft.com/v1.0/sites/a/lists/b/items", 200, 5)
+    metrics.record_retry(2, is_throttled=True, number_of_retries=3)
+    lines = metrics.get_prometheus_text().splitlines()
+    assert "# TYPE office365_requests_total counter" in lines
+    assert "office365_requests_total 2" in lines
+    assert "office365_throttled_total 3" in lines
+    assert "office365_throttling_sleep_seconds_total 2.0" in lines
+    label = 'endpoint="GET sites/{id}/lists/{id}/items"'
+    assert 'office365_request_duration_seconds_bucket{{{},le="0.1"}} 1'.format(label) in lines
+    assert 'office365_request_duration_seconds_bucket{{{},le="1"}} 1'.format(label) in lines
+    assert 'office365_request_duration_seconds_bucket{{{},le="+Inf"}} 2'.format(label) in lines
+    assert "office365_request_duration_seconds_count{{{}}} 2".format(label) in lines
@@ -0,0 +1,104 @@
+import time
+import pytest
+from office365_throttling import Office365BatchSizer, Office365ThrottlingGovernor, get_batch_request_bytes
+
+
+def get_governor():
+    return Office365ThrottlingGovernor(min_rate=1, max_rate=100, burst=10, increase_step=0.5, decrease_factor=0.5)
+
+
+def test_governor_starts_open():
+    governor = get_governor()
+    assert governor.rate == 100
+    assert governor.reserve(cost=10) == 0
+
+
+def test_governor_grows_with_cost():
+    governor = get_governor()
+    governor.rate = 10
+    governor.on_success(cost=20)
+    assert governor.rate == 20
+    governor.on_success(cost=1000)
+    assert governor.rate == 100
+
+
+def test_governor_waits_once_the_burst_is_spent():
+    governor = get_governor()
+    governor.rate = 10
+    assert governor.reserve(cost=10) == 0
+    assert governor.reserve(cost=5) == pytest.approx(0.5, abs=0.05)
+
+
+def test_governor_slows_down_when_throttled():
+    governor = get_governor()
+    sleep_time = governor.on_throttled(2, 1, time.monotonic())
+    assert governor.rate == 50
+    assert 2 <= sleep_time <= 3.4
+    assert governor.reserve() >= 1.9
+
+
+def test_governor_follows_rate_limit_headers():
+    governor = get_governor()
+    governor.on_success(headers={"RateLimit-Remaining": "60", "RateLimit-Reset": "30"})
+    assert governor.rate == 2
+    governor.on_success(headers={"RateLimit-Remaining": "0", "RateLimit-Reset": "5"})
+    assert governor.reserve() >= 4.9
+
+
+def test_governor_retry_sleep_keeps_the_rate():
+    governor = get_governor()
+    governor.get_retry_sleep_time(None, 1, time.monotonic())
+    assert governor.rate == 100
+
+
+def test_governor_gives_up_after_max_retry_time():
+    governor = Office365ThrottlingGovernor(max_retry_time=10)
+    with pytest.raises(Exception):
+        governor.on_throttled(30, 1, time.monotonic())
+
+
+def test_batch_sizer_is_full_at_target_size_or_max_bytes():
+    batch_sizer = Office365BatchSizer(initial_size=5, max_size=20, max_bytes=1000)
+    assert not batch_sizer.is_full(4, 999)
+    assert batch_sizer.is_full(5, 0)
+    assert batch_sizer.is_full(1, 1000)
+
+
+def test_batch_sizer_would_overflow():
+    batch_sizer = Office365BatchSizer(max_bytes=1000)
+    assert not batch_sizer.would_overflow(900, 100)
+    assert batch_sizer.would_overflow(900, 101)
+
+
+def test_batch_sizer_never_exceeds_graph_limit():
+    batch_sizer = Office365BatchSizer(initial_size=50, max_size=50)
+    assert batch_sizer.max_size == 20
+    assert batch_sizer.target_size == 20
+
+
+def test_batch_sizer_grows_after_fast_full_batches():
+    batch_sizer = Office365BatchSizer(initial_size=5, max_size=7, target_latency=10)
+    batch_sizer.on_batch_done(5, 1, False)
+    assert batch_sizer.target_size == 6
+    batch_sizer.on_batch_done(3, 1, False)
+    assert batch_sizer.target_size == 6
+    batch_sizer.on_batch_done(6, 1, False)
+    batch_sizer.on_batch_done(7, 1, False)
+    assert batch_sizer.target_size == 7
+
+
+def test_batch_sizer_shrinks_when_slow_or_throttled():
+    batch_sizer = Office365BatchSizer(initial_size=10, max_size=20, target_latency=10)
+    batch_sizer.on_batch_done(10, 11, False)
+    assert batch_sizer.target_size == 9
+    batch_sizer.on_batch_done(9, 1, True)
+    assert batch_sizer.target_size == 4
+    for _ in range(5):
+        batch_sizer.on_batch_done(4, 1, True)
+    assert batch_sizer.target_size == 1
+
+
+def test_batch_request_bytes():
+    small_request_bytes = get_batch_request_bytes({"url": "https://x/items", "json": {"fields": {}}})
+    large_request_bytes = get_batch_request_bytes({"url": "https://x/items", "json": {"fields": {"Title": "x" * 1000}}})
+    assert large_request_bytes - small_request_bytes > 1000
@@ -0,0 +1,46 @@
+import time
+import pytest
+import requests
+from office365_transport import (
+    Office365TransportConfig, get_deadline_at, get_remaining_time, check_wait_within_deadline,
+    sleep_within_deadline, is_retryable_transport_error
+)
+
+
+def test_deadline_is_the_earliest_one():
+    assert get_deadline_at(100) is None
+    assert get_deadline_at(100, operation_deadline=30) == 130
+    assert get_deadline_at(100, operation_deadline=30, deadline_at=120) == 120
+    assert get_deadline_at(100, operation_deadline=30, deadline_at=150) == 130
+    assert get_deadline_at(100, deadline_at=150) == 150
+
+
+def test_remaining_time():
+    assert get_remaining_time(None) is None
+    assert 9 < get_remaining_time(time.monotonic() + 10) <= 10
+    with pytest.raises(Exception, match="Deadline exceeded"):
+        get_remaining_time(time.monotonic() - 1, context="GET items")
+
+
+def test_waits_longer_than_the_deadline_are_refused():
+    check_wait_within_deadline(100, None)
+    check_wait_within_deadline(1, time.monotonic() + 10)
+    with pytest.raises(Exception, match="to wait before retrying"):
+        check_wait_within_deadline(30, time.monotonic() + 10)
+    with pytest.raises(Exception):
+        sleep_within_deadline(30, time.monotonic() + 10)
+
+
+def test_timeouts_are_shortened_by_the_deadline():
+    transport_config = Office365TransportConfig(connect_timeout=10, read_timeout=60)
+    assert transport_config.get_timeout() == (10, 60)
+    assert transport_config.get_timeout(remaining_time=5) == (5, 5)
+
+
+def test_retryable_transport_errors():
+    assert is_retryable_transport_error(requests.exceptions.ConnectTimeout(), "POST")
+    assert is_retryable_transport_error(requests.exceptions.ReadTimeout(), "PUT")
+    assert is_retryable_transport_error(requests.exceptions.ConnectionError(), "get")
+    assert not is_retryable_transport_error(requests.exceptions.ReadTimeout(), "POST")
+    assert not is_retryable_transport_error(requests.exceptions.ConnectionError(), "PATCH")
+    assert not is_retryable_transport_error(requests.exceptions.InvalidURL(), "GET")
@@ -0,0 +1,155 @@
+import io
+import pytest
+import office365_drive
+from office365_drive import Office365Drive
+from office365_upload import Office365UploadSource, Office365UploadJournal, get_next_expected_offset
+
+
+CONTENT = b"0123456789abcdefghij"
+
+
+class NonSeekableStream(object):
+    def __init__(self, content):
+        self.stream = io.BytesIO(content)
+
+    def read(self, size):
+        return self.stream.read(size)
+
+
+def read_chunks(upload_source, chunk_size, offset=0):
+    return [(chunk_offset, bytes(chunk)) for chunk_offset, chunk in upload_source.get_next_chunk(chunk_size, offset)]
+
+
+def test_bytes_are_cut_in_chunks():
+    with Office365UploadSource(CONTENT) as upload_source:
+        assert upload_source.file_size == 20
+        assert read_chunks(upload_source, 8) == [(0, b"01234567"), (8, b"89abcdef"), (16, b"ghij")]
+
+
+def test_file_path_is_mapped(tmp_path):
+    file_path = tmp_path / "file.bin"
+    file_path.write_bytes(CONTENT)
+    with Office365UploadSource(str(file_path)) as upload_source:
+        assert upload_source.file_size == 20
+        assert b"".join(chunk for _, chunk in read_chunks(upload_source, 7)) == CONTENT
+
+
+def test_open_file_starts_at_its_current_position(tmp_path):
+    file_path = tmp_path / "file.bin"
+    file_path.write_bytes(CONTENT)
+    with open(str(file_path), "rb") as file:
+        file.seek(10)
+        with Office365UploadSource(file) as upload_source:
+            assert read_chunks(upload_source, 8) == [(0, b"abcdefgh"), (8, b"ij")]
+
+
+def test_stream_size_is_found_when_seekable():
+    with Office365UploadSource(io.BytesIO(CONTENT)) as upload_source:
+        assert upload_source.file_size == 20
+        assert read_chunks(upload_source, 8) == [(0, b"01234567"), (8, b"89abcdef"), (16, b"ghij")]
+
+
+def test_iterator_chunks_do_not_follow_its_items():
+    upload_source = Office365UploadSource(iter([b"012", b"3456789abc", b"defghij"]), file_size=20)
+    assert read_chunks(upload_source, 8) == [(0, b"01234567"), (8, b"89abcdef"), (16, b"ghij")]
+
+
+def test_resuming_skips_the_bytes_already_uploaded():
+    for source in [CONTENT, io.BytesIO(CONTENT), NonSeekableStream(CONTENT), iter([CONTENT[:5], CONTENT[5:]])]:
+        with Office365UploadSource(source, file_size=20) as upload_source:
+            assert read_chunks(upload_source, 8, offset=12) == [(12, b"cdefghij")]
+
+
+def test_size_is_required_for_iterators_and_non_seekable_streams():
+    with pytest.raises(Exception):
+        Office365UploadSource(iter([CONTENT]))
+    with pytest.raises(Exception):
+        Office365UploadSource(NonSeekableStream(CONTENT))
+
+
+def test_short_source_is_an_error():
+    upload_source = Office365UploadSource(iter([CONTENT]), file_size=30)
+    with pytest.raises(Exception):
+        read_chunks(upload_source, 8)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, json_response=None):
+        self.status_code = status_code
+        self.json_response = json_response or {}
+        self.url = "https://upload.test/session"
+        self.content = b""
+
+    def json(self):
+        return self.json_response
+
+
+class FakeUploadSession(object):
+    """
+    Answers the chunk PUTs with the given statuses, and the upload session GETs with next_offset.
+    """
+    def __init__(self, statuses, next_offset=None):
+        self.statuses = list(statuses)
+        self.next_offset = next_offset
+        self.content_ranges = []
+
+    def request(self, **kwargs):
+        if kwargs.get("method") == "GET":
+            return FakeResponse(200, {"nextExpectedRanges": ["{}-".format(self.next_offset)]})
+        self.content_ranges.append(kwargs.get("headers").get("Content-Range"))
+        return FakeResponse(self.statuses.pop(0))
+
+
+def get_drive(monkeypatch, statuses, next_offset=None):
+    monkeypatch.setattr(office365_drive.time, "sleep", lambda wait_time: None)
+    return Office365Drive(FakeUploadSession(statuses, next_offset=next_offset), "drive")
+
+
+def test_chunk_is_resent_from_the_next_expected_byte(monkeypatch):
+    drive = get_drive(monkeypatch, [503, 202], next_offset=14)
+    response = drive.write_chunk_with_retries("https://upload.test/session", memoryview(CONTENT[10:]), 10, 20)
+    assert response.status_code == 202
+    assert drive.session.content_ranges == ["bytes 10-19/20", "bytes 14-19/20"]
+
+
+def test_chunk_received_despite_the_error_is_not_resent(monkeypatch):
+    drive = get_drive(monkeypatch, [500], next_offset=20)
+    assert drive.write_chunk_with_retries("https://upload.test/session", memoryview(CONTENT[10:]), 10, 20) is None
+    assert drive.session.content_ranges == ["bytes 10-19/20"]
+
+
+def test_range_mismatch_is_retried(monkeypatch):
+    drive = get_drive(monkeypatch, [416, 202], next_offset=12)
+    drive.write_chunk_with_retries("https://upload.test/session", memoryview(CONTENT[10:]), 10, 20)
+    assert drive.session.content_ranges == ["bytes 10-19/20", "bytes 12-19/20"]
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    drive = get_drive(monkeypatch, [404, 202], next_offset=10)
+    with pytest.raises(Exception):
+        drive.write_chunk_with_retries("https://upload.test/session", memoryview(CONTENT[10:]), 10, 20)
+    assert len(drive.session.content_ranges) == 1
+
+
+def test_journal_keeps_the_upload_state(tmp_path):
+    journal = Office365UploadJournal(str(tmp_path / "journal.json"))
+    assert journal.load("drive/parent/file.bin", 20) is None
+    journal.save("drive/parent/file.bin", 20, "https://upload.test/session", 0, "2999-01-01T00:00:00.0000000Z")
+    upload_state = journal.load("drive/parent/file.bin", 20)
+    journal.update_offset(upload_state, 8)
+    assert journal.load("drive/parent/file.bin", 20).get("offset") == 8
+    assert journal.load("drive/parent/other.bin", 20) is None
+    assert journal.load("drive/parent/file.bin", 30) is None
+    journal.delete()
+    assert journal.load("drive/parent/file.bin", 20) is None
+
+
+def test_journal_ignores_expired_sessions(tmp_path):
+    journal = Office365UploadJournal(str(tmp_path / "journal.json"))
+    journal.save("drive/parent/file.bin", 20, "https://upload.test/session", 8, "2000-01-01T00:00:00Z")
+    assert journal.load("drive/parent/file.bin", 20) is None
+
+
+def test_next_expected_offset():
+    assert get_next_expected_offset({"nextExpectedRanges": ["12-19", "25-"]}) == 12
+    assert get_next_expected_offset({"nextExpectedRanges": []}) is None
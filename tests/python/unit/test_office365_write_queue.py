@@ -0,0 +1,97 @@
+import time
+import pytest
+import office365_write_queue
+from office365_auth import Office365Auth
+from office365_throttling import Office365BatchSizer
+from office365_write_queue import Office365ListWriteQueue, get_list_write_queue
+from sharepoint_constants import SharePointConstants
+
+
+class FakeQueueSession(object):
+    """
+    Answers every row of a $batch with 201, except the rows whose Title is in failed_titles.
+    """
+    def __init__(self, identity="tenant/user/app", failed_titles=None):
+        self.identity = identity
+        self.failed_titles = failed_titles or []
+        self.batch_sizer = Office365BatchSizer(initial_size=20, max_size=20)
+        self.batches = []
+
+    def get_credentials_identity(self):
+        return self.identity
+
+    def get_deadline_at(self, started_at):
+        return None
+
+    def send_batch(self, requests_buffer, deadline_at=None):
+        self.batches.append(requests_buffer)
+        responses = []
+        for request_kwargs in requests_buffer:
+            title = request_kwargs.get("json").get("fields").get("Title")
+            if title in self.failed_titles:
+                responses.append({"status": 400, "body": {"error": {"message": "Invalid"}}})
+            else:
+                responses.append({"status": 201, "body": {"id": title}})
+        return responses
+
+
+class FakeQueueList(object):
+    def __init__(self, session, list_id="list-id"):
+        self.session = session
+        self.list_id = list_id
+
+    def get_next_list_row_url(self):
+        return "https://graph.microsoft.com/v1.0/sites/site-id/lists/{}/items".format(self.list_id)
+
+
+@pytest.fixture
+def write_queues(monkeypatch):
+    monkeypatch.setattr(office365_write_queue, "LIST_WRITE_QUEUES", {})
+    monkeypatch.setattr(SharePointConstants, "WRITE_QUEUE_IDLE_TIMEOUT_SEC", 0.05)
+    return office365_write_queue.LIST_WRITE_QUEUES
+
+
+def test_rows_written_together_share_a_batch():
+    session = FakeQueueSession(failed_titles=["b"])
+    write_queue = Office365ListWriteQueue(FakeQueueList(session), linger=0.1)
+    futures = [write_queue.write_row({"Title": title}) for title in ["a", "b", "c"]]
+    assert futures[0].result(timeout=5) == {"id": "a"}
+    assert futures[2].result(timeout=5) == {"id": "c"}
+    with pytest.raises(Exception):
+        futures[1].result(timeout=5)
+    assert len(session.batches) == 1
+
+
+def test_full_batch_is_sent_without_lingering():
+    session = FakeQueueSession()
+    session.batch_sizer = Office365BatchSizer(initial_size=2, max_size=2)
+    write_queue = Office365ListWriteQueue(FakeQueueList(session), linger=60)
+    futures = [write_queue.write_row({"Title": title}) for title in ["a", "b"]]
+    assert [future.result(timeout=5) for future in futures] == [{"id": "a"}, {"id": "b"}]
+
+
+def test_queues_are_shared_per_list_and_credentials(write_queues):
+    session = FakeQueueSession()
+    write_queue = get_list_write_queue(FakeQueueList(session))
+    assert get_list_write_queue(FakeQueueList(session)) is write_queue
+    assert get_list_write_queue(FakeQueueList(FakeQueueSession(identity="tenant/other/app"))) is not write_queue
+    assert get_list_write_queue(FakeQueueList(session, list_id="other-list")) is not write_queue
+
+
+def test_idle_queues_leave_the_registry(write_queues):
+    write_queue = get_list_write_queue(FakeQueueList(FakeQueueSession()))
+    write_queue.linger = 0.01
+    write_queue.write_row({"Title": "a"}).result(timeout=5)
+    deadline = time.monotonic() + 5
+    while write_queues and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert write_queues == {}
+    assert write_queue.write_row({"Title": "b"}).result(timeout=5) == {"id": "b"}
+
+
+def test_opaque_token_identity_survives_renewals():
+    auth = Office365Auth(access_token="opaque-1", token_provider=lambda: "opaque-2", identity="sharepoint-connection")
+    assert auth.get_identity() == "sharepoint-connection"
+    auth.refresh_access_token("opaque-1")
+    assert auth.get_identity() == "sharepoint-connection"
+    assert Office365Auth(access_token="opaque-1").get_identity() != Office365Auth(access_token="opaque-2").get_identity()